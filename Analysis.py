@@ -0,0 +1,127 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+import Export
+from Data_processing import Calibration, HillFit, r2_score
+from Electrode import Electrode
+from Process_CH_data import import_CH_files, read_concentration_file
+
+logger = logging.getLogger("SwiftMote")
+
+# Headless analysis API, used by swiftmote.py and usable from scripts or worker processes: nothing here imports
+# tkinter or a GUI backend of matplotlib. Functions log their errors to the "SwiftMote" logger and return None
+# (or an empty result) instead of opening dialogs.
+
+def import_ch(data_path: str, data_folder: str, test_type: str = "SWV", concentration_file: str = None,
+              max_workers: int = None):
+    """Imports a folder of CH Instruments files into the electrodes of data_folder, like Load CH data in the GUI.
+    Titrations need the concentration file. Returns the electrodes by name, None on error"""
+    try:
+        if not os.path.isdir(data_path):
+            logger.error(f"{data_path} is not a folder")
+            return None
+        concentration_list = None
+        if test_type == "Titration":
+            if concentration_file is None:
+                logger.error("Titrations need a concentration file")
+                return None
+            concentration_list = read_concentration_file(concentration_file)
+        os.makedirs(data_folder, exist_ok=True)
+        return import_CH_files(data_path, data_folder, test_type, concentration_list, max_workers, log=logger.info)
+    except Exception:
+        logger.exception(f"Could not import {data_path}")
+        return None
+
+
+def load_electrodes(data_folder: str, names: list = None) -> dict:
+    """Electrodes saved in data_folder by name, all of them if names is None. Unreadable ones are logged and skipped"""
+    if names is None:
+        names = [name for name in sorted(os.listdir(data_folder)) if os.path.isfile(os.path.join(data_folder, name))]
+    electrodes = {}
+    for name in names:
+        if not os.path.isfile(os.path.join(data_folder, name)):
+            logger.error(f"No electrode {name} in {data_folder}")
+            continue
+        try:
+            electrodes[name] = Electrode.load(data_folder, name)
+        except Exception:
+            logger.exception(f"Could not load electrode {name} from {data_folder}")
+    return electrodes
+
+
+def get_titration_curve(df: pd.DataFrame):
+    """Concentrations and peak gains in % relative to the first scan, as on the titration graph"""
+    return df["concentration"].to_numpy(dtype=float), Calibration.normalize(df["peak_current"].to_numpy(dtype=float))
+
+
+def fit_titration(df: pd.DataFrame, hill: bool = True, concentration_range: tuple = None, n_resamples: int = 0):
+    """Fits the titration curve of a test DataFrame between the concentrations of concentration_range (inclusive).
+    Returns a dict with the Calibration, its R², the fitted points and the fit curve, None if the fit failed.
+    With n_resamples, a Hill fit also gets "intervals": the bootstrap intervals of HillFit.confidence_intervals,
+    and its Calibration the refits giving the intervals of the concentrations"""
+    try:
+        concentration, gain = get_titration_curve(df)
+        selected = np.isfinite(concentration) & np.isfinite(gain)
+        if concentration_range is not None:
+            selected &= (concentration_range[0] <= concentration) & (concentration <= concentration_range[1])
+        if hill:
+            selected &= concentration > 0  # the Hill fit works on a log scale
+        order = np.argsort(concentration[selected], kind="stable")
+        concentration, gain = concentration[selected][order], gain[selected][order]
+        if len(concentration) < (4 if hill else 2):
+            logger.error(f"Not enough titration points to fit: {len(concentration)}")
+            return None
+        if hill:
+            hf = HillFit(concentration, gain)
+            hf.fitting()
+            if not hasattr(hf, "params"):
+                logger.error("The Hill fit did not converge")
+                return None
+            intervals = hf.confidence_intervals(n_resamples) if n_resamples else None
+            calibration = Calibration.from_hill(hf)
+            fit = (hf.x_fit, hf.y_fit)
+            r_2 = r2_score(gain, hf._equation(concentration, *hf.params))  # at the data, y_fit is on a log grid
+        else:
+            coefs = np.polyfit(concentration, gain, 1)
+            calibration = Calibration.from_linear(coefs, concentration)
+            fit = (concentration, np.polyval(coefs, concentration))
+            r_2 = r2_score(gain, fit[1])
+            intervals = None
+        return {"calibration": calibration, "r_2": float(r_2), "concentration": concentration, "gain": gain,
+                "fit": fit, "intervals": intervals}
+    except Exception:
+        logger.exception("Could not fit the titration")
+        return None
+
+
+def get_export_columns(columns: list = None):
+    """Parameters to export by test type, as Export.get_tables expects them"""
+    if columns is None:
+        return None
+    columns = [name for name in columns if name not in Export.default_excluded]
+    return {test_type: columns for test_type in Export.export_files}
+
+
+def get_export_tables(electrodes: dict, columns: list = None, calibration: Calibration = None) -> dict:
+    """Tables of the export of the GUI by test type: a column per electrode and parameter.
+    columns selects the parameters (all of them by default), calibration fills the SWV concentration"""
+    tables = Export.get_tables(electrodes, get_export_columns(columns), calibration)
+    return {test_type: table.get_chunk(0, len(table)) for test_type, table in tables.items()}
+
+
+def export_csv(electrodes: dict, output_folder: str, columns: list = None, calibration: Calibration = None,
+               file_format: str = "csv") -> dict:
+    """Writes titration, lovric and voltammogram files to output_folder for the tests with data, in one of
+    Export.formats. Returns the paths written by test type, an empty dict on error"""
+    try:
+        paths = Export.export(electrodes, output_folder, get_export_columns(columns), calibration, file_format)
+        if not paths:
+            logger.warning("No data to export")
+            return {}
+        for test_type, path in paths.items():
+            logger.info(f"{test_type} saved to {path}")
+        return paths
+    except Exception:
+        logger.exception(f"Could not export to {output_folder}")
+        return {}
@@ -0,0 +1,197 @@
+import itertools
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, BrokenExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable
+import Export
+from Data_processing import extract_gains, get_executor
+from Fit_cache import fit_hill
+from Process_CH_data import import_CH_files
+from Utils import debug
+
+
+@dataclass
+class Job:
+    """Work submitted to the AnalysisExecutor"""
+    id: int
+    kind: str  # key of AnalysisExecutor.kinds
+    key: str = None  # a newer job with the same key makes this one stale, its result is dropped
+    on_done: Callable = None  # on_done(JobResult), called on the UI thread by AnalysisExecutor.poll()
+    submitted: float = 0.0
+
+
+@dataclass
+class JobResult:
+    job: Job
+    value: Any = None
+    error: BaseException = None  # raised by the job, value is None then
+    elapsed: float = 0.0  # seconds from submission to completion
+
+
+class AnalysisExecutor:
+    """Runs the analysis away from the Tk thread and hands finished results back to it.
+
+    Computations (gain extraction, Hill fits) run in the process pool of Data_processing, so they don't hold the
+    GIL of the app. Imports and exports, which mostly wait on files and already split their parsing or writing,
+    run in threads. Results are queued as they finish and the UI thread consumes them with poll(), within a time
+    budget per frame: it never computes, it only draws what is done. Jobs submitted with the same key supersede
+    each other, e.g. the fit of the titration range the user selected last is the only one drawn."""
+    kinds = {"gains": ("process", extract_gains),  # (voltages, currents) -> dict of extract_gains
+             "hill": ("process", fit_hill),  # (concentration, gain, p0, reverse) -> HillFit
+             "import": ("thread", import_CH_files),  # (data path, data folder, test type, ...) -> electrodes
+             "export": ("thread", Export.export)}  # (electrodes, output folder, ...) -> paths or None
+
+    def __init__(self, threads: int = 2, on_log=print):
+        self.on_log = on_log  # shows the messages of log() on the UI thread
+        self.results = queue.SimpleQueue()  # JobResult or message of log(), in completion order
+        self.pending = {}  # id -> Job submitted and not yet handed to the UI thread
+        self.stats = {"submitted": 0, "completed": 0, "stale": 0, "errors": 0, "deferred": 0}
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="Analysis")
+        self._ids = itertools.count(1)
+        self._latest = {}  # key -> id of the newest job with this key
+
+    def _get_pool(self, kind: str):
+        where, function = self.kinds[kind]
+        return (get_executor() if where == "process" else self._threads), function
+
+    def submit(self, kind: str, *args, key: str = None, on_done: Callable = None, **kwargs) -> Job:
+        """Starts a job of a kind of kinds with the arguments of its function, returns at once"""
+        pool, function = self._get_pool(kind)
+        job = Job(next(self._ids), kind, key, on_done, time.perf_counter())
+        if key is not None:
+            self._latest[key] = job.id
+        self.pending[job.id] = job
+        self.stats["submitted"] += 1
+        pool.submit(function, *args, **kwargs).add_done_callback(lambda future: self._finished(job, future))
+        return job
+
+    def _finished(self, job: Job, future):  # called by a thread of the pool
+        try:
+            result = JobResult(job, value=future.result())
+        except BaseException as e:
+            result = JobResult(job, error=e)
+        result.elapsed = time.perf_counter() - job.submitted
+        self.results.put(result)
+
+    def run(self, kind: str, *args, timeout: float = None, **kwargs):
+        """Runs a job and waits for its value, for threads that must not go on without it (e.g. acquisition)"""
+        pool, function = self._get_pool(kind)
+        return pool.submit(function, *args, **kwargs).result(timeout)
+
+    def get_gains(self, voltages: list, currents: list) -> dict:
+        """extract_gains in the process pool, in the calling thread if the pool is not available"""
+        try:
+            return self.run("gains", voltages, currents)
+        except (BrokenExecutor, RuntimeError):  # pool broken or shut down while closing
+            debug()
+            return extract_gains(voltages, currents)
+
+    def log(self, text: str):
+        """Thread-safe print for the jobs, the message is shown by on_log on the UI thread"""
+        self.results.put(str(text))
+
+    def is_stale(self, job: Job) -> bool:
+        return job.key is not None and self._latest.get(job.key) != job.id
+
+    def poll(self, deadline: float = None) -> int:
+        """Hands finished jobs to their on_done, on the calling (UI) thread, until deadline (a time.perf_counter()
+        value), the others wait for the next frame. At least one result is handled per call. Returns the number
+        of results handled"""
+        handled = 0
+        while True:
+            if handled and deadline is not None and time.perf_counter() >= deadline:
+                if not self.results.empty():
+                    self.stats["deferred"] += 1
+                return handled
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return handled
+            handled += 1
+            if isinstance(result, str):
+                self.on_log(result)
+                continue
+            job = self.pending.pop(result.job.id, result.job)
+            if self.is_stale(job):
+                self.stats["stale"] += 1
+                continue
+            if job.key is not None:
+                self._latest.pop(job.key, None)
+            self.stats["completed"] += 1
+            if result.error is not None:
+                self.stats["errors"] += 1
+                if job.on_done is None:
+                    self.on_log(f"{job.kind} failed: {result.error}")
+            try:
+                if job.on_done is not None:
+                    job.on_done(result)
+            except Exception as e:
+                debug()
+                self.on_log(e)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+class FrameBudget:
+    """Time spent on the UI thread per frame, by stage.
+
+    start() begins a frame and returns its deadline, after which work that can wait (e.g. AnalysisExecutor.poll)
+    is left for the next frame. should_run(stage) tells if an optional stage (e.g. the plot redraw) still fits in
+    the frame, it is deferred otherwise, at most max_deferrals frames in a row. measure(stage) times a part of the
+    frame, end() closes it and counts the frames over budget. get_stats() gives the count, mean and maximum time of
+    each stage in ms and the frames each optional stage was deferred."""
+
+    def __init__(self, budget: float = 0.010, max_deferrals: int = 6):
+        self.budget = budget
+        self.max_deferrals = max_deferrals
+        self.frames = 0
+        self.over_budget = 0
+        self.stages = {}  # stage -> [count, total seconds, max seconds]
+        self.deferred = {}  # optional stage -> frames it was deferred
+        self._deferrals = {}  # optional stage -> frames it was deferred in a row
+        self._start = None
+
+    def start(self) -> float:
+        self._start = time.perf_counter()
+        return self._start + self.budget
+
+    def should_run(self, stage: str) -> bool:
+        """True if the frame deadline has not passed, or stage was already deferred max_deferrals frames in a row"""
+        if time.perf_counter() < self._start + self.budget or self._deferrals.get(stage, 0) >= self.max_deferrals:
+            self._deferrals[stage] = 0
+            return True
+        self._deferrals[stage] = self._deferrals.get(stage, 0) + 1
+        self.deferred[stage] = self.deferred.get(stage, 0) + 1
+        return False
+
+    def record(self, stage: str, elapsed: float):
+        stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def end(self) -> float:
+        """Closes the frame, returns its duration in seconds"""
+        elapsed = time.perf_counter() - self._start
+        self.frames += 1
+        if elapsed > self.budget:
+            self.over_budget += 1
+        self.record("frame", elapsed)
+        return elapsed
+
+    def get_stats(self) -> dict:
+        return {"budget_ms": self.budget * 1000, "frames": self.frames, "over_budget": self.over_budget,
+                "deferred": dict(self.deferred),
+                **{stage: {"count": count, "mean_ms": total / count * 1000, "max_ms": longest * 1000}
+                   for stage, (count, total, longest) in self.stages.items()}}
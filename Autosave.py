@@ -0,0 +1,215 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+from contextlib import nullcontext
+from Electrode import Electrode
+from Utils import debug
+
+
+class AutosaveJournal:
+    """Append-only, crash-safe file of records.
+
+    Each record is a header (magic, payload length, CRC-32 of the payload) followed by a pickled payload, and every
+    append is fsync'd. A record torn by a crash fails its length or checksum: reading stops there and recover()
+    truncates the file to the last valid record. rewrite() replaces the whole file atomically."""
+    magic = b"SMJ1"
+    header = struct.Struct("<4sII")
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filepath)), exist_ok=True)
+            self._file = open(self.filepath, "ab")
+        return self._file
+
+    def encode(self, record) -> bytes:
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        return self.header.pack(self.magic, len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, records: list) -> int:
+        """Appends records and waits until they are on disk, returns the number of bytes written"""
+        if not records:
+            return 0
+        data = b"".join(self.encode(record) for record in records)
+        f = self._open()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return len(data)
+
+    def read(self):
+        """Returns (valid records in order, length of the valid part of the file)"""
+        if not os.path.isfile(self.filepath):
+            return [], 0
+        with open(self.filepath, "rb") as f:
+            data = f.read()
+        records = []
+        position = 0
+        while position + self.header.size <= len(data):
+            magic, length, checksum = self.header.unpack_from(data, position)
+            payload = data[position + self.header.size:position + self.header.size + length]
+            if magic != self.magic or len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            try:
+                records.append(pickle.loads(payload))
+            except Exception:
+                break
+            position += self.header.size + length
+        return records, position
+
+    def recover(self) -> list:
+        """Valid records of the journal, a torn or corrupted tail is cut off so new records follow valid ones"""
+        self.close()
+        records, length = self.read()
+        if os.path.isfile(self.filepath) and os.path.getsize(self.filepath) != length:
+            with open(self.filepath, "r+b") as f:
+                f.truncate(length)
+                os.fsync(f.fileno())
+        return records
+
+    def rewrite(self, records: list):
+        """Replaces the journal with records: written to a temporary file, fsync'd, then renamed over the journal"""
+        self.close()
+        temporary = self.filepath + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(b"".join(self.encode(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.filepath)
+        try:  # makes the rename durable, not supported on Windows
+            folder = os.open(os.path.dirname(os.path.abspath(self.filepath)), os.O_RDONLY)
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+        except OSError:
+            pass
+
+    def size(self) -> int:
+        return os.path.getsize(self.filepath) if os.path.isfile(self.filepath) else 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Autosave:
+    """Journals the scans that are not in the electrode stores yet, so a crash loses none of them.
+
+    Electrodes write their scans to their ExperimentStore when saved (after every scan run by the DeviceManager),
+    the journal covers the scans added since: each checkpoint() appends only the rows of Test.unsaved it has not
+    journaled yet. Records of rows that reached the store are dropped by compaction, which rewrites the journal
+    with the rows still unsaved once it exceeds compact_bytes, and simply empties it when every row is saved.
+    recover() puts the journaled rows missing from the stores back into their electrodes when the app starts."""
+
+    def __init__(self, filepath: str, compact_bytes: int = 64 * 2 ** 20):
+        self.journal = AutosaveJournal(filepath)
+        self.compact_bytes = compact_bytes
+        self.journaled = set()  # (electrode, experiment, test, index, time) of the rows in the journal
+        self.stats = {"checkpoints": 0, "records": 0, "bytes": 0, "compactions": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_unsaved(electrodes: dict, get_lock=None) -> dict:
+        """(electrode, experiment, test, index, time) -> (test, index) of every row not in a store yet.
+        get_lock(electrode name) returns the lock held while the electrode is saved: a row popped from Test.unsaved
+        by a save is then seen either here or in the store, never in neither"""
+        unsaved = {}
+        for electrode in list(electrodes.values()):
+            with get_lock(electrode.name) if get_lock is not None else nullcontext():
+                unsaved.update(Autosave._get_unsaved(electrode))
+        return unsaved
+
+    @staticmethod
+    def _get_unsaved(electrode) -> dict:
+        unsaved = {}
+        for experiment_name, tests in list(electrode.experiments.items()):
+            for test_type, test in tests.items():
+                if test._results is None:  # results not loaded, nothing was added
+                    continue
+                for index in list(test.unsaved):
+                    if index in test.results:
+                        key = (electrode.name, experiment_name, test_type, index,
+                               float(test.results.row(index)["time"]))
+                        unsaved[key] = (test, index)
+        return unsaved
+
+    @staticmethod
+    def get_record(key: tuple, test, index: int) -> dict:
+        electrode_name, experiment_name, test_type = key[:3]
+        return {"electrode": electrode_name, "experiment": experiment_name, "test": test_type, "index": index,
+                "row": test.get_row(index)}
+
+    def checkpoint(self, electrodes: dict, get_lock=None) -> int:
+        """Journals the rows added since the last checkpoint, compacts when needed. Returns the records written"""
+        with self._lock:
+            unsaved = self.get_unsaved(electrodes, get_lock)
+            self.stats["checkpoints"] += 1
+            if not unsaved:
+                if self.journaled or self.journal.size():
+                    self.journal.rewrite([])  # every journaled row is in a store
+                    self.journaled = set()
+                    self.stats["compactions"] += 1
+                return 0
+            if self.journal.size() > self.compact_bytes and not self.journaled.issubset(unsaved):
+                # some journaled rows reached a store since, the journal is rewritten with the unsaved ones only
+                self.journal.rewrite([self.get_record(key, *value) for key, value in unsaved.items()])
+                self.journaled = set(unsaved)
+                self.stats["compactions"] += 1
+                self.stats["records"] += len(unsaved)
+                return len(unsaved)
+            new = [key for key in unsaved if key not in self.journaled]
+            self.stats["bytes"] += self.journal.append([self.get_record(key, *unsaved[key]) for key in new])
+            self.journaled.update(new)
+            self.stats["records"] += len(new)
+            return len(new)
+
+    def recover(self, electrodes: dict, data_path: str, log=print) -> int:
+        """Adds the journaled rows missing from the stores to their electrodes (loaded into electrodes if needed),
+        saves them, then empties the journal. Returns the number of rows recovered"""
+        with self._lock:
+            records = self.journal.recover()
+            if not records:
+                return 0
+            latest = {}  # the last record of a row wins, the index may have been rewritten by a newer scan
+            for record in records:
+                latest[(record["electrode"], record["experiment"], record["test"], record["index"])] = record
+            recovered = 0
+            changed = {}
+            for (electrode_name, experiment_name, test_type, index), record in latest.items():
+                try:
+                    electrode = electrodes.get(electrode_name)
+                    if electrode is None:
+                        if os.path.isfile(os.path.join(data_path, electrode_name)):
+                            electrode = Electrode.load(data_path, electrode_name)
+                        else:
+                            electrode = Electrode(electrode_name)
+                        electrodes[electrode_name] = electrode
+                    if experiment_name not in electrode.get_experiments():
+                        electrode.create_experiment(experiment_name)
+                    test = electrode.get_tests(experiment_name)[test_type]
+                    if index in test.results and float(test.get_row(index)["time"]) == float(record["row"]["time"]):
+                        continue  # already in the store
+                    test.results.add(index, record["row"])
+                    test.unsaved.append(index)
+                    changed[electrode_name] = electrode
+                    recovered += 1
+                except Exception:
+                    debug()
+                    log(f"Could not recover scan {index} of {electrode_name} {experiment_name} {test_type}")
+            for electrode in changed.values():
+                electrode.save(data_path)
+            self.journal.rewrite([])
+            self.journaled = set()
+            if recovered:
+                log(f"Recovered {recovered} scans from the autosave journal into {', '.join(changed)}")
+            return recovered
+
+    def close(self):
+        self.journal.close()
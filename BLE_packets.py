@@ -0,0 +1,322 @@
+import collections
+import datetime
+import time
+import numpy as np
+
+time_origin = datetime.datetime(year=2000, month=1, day=1, tzinfo=datetime.timezone.utc)
+
+
+def get_time_us(hour: int, minute: int, second: int, fraction: int) -> int:
+    """Microseconds since midnight of a packet time, the fraction byte counts down 256ths of a second"""
+    # round(1e6 * (2**8 - fraction - 1) / (2**8 + 1)) in integers, the ratio is never exactly .5
+    return ((hour * 60 + minute) * 60 + second) * 1000000 + (2000000 * (255 - fraction) + 257) // 514
+
+
+class Packet:
+    transaction_number_bytes = 1  # use 1 byte to represent transaction field
+    packet_number_bytes = 1  # use 1 byte to represent packet field
+    time_number_bytes = 4  # 4*1-byte fields represent time: hours, minutes, seconds, microseconds
+    metadata_length_total_bytes = transaction_number_bytes + packet_number_bytes + time_number_bytes
+    datapoint_length_bytes = 2  # each data point is 2 bytes
+
+    def __init__(self, data: bytearray, time_delivered):
+        """Parse packet, datapoints are a read-only view of data, which must not be modified afterwards"""
+        self.data = data
+        self.time_delivered = time_delivered
+
+        self.transaction_number = data[0]
+        self.packet_number = data[1]
+        # transmit only 24 hours of time, year/month/date is not transmitted since experiment lasts only 6 hours,
+        # modify if longer interval is needed with no added jitter,
+        # but it is not required since overflow will lead to auto adjustment of offset
+        self.time_created_us = get_time_us(hour=data[5], minute=data[4], second=data[3], fraction=data[2])
+
+        number_of_datapoints = max((len(data) - self.metadata_length_total_bytes) // self.datapoint_length_bytes, 0)
+        self.datapoints = np.frombuffer(data, dtype='<u2', count=number_of_datapoints,
+                                        offset=self.metadata_length_total_bytes)
+
+    @property
+    def time_created(self) -> datetime.datetime:
+        """Time of creation on 2000-01-01 UTC, only built when asked for"""
+        return time_origin + datetime.timedelta(microseconds=self.time_created_us)
+
+    def get_datapoints(self) -> np.ndarray:
+        """Data load of the BLE packet"""
+        return self.datapoints
+
+
+class Transaction:
+    """One indivisible piece of useful data
+    2 modes of operation:
+    1) Size is known
+    2) Size is unknown
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.packets: {Packet} = {}
+        self.transaction_number = -1
+        self.finalized = False
+        self.first_arrival = None  # monotonic times, used by TransactionReassembler
+        self.last_arrival = None
+        self.gap_mask = None  # True for datapoints of missing packets, set by get_joined_data
+
+    def insert(self, packet: Packet, arrival: float = None) -> bool:
+        """Adds a packet in any order, returns False for a duplicate"""
+        if packet.packet_number in self.packets:
+            return False
+        if self.transaction_number == -1:
+            self.transaction_number = packet.transaction_number
+            self.first_arrival = arrival
+        self.packets[packet.packet_number] = packet
+        self.last_arrival = arrival
+        return True
+
+    def is_complete(self) -> bool:
+        return self.size != 0 and all(i in self.packets for i in range(self.size))
+
+    def finalize(self, size: int = 0):
+        """Closes the transaction, size is the expected number of packets, or the highest received one if unknown"""
+        self.size = max(size, max(self.packets) + 1 if self.packets else 0)
+        self.finalized = True
+
+    def get_missing_packets(self) -> list:
+        return [i for i in range(self.size) if i not in self.packets]
+
+    def add_packet(self, data: bytearray, time_delivered):
+        if self.finalized:
+            # self.print("Error, this transaction is already finalized")
+            return -1
+
+        packet = Packet(data=data, time_delivered=time_delivered)  # create a Packet object
+
+        if self.transaction_number == -1:
+            # self.print("First packet of new transaction received")
+            self.transaction_number = packet.transaction_number
+
+        if self.transaction_number == packet.transaction_number:
+            # self.print("Adding new packet")
+            if packet.packet_number not in self.packets:
+                self.packets[packet.packet_number] = packet
+            else:
+                self.print("Error, this packet was already received")
+                return -1
+        else:
+            if self.size != 0:  # if size is not set, estimate number of packets.
+                self.print("Transaction probably finished successfully")
+                self.finalized = True
+                self.size = len(self.packets)
+                self.print("Transaction size")
+                return -2
+            else:
+                self.print("Error, Transaction number is different, this should never happen")
+                return -1
+
+        if len(self.packets) == self.size:
+            self.print("Transaction finished successfully")
+            self.finalized = True
+            return 0
+        else:
+            return 1  # continue waiting for more packets
+
+    def get_joined_data(self):
+        """Datapoints of all packets in one preallocated array, without the trailing zeros.
+        Missing packets are filled with zeros, assuming they were as long as the longest received one,
+        and flagged in self.gap_mask"""
+        try:
+            if self.finalized:
+                packet_length = max(len(packet.get_datapoints()) for packet in self.packets.values())
+                datapoints = [self.packets[i].get_datapoints() if i in self.packets else None
+                              for i in range(self.size)]
+                lengths = [len(points) if points is not None else packet_length for points in datapoints]
+                all_datapoints = np.zeros(sum(lengths), dtype=np.uint16)
+                gap_mask = np.zeros(len(all_datapoints), dtype=bool)
+                position = 0
+                for points, length in zip(datapoints, lengths):
+                    if points is None:
+                        gap_mask[position:position + length] = True
+                    else:
+                        all_datapoints[position:position + length] = points
+                    position += length
+
+                # removes 0s at the end, hopefully it does not delete useful data
+                nonzero = np.flatnonzero(all_datapoints)
+                all_datapoints = all_datapoints[:nonzero[-1] + 1 if nonzero.size else 0]
+                self.gap_mask = gap_mask[:len(all_datapoints)]
+
+                self.print(all_datapoints)
+
+                return all_datapoints
+            else:
+                # self.print("Error, not finalized yet")
+                return None
+        except Exception:
+            return None
+
+    def get_times_of_delivery(self):
+        # should be in ascending order, but no checks are done
+        if self.finalized:
+            all_times_of_delivery = {}
+            for i, packet in self.packets.items():
+                all_times_of_delivery[i] = packet.time_delivered
+            return all_times_of_delivery
+        else:
+            # self.print("Error, not finalized yet")
+            return None
+
+    def get_min_time_of_transaction_delivery(self):
+        if self.finalized:
+            return min(self.get_times_of_delivery().values())
+        else:
+            return None
+
+    def get_times_of_packet_creation(self):  # for debugging
+        # should be in ascending order, but no checks are done
+        if self.finalized:
+            all_times_of_transmitting = {}
+            for i, packet in self.packets.items():
+                all_times_of_transmitting[i] = packet.time_created
+            return all_times_of_transmitting
+        else:
+            # self.print("Error, not finalized yet")
+            return None
+
+    def get_min_time_of_transaction_creation(self):
+        if self.finalized:
+            return time_origin + datetime.timedelta(
+                microseconds=min(packet.time_created_us for packet in self.packets.values()))
+        else:
+            return None
+
+    def print(self, all_datapoints):
+        pass
+
+
+class TransactionReassembler:
+    """Reassembles BLE packets into transactions when packets are reordered, duplicated or lost.
+
+    Up to window transactions are kept in flight at once, and they are emitted in transaction number order:
+    a complete transaction waits for the older ones still in flight. A transaction is emitted when it and every
+    older one are complete, when no packet arrived for timeout seconds (older ones go with it), or when it is
+    the oldest one and the window is full; incomplete transactions are emitted with the gap mask of their missing
+    packets. poll() must be called regularly so that timeouts fire when packets stop arriving.
+    If size (packets per transaction) is 0 it is estimated from the highest packet number received so far, which
+    only grows, and a transaction holding packets 0 to the estimate is complete once a newer transaction started."""
+
+    def __init__(self, size: int = 0, window: int = 4, timeout: float = 1.0, clock=time.monotonic):
+        self.size = size
+        self.estimated_size = 0  # highest packet number received + 1, used while size is 0
+        self.window = window
+        self.timeout = timeout
+        self.clock = clock
+        self.in_flight = {}  # transaction number -> Transaction
+        self.recently_emitted = collections.deque(maxlen=4 * window)  # late packets of these are not new transactions
+        self.last_transaction_number = None  # newest transaction number seen
+        self.counters = {"packets": 0,
+                         "duplicates": 0,
+                         "late": 0,  # packets of a transaction that was already emitted
+                         "reordered": 0,  # packets arriving after a higher packet number of their transaction
+                         "transactions": 0,
+                         "complete": 0,
+                         "partial": 0,
+                         "lost_packets": 0,
+                         "lost_transactions": 0,  # gaps in the transaction numbers
+                         "discarded": 0}  # transactions whose values fell in lost packets, see get_values
+        self.latencies = collections.deque(maxlen=1000)  # seconds from the first packet to the emission
+
+    def get_expected_size(self) -> int:
+        return self.size or self.estimated_size
+
+    def _get_age(self, number: int) -> int:
+        """Transactions started since this one, the transaction number is 1 byte and wraps around"""
+        return (self.last_transaction_number - number) % 256
+
+    def _is_complete(self, number: int, transaction: Transaction) -> bool:
+        if not transaction.is_complete():
+            return False
+        return self.size != 0 or number != self.last_transaction_number  # unknown size: a newer one started
+
+    def add_packet(self, data: bytearray, time_delivered) -> list:
+        """Adds a packet, returns the transactions emitted because of it or of a timeout, oldest first"""
+        now = self.clock()
+        packet = Packet(data=data, time_delivered=time_delivered)
+        number = packet.transaction_number
+        self.counters["packets"] += 1
+        emitted = self.poll(now)
+        transaction = self.in_flight.get(number)
+        if transaction is None:
+            if number in self.recently_emitted:
+                self.counters["late"] += 1
+                return emitted
+            if self.last_transaction_number is None or 0 < (number - self.last_transaction_number) % 256 < 128:
+                if self.last_transaction_number is not None:
+                    self.counters["lost_transactions"] += (number - self.last_transaction_number) % 256 - 1
+                self.last_transaction_number = number
+            elif self.counters["lost_transactions"]:  # older than the newest one, counted lost when it was skipped
+                self.counters["lost_transactions"] -= 1
+            transaction = Transaction(size=self.get_expected_size())
+            self.in_flight[number] = transaction
+        if packet.packet_number < max(transaction.packets, default=-1):
+            self.counters["reordered"] += 1
+        if not transaction.insert(packet, now):
+            self.counters["duplicates"] += 1
+        elif self.size == 0 and packet.packet_number >= self.estimated_size:
+            self.estimated_size = packet.packet_number + 1
+            for in_flight in self.in_flight.values():  # they need the new packets too
+                in_flight.size = self.estimated_size
+        return emitted + self._release(now)
+
+    def _release(self, now: float, through_age: int = None) -> list:
+        """Emits, oldest first, the transactions at least through_age old, then the oldest ones while the window
+        overflows or they are complete"""
+        emitted = []
+        while self.in_flight:
+            number = max(self.in_flight, key=self._get_age)
+            transaction = self.in_flight[number]
+            if (through_age is not None and self._get_age(number) >= through_age) or \
+                    len(self.in_flight) > self.window or self._is_complete(number, transaction):
+                emitted.append(self._emit(number, now))
+            else:
+                break
+        return emitted
+
+    def poll(self, now: float = None) -> list:
+        """Emits the transactions that received no packet for timeout seconds, with the older ones in flight"""
+        now = self.clock() if now is None else now
+        expired = [number for number, transaction in self.in_flight.items()
+                   if now - transaction.last_arrival >= self.timeout]
+        if not expired:
+            return []
+        return self._release(now, through_age=min(self._get_age(number) for number in expired))
+
+    def flush(self) -> list:
+        """Emits every transaction in flight"""
+        return self._release(self.clock(), through_age=0) if self.in_flight else []
+
+    def _emit(self, number: int, now: float) -> Transaction:
+        transaction = self.in_flight.pop(number)
+        transaction.finalize(self.get_expected_size())
+        self.recently_emitted.append(number)
+        missing = len(transaction.get_missing_packets())
+        self.counters["transactions"] += 1
+        self.counters["complete" if missing == 0 else "partial"] += 1
+        self.counters["lost_packets"] += missing
+        self.latencies.append(now - transaction.first_arrival)
+        return transaction
+
+    def get_values(self, transaction: Transaction, count: int):
+        """First count datapoints of an emitted transaction, None if one of them was in a lost packet (zero-filled
+        by get_joined_data), such transactions are counted as discarded"""
+        data = transaction.get_joined_data()
+        if data is None or len(data) < count or transaction.gap_mask[:count].any():
+            self.counters["discarded"] += 1
+            return None
+        return data[:count]
+
+    def get_stats(self) -> dict:
+        """Counters and reassembly latency in seconds (median and maximum of the last transactions)"""
+        latencies = np.array(self.latencies) if self.latencies else np.array([np.nan])
+        return {**self.counters,
+                "in_flight": len(self.in_flight),
+                "latency_p50": float(np.median(latencies)),
+                "latency_max": float(np.max(latencies))}
@@ -0,0 +1,399 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+
+default_history = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.json")
+default_scans = (100, 1000, 10000, 100000)
+default_points = (200, 1000, 4000)
+
+
+def make_dataset(scans: int, points: int, seed: int = 0):
+    """Reproducible synthetic titration: voltages (mV), currents (uA, one row per scan) and concentrations.
+    Each scan is a Gaussian peak on a sloped baseline with noise, its height follows a Hill response."""
+    rng = np.random.default_rng(seed)
+    voltages = np.linspace(-300.0, 100.0, points)
+    concentrations = np.logspace(-1, 3, scans)
+    heights = 1.0 + 0.5 * concentrations / (10.0 + concentrations)
+    centers = rng.normal(-150.0, 5.0, scans)
+    currents = np.empty((scans, points))
+    for start in range(0, scans, 1000):  # limits the temporary arrays
+        end = min(start + 1000, scans)
+        currents[start:end] = 1.0 + 0.001 * voltages + heights[start:end, None] * \
+            np.exp(-((voltages - centers[start:end, None]) / 40.0) ** 2 / 2) + \
+            rng.normal(0.0, 0.005, (end - start, points))
+    return voltages, currents, concentrations
+
+
+def get_peak_rss_mb() -> float:
+    """Peak resident memory of this process"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS, KiB on Linux
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+
+
+def quiet():
+    """extract_gains and the tests print on every scan"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def timed(function, calls) -> list:
+    """Seconds taken by function(call) for each call"""
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        function(call)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def get_sample(scans: int, samples: int) -> np.ndarray:
+    return np.linspace(0, scans - 1, min(scans, samples)).astype(int)
+
+
+def get_gains(voltages, currents, rows) -> list:
+    from Data_processing import extract_gains
+    gains = []
+    with quiet():
+        for row in rows:
+            try:
+                gains.append(extract_gains(voltages.tolist(), currents[row].tolist()))
+            except Exception:
+                gains.append(None)
+    return gains
+
+
+def make_test(voltages, currents, concentrations, samples: int):
+    """Titration with a result per scan, gains of a sample of scans are reused for the other ones"""
+    from Tests import Titration
+    prototypes = [gains for gains in get_gains(voltages, currents, get_sample(len(currents), samples)) if gains]
+    test = Titration()
+    voltage_list = voltages.tolist()
+    with quiet():
+        for row in range(len(currents)):
+            test.add_result(row, float(row), voltage_list, currents[row].tolist(), 25, float(concentrations[row]),
+                            prototypes[row % len(prototypes)])
+    return test
+
+
+#### Benchmarks ####
+# each one returns (latencies in seconds, items processed per latency, unit of the items)
+
+def bench_extract_gains(voltages, currents, concentrations, samples: int, repeats: int):
+    from Data_processing import extract_gains
+    voltage_list = voltages.tolist()
+    rows = [currents[row].tolist() for row in get_sample(len(currents), samples)]
+
+    def run(row):
+        try:
+            extract_gains(voltage_list, row)
+        except Exception:
+            pass
+
+    with quiet():
+        run(rows[0])  # untimed, imports scipy
+        return timed(run, rows), 1, "scans"
+
+
+def get_titration(voltages, currents, concentrations, size: int = 40):
+    """Concentrations and normalized peak gains of a titration of at most size points"""
+    rows = get_sample(len(currents), size)
+    gains = get_gains(voltages, currents, rows)
+    peaks = np.array([gain["peak current"] if gain else np.nan for gain in gains])
+    valid = np.isfinite(peaks)
+    return concentrations[rows][valid], (peaks[valid] / peaks[valid][0] - 1) * 100
+
+
+def bench_hill_fit(voltages, currents, concentrations, samples: int, repeats: int):
+    from Data_processing import HillFit
+    concentration, gain = get_titration(voltages, currents, concentrations)
+
+    def run(_):
+        HillFit(concentration, gain).fitting()
+
+    with quiet():
+        run(None)  # untimed, imports scipy
+        return timed(run, range(repeats)), 1, "fits"
+
+
+def bench_hill_bootstrap(voltages, currents, concentrations, samples: int, repeats: int):
+    from Data_processing import HillFit
+    concentration, gain = get_titration(voltages, currents, concentrations)
+    hf = HillFit(concentration, gain)
+
+    def run(_):
+        hf.confidence_intervals(1000, max_workers=1)
+
+    with quiet():
+        hf.fitting()
+        run(None)  # untimed, imports scipy
+        return timed(run, range(repeats)), 1000, "refits"
+
+
+def bench_add_result_store(voltages, currents, concentrations, samples: int, repeats: int):
+    """Storage part of add_result only: the gains are precomputed, as when they come from a worker process"""
+    from Tests import Titration
+    prototypes = [gains for gains in get_gains(voltages, currents, get_sample(len(currents), samples)) if gains]
+    test = Titration()
+    voltage_list = voltages.tolist()
+
+    def run(row):
+        test.add_result(row, float(row), voltage_list, currents[row].tolist(), 25, float(concentrations[row]),
+                        prototypes[row % len(prototypes)])
+
+    with quiet():
+        return timed(run, range(len(currents))), 1, "scans"
+
+
+def bench_add_result_full(voltages, currents, concentrations, samples: int, repeats: int):
+    """End-to-end add_result of a new sweep, gain extraction included (gains=None)"""
+    from Tests import Titration
+    test = Titration()
+    voltage_list = voltages.tolist()
+    rows = [(row, currents[row].tolist()) for row in get_sample(len(currents), samples)]
+
+    def run(item):
+        row, current = item
+        test.add_result(row, float(row), voltage_list, current, 25, float(concentrations[row]))
+
+    with quiet():
+        return timed(run, rows), 1, "scans"
+
+
+class _ExperimentSink:
+    """Receives the rows of load_experiment, which was written for the former GUI dataframes"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def add_dataframe(self, name):
+        pass
+
+    def add_data_to_df(self, *row):
+        self.rows += 1
+
+
+class _Master:
+    def __init__(self):
+        self.Titration_df = _ExperimentSink()
+        self.Experiment_df = _ExperimentSink()
+
+    def print(self, *args):
+        pass
+
+
+def bench_load_experiment(voltages, currents, concentrations, samples: int, repeats: int):
+    import pandas as pd
+    from Data_processing import load_experiment
+    df = pd.DataFrame({"raw_voltages": [voltages.tolist()] * len(currents),
+                       "raw_currents": [row.tolist() for row in currents],
+                       "concentration": concentrations,
+                       "frequency": 25,
+                       "time": np.arange(len(currents), dtype=float),
+                       "readable_time": "2000-01-01 00:00:00"})
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, "experiment.json")
+        df.to_json(filepath, orient="index")
+        del df
+
+        def run(_):
+            master = _Master()
+            load_experiment(master, filepath, "titration", "benchmark")
+            assert master.Titration_df.rows == len(currents), "load_experiment failed"
+
+        return timed(run, range(repeats)), len(currents), "scans"
+
+
+def bench_save_load(voltages, currents, concentrations, samples: int, repeats: int):
+    from Electrode import Electrode
+    test = make_test(voltages, currents, concentrations, samples)
+    electrode = Electrode("E1_benchmark")
+    electrode.create_experiment("benchmark")
+    electrode.experiments["benchmark"]["Titration"] = test
+    with tempfile.TemporaryDirectory() as folder:
+        def run(_):
+            electrode.save(folder)  # the first save writes every scan, the following ones only the header
+            loaded = Electrode.load(folder, electrode.name)
+            assert len(loaded.get_tests("benchmark")["Titration"].get_df()) == len(currents)
+
+        return timed(run, range(repeats)), len(currents), "scans"
+
+
+def bench_export(voltages, currents, concentrations, samples: int, repeats: int):
+    """CSV export of 4 electrodes sharing the same titration"""
+    import Export
+    from Electrode import Electrode
+    test = make_test(voltages, currents, concentrations, samples)
+    electrodes = {}
+    for number in range(1, 5):
+        electrode = electrodes[f"E{number}"] = Electrode(f"E{number}")
+        electrode.create_experiment("benchmark")
+        electrode.experiments["benchmark"]["Titration"] = test
+    with tempfile.TemporaryDirectory() as folder:
+        def run(_):
+            Export.export(electrodes, folder)
+
+        return timed(run, range(repeats)), 4 * len(currents), "scans"
+
+
+def bench_concentration(voltages, currents, concentrations, samples: int, repeats: int):
+    """Concentration inversion of App.update_plots: every scan converted through the plot cache"""
+    from Data_processing import Calibration, HillFit
+    from Plot_cache import PlotCache
+    concentration, gain = get_titration(voltages, currents, concentrations)
+    with quiet():
+        hf = HillFit(concentration, gain)
+        hf.fitting()
+    calibration = Calibration.from_hill(hf)
+    df = make_test(voltages, currents, concentrations, samples).get_df()
+
+    def run(_):
+        PlotCache().get_concentrations(df, calibration)
+
+    return timed(run, range(repeats)), len(df), "scans"
+
+
+benchmarks = {"extract_gains": bench_extract_gains,
+              "hill_fit": bench_hill_fit,
+              "hill_bootstrap": bench_hill_bootstrap,
+              "add_result_store": bench_add_result_store,
+              "add_result_full": bench_add_result_full,
+              "load_experiment": bench_load_experiment,
+              "save_load": bench_save_load,
+              "export": bench_export,
+              "concentration": bench_concentration}
+
+
+def run_case(name: str, scans: int, points: int, samples: int, repeats: int, seed: int) -> dict:
+    """Runs one benchmark on one dataset size, in a fresh process when called through run_isolated"""
+    voltages, currents, concentrations = make_dataset(scans, points, seed)
+    latencies, items, unit = benchmarks[name](voltages, currents, concentrations, samples, repeats)
+    latencies = np.array(latencies)
+    total = float(latencies.sum())
+    return {"benchmark": name,
+            "scans": scans,
+            "points": points,
+            "calls": len(latencies),
+            "total_s": total,
+            "throughput": len(latencies) * items / total if total else float("inf"),
+            "unit": f"{unit}/s",
+            "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+            "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+            "peak_rss_mb": get_peak_rss_mb()}
+
+
+def run_isolated(*args) -> dict:
+    """Runs a case in a new process, so its peak memory is not hidden by the previous cases"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def load_history(filepath: str) -> list:
+    if not os.path.isfile(filepath):
+        return []
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def append_history(filepath: str, run: dict):
+    """Appends a run to the JSON history, replaced atomically so an interrupted write keeps the old history"""
+    history = load_history(filepath)
+    history.append(run)
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def get_previous(history: list, result: dict):
+    for run in reversed(history):
+        for previous in run["results"]:
+            if all(previous.get(key) == result[key] for key in ("benchmark", "scans", "points")):
+                return previous
+    return None
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmarks of the analysis paths on synthetic voltammograms")
+    arg_parser.add_argument("--only", nargs="+", choices=list(benchmarks), default=list(benchmarks))
+    arg_parser.add_argument("--scans", nargs="+", type=int, default=list(default_scans))
+    arg_parser.add_argument("--points", nargs="+", type=int, default=list(default_points))
+    arg_parser.add_argument("--max-values", type=float, default=2e7,
+                            help="skips datasets with more scans x points, 2e7 values take 160 MB")
+    arg_parser.add_argument("--samples", type=int, default=200, help="scans timed by the per-scan benchmarks")
+    arg_parser.add_argument("--repeats", type=int, default=5, help="calls of the whole-dataset benchmarks")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--quick", action="store_true", help="small datasets only, for a fast check")
+    arg_parser.add_argument("--in-process", action="store_true",
+                            help="no process per case, faster but the peak memory is cumulative")
+    arg_parser.add_argument("--history", default=default_history)
+    arg_parser.add_argument("--no-history", action="store_true")
+    arg_parser.add_argument("--threshold", type=float, default=1.2,
+                            help="flags a regression when p50 grows by more than this ratio")
+    args = arg_parser.parse_args(argv)
+    if args.quick:
+        args.scans, args.points, args.samples, args.repeats = [100, 1000], [200, 1000], 50, 3
+
+    history = [] if args.no_history else load_history(args.history)
+    results = []
+    regressions = 0
+    print(f"{'benchmark':16}{'scans':>8}{'points':>8}{'throughput':>22}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+    for name in args.only:
+        for scans in args.scans:
+            for points in args.points:
+                if scans * points > args.max_values:
+                    print(f"{name:16}{scans:>8}{points:>8}  skipped, more than --max-values")
+                    continue
+                case = (name, scans, points, args.samples, args.repeats, args.seed)
+                try:
+                    result = run_case(*case) if args.in_process else run_isolated(*case)
+                except Exception as e:
+                    print(f"{name:16}{scans:>8}{points:>8}  failed: {e!r}")
+                    continue
+                previous = get_previous(history, result)
+                change = ""
+                if previous is not None and previous["p50_ms"]:
+                    ratio = result["p50_ms"] / previous["p50_ms"]
+                    change = f"  x{ratio:.2f} vs {previous.get('commit') or 'last run'}"
+                    if ratio > args.threshold:
+                        change += "  REGRESSION"
+                        regressions += 1
+                result["commit"] = get_commit()
+                results.append(result)
+                print(f"{name:16}{scans:>8}{points:>8}{result['throughput']:>12.1f} {result['unit']:9}"
+                      f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['peak_rss_mb']:>9.0f}{change}")
+
+    if not args.no_history and results:
+        append_history(args.history, {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                                      "commit": get_commit(),
+                                      "python": platform.python_version(),
+                                      "numpy": np.__version__,
+                                      "platform": platform.platform(),
+                                      "results": results})
+        print(f"Results appended to {args.history}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,11 @@
+import logging
+import os
 import numpy as np
-from scipy.signal import savgol_filter
 from numpy import diff
 from Utils import debug
-import tkinter as tk
 import pandas as pd
 from typing import Union
-from tkinter import messagebox
-from scipy.optimize import curve_fit
-from sklearn.metrics import r2_score
-from scipy.interpolate import CubicSpline
+# scipy is imported by the functions using it, it is not needed to open the GUI
 
 
 def load_experiment(master, filepath:str,df_type:str, exp_name:str):
@@ -52,31 +49,36 @@ def load_experiment(master, filepath:str,df_type:str, exp_name:str):
                     raise Exception("datafram type doesn't exists")
         except Exception as e:
             debug()
-            tk.messagebox.showerror('Warning', "File not found")
+            logging.getLogger("SwiftMote").error(f"Could not load {filepath}: {e}")
             return 0
 
     except Exception as e:
         debug()
-        tk.messagebox.showerror('Warning', "File not found")
+        logging.getLogger("SwiftMote").error(f"Could not load {filepath}: {e}")
         return 0
 
+def r2_score(y_true: Union[list[float], np.ndarray], y_pred: Union[list[float], np.ndarray]) -> float:
+    """Coefficient of determination, as sklearn.metrics.r2_score: 1.0 for a perfect fit of constant data"""
+    y_true = np.asarray(y_true, dtype=float)
+    ss_res = np.sum((y_true - np.asarray(y_pred, dtype=float)) ** 2)
+    ss_tot = np.sum((y_true - y_true.mean()) ** 2)
+    if ss_tot == 0:
+        return 1.0 if ss_res == 0 else 0.0
+    return float(1 - ss_res / ss_tot)
+
+
+def get_zero_crossings(values: Union[list[float], np.ndarray]) -> np.ndarray:
+    """Indices i where values changes sign between i-1 and i, in one O(N) pass.
+    Exact zeros are not counted as a sign change."""
+    return np.flatnonzero(np.abs(np.diff(np.sign(values))) == 2) + 1
+
+
 def extract_gains(voltages: list[float], currents:list[float]) -> dict:
+    from scipy.signal import savgol_filter
     border = 20
     zeros_trim = np.zeros(border)
     voltages = voltages[border:]
     currents = currents[border:]
-    def get_peaks_and_valleys(values: list, offset: int):
-        dt_peaks = []
-        for val in values[1:]:
-            try:
-                if val > 0 and values[values.index(val) - 1] < 0:
-                    dt_peaks.append(values.index(val) + offset)
-
-                elif val < 0 and values[values.index(val) - 1] > 0:
-                    dt_peaks.append(values.index(val) + offset)
-            except Exception:
-                return debug()
-        return dt_peaks
     ############################################# determination of the peak current#######################################################################
     currents = currents  # + noise
     model = np.poly1d(np.polyfit(voltages, currents, 6))
@@ -105,7 +107,7 @@ def extract_gains(voltages: list[float], currents:list[float]) -> dict:
     ################################# approximation of start and end of bump by derivative ##############################################################
     # bump_start = data_smooth.index(data_smooth[24])
     # bump_end = data_smooth.index(data_smooth[130])
-    dt = dt_current
+    crossings = get_zero_crossings(dt_current)  # computed once, reused by every widening step
     bump_start = zero_index
     bump_end = zero_index
     count = 0
@@ -113,31 +115,25 @@ def extract_gains(voltages: list[float], currents:list[float]) -> dict:
     isAfter = True
     err = 0.1
     while count <= 10:
-        temp = [current for current in dt]
-        try:
-            if isBefore:
+        if isBefore:
+            position = np.searchsorted(crossings, bump_start, side='left')
+            if position > 0:  # closest sign change before the bump start
                 temp_ind = bump_start
-                peaks_before = get_peaks_and_valleys(temp[:bump_start], 0)
-                bump_start = max(x for x in peaks_before if x < bump_start)
+                bump_start = int(crossings[position - 1])
                 difference = (data_smooth[temp_ind] - data_smooth[bump_start]) / data_smooth[temp_ind]
                 if difference < err:
                     isBefore = False
-        except Exception:
-            pass
-        try:
-            if isAfter:
+        if isAfter:
+            position = np.searchsorted(crossings, bump_end, side='right')
+            if position < len(crossings):  # closest sign change after the bump end
                 temp_ind = bump_end
-                peaks_after = get_peaks_and_valleys(temp[zero_index:], zero_index)
-                bump_end = min(x for x in peaks_after if x > bump_end)
+                bump_end = int(crossings[position])
                 difference = (data_smooth[temp_ind] - data_smooth[bump_end]) / data_smooth[temp_ind]
                 if difference < err:
                     isAfter = False
-        except Exception:
-            pass
         if not isBefore and not isAfter:
             break
 
-        dt = temp
         count += 1
 
     print("BUMP", bump_start, " ", bump_end)
@@ -208,6 +204,133 @@ def extract_gains(voltages: list[float], currents:list[float]) -> dict:
                 "half-height voltages": [voltages[pt1], voltages[pt2]]}
 
 
+def extract_gains_batch(voltages: Union[list[float], np.ndarray], currents_2d: np.ndarray) -> dict:
+    """Same processing as extract_gains, applied at once to N scans sharing one voltage grid.
+
+    param voltages: voltage grid of every scan, length N_points
+    param currents_2d: array of shape (N_scans, N_points)
+    Returns a dict of arrays with the keys of extract_gains, one row per scan, plus a "valid" mask.
+    Rows for which extract_gains would fail are flagged invalid and filled with NaN.
+    """
+    from scipy.signal import savgol_filter
+    border = 20
+    win_length = 21
+    err = 0.1
+    voltages = np.asarray(voltages, dtype=float)
+    currents_2d = np.atleast_2d(np.asarray(currents_2d, dtype=float))
+    n_scans = currents_2d.shape[0]
+    rows = np.arange(n_scans)
+    v = voltages[border:]
+    currents = currents_2d[:, border:]
+    n_points = v.size
+    cols = np.arange(n_points)
+
+    ############################################# determination of the peak current ##################################
+    smooth_coefs = np.polyfit(v, currents.T, 6)
+    data_smooth = np.zeros_like(currents)
+    for coef in smooth_coefs:  # Horner scheme, same operations as np.poly1d
+        data_smooth = data_smooth * v + coef[:, None]
+
+    dt = np.diff(data_smooth, axis=1)
+    bump_start = np.argmax(dt, axis=1)
+    bump_end = np.argmin(dt, axis=1)
+    lo = np.minimum(bump_start, bump_end)[:, None]
+    hi = np.maximum(bump_start, bump_end)[:, None]
+    in_bump = (cols[:-1] >= lo) & (cols[:-1] < hi)
+    zero_index = np.where(bump_start == bump_end, bump_start,
+                          np.argmax(np.where(in_bump, data_smooth[:, :-1], -np.inf), axis=1))
+
+    ################################# approximation of start and end of bump by derivative ###########################
+    # sign changes of the derivative, prev/next lookup tables make each widening step O(1) per scan
+    crossing = np.zeros(dt.shape, dtype=bool)
+    crossing[:, 1:] = np.abs(np.diff(np.sign(dt), axis=1)) == 2  # same rule as get_zero_crossings
+    dt_cols = np.arange(dt.shape[1])
+    no_next = dt.shape[1]
+    prev_incl = np.maximum.accumulate(np.where(crossing, dt_cols, -1), axis=1)
+    prev_strict = np.full(dt.shape, -1)
+    prev_strict[:, 1:] = prev_incl[:, :-1]
+    next_incl = np.minimum.accumulate(np.where(crossing, dt_cols, no_next)[:, ::-1], axis=1)[:, ::-1]
+    next_strict = np.full(dt.shape, no_next)
+    next_strict[:, :-1] = next_incl[:, 1:]
+
+    bump_start = zero_index.copy()
+    bump_end = zero_index.copy()
+    is_before = np.ones(n_scans, dtype=bool)
+    is_after = np.ones(n_scans, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(11):
+            if not (is_before | is_after).any():
+                break
+            candidate = prev_strict[rows, bump_start]
+            moved = is_before & (candidate >= 0)
+            new_start = np.where(moved, candidate, bump_start)
+            difference = (data_smooth[rows, bump_start] - data_smooth[rows, new_start]) / data_smooth[rows, bump_start]
+            is_before &= ~(moved & (difference < err))
+            bump_start = new_start
+
+            candidate = next_strict[rows, bump_end]
+            moved = is_after & (candidate < no_next)
+            new_end = np.where(moved, candidate, bump_end)
+            difference = (data_smooth[rows, bump_end] - data_smooth[rows, new_end]) / data_smooth[rows, bump_end]
+            is_after &= ~(moved & (difference < err))
+            bump_end = new_end
+
+    #################################### baseline from values outside of the bump ####################################
+    data_sav = savgol_filter(currents, window_length=win_length, polyorder=1, mode='mirror', axis=1)
+    outside = (cols < bump_start[:, None]) | (cols >= bump_end[:, None])
+    count = outside.sum(axis=1)
+    v_mean = (outside * v).sum(axis=1) / count
+    i_mean = (outside * data_sav).sum(axis=1) / count
+    v_centered = np.where(outside, v - v_mean[:, None], 0)
+    slope = (v_centered * (data_sav - i_mean[:, None])).sum(axis=1) / (v_centered ** 2).sum(axis=1)
+    baseline_coeff = np.column_stack([slope, i_mean - slope * v_mean])
+    data_baseline = baseline_coeff[:, :1] * v + baseline_coeff[:, 1:]
+    normalized_gain = data_sav - data_baseline
+    max_gain_index = np.argmax(data_smooth, axis=1)
+
+    ######################################################## half heigth width #######################################
+    half_gain = np.max(normalized_gain, axis=1) / 2
+    distance = np.abs(normalized_gain - half_gain[:, None])
+    before_peak = cols < max_gain_index[:, None]
+    pt1 = np.argmin(np.where(before_peak, distance, np.inf), axis=1)
+    pt2 = np.argmin(np.where(before_peak, np.inf, distance), axis=1)
+
+    valid = (max_gain_index > 0) & (max_gain_index < n_points - 1)
+    left_index = np.clip(max_gain_index - 1, 0, n_points - 1)
+    right_index = np.clip(max_gain_index + 1, 0, n_points - 1)
+    gain_peak = normalized_gain[rows, max_gain_index]
+    gain_left = normalized_gain[rows, left_index]
+    gain_right = normalized_gain[rows, right_index]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_difference_left = ((gain_peak - gain_left) / gain_left) * 100
+        p_difference_right = ((gain_peak - gain_right) / gain_right) * 100
+    use_left = p_difference_left < -1
+    use_right = p_difference_right < -1
+    both = use_left & use_right
+    use_left = np.where(both, p_difference_left < p_difference_right, use_left)
+    use_right = np.where(both, ~use_left, use_right & ~use_left)
+    peak_current = np.where(use_left, (gain_peak + gain_left) / 2,
+                            np.where(use_right, (gain_peak + gain_right) / 2, gain_peak))
+
+    gain_coeff = np.polyfit(v, normalized_gain.T, 6).T
+    smooth_data = np.hstack([np.zeros((n_scans, border)), data_sav])
+    peak_voltage = v[max_gain_index]
+    half_heights = np.column_stack([v[pt1], v[pt2]])
+
+    peak_current[~valid] = np.nan
+    peak_voltage[~valid] = np.nan
+    half_heights[~valid] = np.nan
+    gain_coeff[~valid] = np.nan
+    baseline_coeff[~valid] = np.nan
+    return {"gain coefs": gain_coeff,
+            "baseline coefs": baseline_coeff,
+            "peak current": peak_current,
+            "smooth_data": smooth_data,
+            "peak voltage": peak_voltage,
+            "half-height voltages": half_heights,
+            "valid": valid}
+
+
 class HillFit:
     def __init__(
             self,
@@ -229,17 +352,23 @@ class HillFit:
         return self.bottom + (self.top - self.bottom) * x ** self.nH / (
                 self.ec50 ** self.nH + x ** self.nH)
 
+    def _get_initial(self) -> tuple:
+        """Default initial parameters and bounds of the fit"""
+        min_data = np.amin(self.y_data)
+        max_data = np.amax(self.y_data)
+
+        h = abs(max_data - min_data)
+        param_initial = [max_data, min_data, 0.5 * (self.x_data[-1] - self.x_data[0]), 1]
+        param_bounds = (
+            [max_data - 0.5 * h, min_data - 0.5 * h, self.x_data[0] * 0.1, 0.01],
+            [max_data + 0.5 * h, min_data + 0.5 * h, self.x_data[-1] * 10, 100],
+        )
+        return param_initial, param_bounds
+
     def _get_param(self, curve_fit_kws: dict) -> list[float]:
+        from scipy.optimize import curve_fit
         try:
-            min_data = np.amin(self.y_data)
-            max_data = np.amax(self.y_data)
-
-            h = abs(max_data - min_data)
-            param_initial = [max_data, min_data, 0.5 * (self.x_data[-1] - self.x_data[0]), 1]
-            param_bounds = (
-                [max_data - 0.5 * h, min_data - 0.5 * h, self.x_data[0] * 0.1, 0.01],
-                [max_data + 0.5 * h, min_data + 0.5 * h, self.x_data[-1] * 10, 100],
-            )
+            param_initial, param_bounds = self._get_initial()
             curve_fit_kws.setdefault("p0", param_initial)
             curve_fit_kws.setdefault("bounds", param_bounds)
             popt, _ = list(curve_fit(self._equation, self.x_data, self.y_data, **curve_fit_kws))
@@ -247,12 +376,15 @@ class HillFit:
         except Exception:
             debug()
 
-    def fitting(self,sigfigs: int = 6):
+    def fitting(self,sigfigs: int = 6, p0=None):
+        """p0 warm-starts the fit, e.g. with the parameters of a fit of close data"""
         try:
             curve_fit_kws = {}
             self.x_fit = np.logspace(
                 np.log10(self.x_data[0]), np.log10(self.x_data[-1]), len(self.y_data)
             )
+            if p0 is not None:
+                curve_fit_kws["p0"] = np.clip(p0, *self._get_initial()[1])
             params = self._get_param(curve_fit_kws)
             self.y_fit = self._equation(self.x_fit, *params)
             self.r_2 = r2_score(self.y_data, self.y_fit)
@@ -260,4 +392,236 @@ class HillFit:
             self.r_2 = 1000
         else:
             self.equation = f"{round(self.bottom, sigfigs)} + ({round(self.top, sigfigs)}-{round(self.bottom, sigfigs)})*x**{(round(self.nH, sigfigs))} / ({round(self.ec50, sigfigs)}**{(round(self.nH, sigfigs))} + x**{(round(self.nH, sigfigs))})"
-            self.params = params
\ No newline at end of file
+            self.params = params
+
+    def confidence_intervals(self, n_resamples: int = 1000, method: str = "bootstrap", level: float = 0.95,
+                             max_workers: int = None, seed: int = None) -> dict:
+        """Intervals of the parameters from refits on resampled titration points, warm-started from the fitted ones.
+
+        method "bootstrap": n_resamples draws of the points with replacement, percentile intervals
+        method "jackknife": one refit per left-out point, normal intervals with the jackknife standard error
+        Refits are batched (see refit_hill), big jobs are split in chunks over a process pool, max_workers=1 runs
+        them in this process.
+        Returns {"top", "bottom", "ec50", "nH": (low, high), "samples": refitted parameters of shape (N, 4),
+        "failed": number of refits that did not converge}, None if the titration could not be fitted"""
+        if not hasattr(self, "params"):
+            self.fitting()
+            if not hasattr(self, "params"):
+                return None
+        n_points = len(self.x_data)
+        if method == "bootstrap":
+            samples = np.random.default_rng(seed).integers(0, n_points, (n_resamples, n_points))
+        elif method == "jackknife":
+            samples = np.array([np.delete(np.arange(n_points), i) for i in range(n_points)])
+        else:
+            raise ValueError(f"Unknown method {method}")
+        _, bounds = self._get_initial()
+        p0 = np.clip(self.params, bounds[0], bounds[1])
+        if max_workers is None:
+            max_workers = min(os.cpu_count() or 1, 8)
+        if max_workers == 1 or samples.size < 200000:  # refits are batched, a pool only pays off for big jobs
+            params = refit_hill(self.x_data, self.y_data, samples, p0, bounds, self.bottom_param)
+        else:
+            chunks = np.array_split(samples, max_workers * 2)
+            params = np.concatenate(list(get_executor().map(
+                refit_hill, *zip(*[(self.x_data, self.y_data, chunk, p0, bounds, self.bottom_param)
+                                   for chunk in chunks]))))
+        failed = int(np.isnan(params).any(axis=1).sum())
+        params = params[~np.isnan(params).any(axis=1)]
+        intervals = {"samples": params, "failed": failed}
+        if not len(params):
+            return intervals
+        if method == "bootstrap":
+            low, high = np.percentile(params, [50 * (1 - level), 50 * (1 + level)], axis=0)
+        else:
+            from statistics import NormalDist
+            n = len(params)
+            error = NormalDist().inv_cdf(0.5 + level / 2) * np.sqrt(
+                (n - 1) / n * np.sum((params - params.mean(axis=0)) ** 2, axis=0))
+            low, high = np.array(self.params) - error, np.array(self.params) + error
+        for i, name in enumerate(("top", "bottom", "ec50", "nH")):
+            intervals[name] = (float(low[i]), float(high[i]))
+        self.intervals = intervals
+        return intervals
+
+
+def hill_equation(x: np.ndarray, top: float, bottom: float, ec50: float, nH: float) -> np.ndarray:
+    return bottom + (top - bottom) * x ** nH / (ec50 ** nH + x ** nH)
+
+
+def hill_jacobian(x: np.ndarray, top, bottom, ec50, nH) -> np.ndarray:
+    """Derivatives of hill_equation by top, bottom, ec50 and nH along the last axis, parameters can be arrays
+    broadcasting with x"""
+    ratio = x ** nH / (ec50 ** nH + x ** nH)
+    slope = (top - bottom) * ratio * (1 - ratio)
+    log_ratio = np.log(np.where(x > 0, x, ec50) / ec50)  # slope is 0 at x=0
+    return np.stack(np.broadcast_arrays(ratio, 1 - ratio, -slope * nH / ec50, slope * log_ratio), axis=-1)
+
+
+def refit_hill(x_data: np.ndarray, y_data: np.ndarray, samples: np.ndarray, p0, bounds,
+               bottom_param: bool = True, max_iterations: int = 100, tolerance: float = 1e-10) -> np.ndarray:
+    """Hill parameters fitted on the points of each row of indices of samples, all rows at once.
+
+    Levenberg-Marquardt with the analytic Jacobian, vectorized over the rows (one 4x4 solve per row and iteration),
+    every row starting from p0 and kept within bounds. A few hundred refits of a titration take milliseconds,
+    where a curve_fit call per row costs a few ms each. Rows of NaN for the fits that failed or had less than
+    4 distinct concentrations. Runs in worker processes"""
+    x = np.asarray(x_data, dtype=float)[samples]
+    y = np.asarray(y_data, dtype=float)[samples]
+    low, high = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    params = np.tile(np.clip(np.asarray(p0, dtype=float), low, high), (len(samples), 1))
+    if not bottom_param:
+        params[:, 1] = 0
+
+    def get_cost(p):
+        with np.errstate(all='ignore'):
+            residuals = hill_equation(x, *(p[:, [i]] for i in range(4))) - y
+            cost = np.sum(residuals ** 2, axis=1)
+        return residuals, np.where(np.isfinite(cost), cost, np.inf)
+
+    residuals, cost = get_cost(params)
+    damping = np.full(len(samples), 1e-3)
+    active = np.isfinite(cost)
+    failed = ~active
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        with np.errstate(all='ignore'):
+            jac = hill_jacobian(x[active], *(params[active][:, [i]] for i in range(4)))
+        if not bottom_param:
+            jac[..., 1] = 0
+        hessian = np.einsum("snp,snq->spq", jac, jac)
+        gradient = np.einsum("snp,sn->sp", jac, residuals[active])
+        diagonal = np.einsum("spp->sp", hessian)
+        diagonal = np.where(diagonal > 0, diagonal, 1.0)  # e.g. bottom when it is not fitted
+        system = hessian + (damping[active, None] * diagonal)[:, :, None] * np.eye(4)
+        valid = np.isfinite(system).all(axis=(1, 2)) & np.isfinite(gradient).all(axis=1)
+        step = np.zeros_like(gradient)
+        if valid.any():
+            try:
+                step[valid] = np.linalg.solve(system[valid], -gradient[valid][:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                valid[:] = False
+        candidate = params.copy()
+        candidate[active] = np.clip(params[active] + step, low, high)
+        new_residuals, new_cost = get_cost(candidate)
+        better = np.zeros(len(samples), dtype=bool)
+        better[active] = valid & (new_cost[active] < cost[active])
+        failed[np.flatnonzero(active)[~valid]] = True
+        converged = failed.copy()
+        converged[active] |= better[active] & (cost[active] - new_cost[active] <= tolerance * cost[active])
+        params[better], residuals[better], cost[better] = candidate[better], new_residuals[better], new_cost[better]
+        damping[better] /= 10
+        worse = active & ~better
+        damping[worse] *= 10
+        converged |= worse & (damping > 1e10)  # no step lowers the cost, at a minimum within the bounds
+        active &= ~converged
+    distinct = np.array([np.unique(row).size >= 4 for row in x])
+    params[failed | ~distinct] = np.nan
+    return params
+
+
+_executor = None
+
+
+def get_executor():
+    """Process pool of the analysis, created on first use and kept, worker start-up is paid once"""
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 8))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+class Calibration:
+    """Inverse of a titration fit, turns peak currents into concentrations.
+
+    Peak currents are normalized like the titration curve, as a gain in % relative to a reference peak
+    (the first scan of the series by default), then inverted through the Hill equation or the linear fit.
+    Values the fit can't invert are NaN, so a whole series is converted with one NumPy call."""
+
+    def __init__(self, kind: str, params: tuple, concentration_range: tuple = (np.nan, np.nan),
+                 param_samples: np.ndarray = None):
+        self.kind = kind  # "Hill": (top, bottom, ec50, nH), "Linear": (a, b) of gain = a * concentration + b
+        self.params = tuple(float(param) for param in params)
+        self.concentration_range = tuple(float(value) for value in concentration_range)
+        self.param_samples = param_samples  # Hill parameters of resampled refits, for concentration_interval
+
+    @classmethod
+    def from_hill(cls, hf: HillFit) -> "Calibration":
+        """Calibration of a Hill fit, with the refits of its last confidence_intervals if it has some"""
+        intervals = getattr(hf, "intervals", None) or {}
+        return cls("Hill", hf.params, (np.min(hf.x_data), np.max(hf.x_data)), intervals.get("samples"))
+
+    @classmethod
+    def from_linear(cls, coefs, concentration: Union[list[float], np.ndarray] = None) -> "Calibration":
+        concentration_range = (np.min(concentration), np.max(concentration)) if concentration is not None \
+            else (np.nan, np.nan)
+        return cls("Linear", coefs[:2], concentration_range)
+
+    @classmethod
+    def fit(cls, concentration: Union[list[float], np.ndarray], gain: Union[list[float], np.ndarray],
+            hill: bool = True) -> "Calibration":
+        """Fits a titration curve (gain in % against concentration) and returns its calibration"""
+        if hill:
+            hf = HillFit(concentration, gain)
+            hf.fitting()
+            return cls.from_hill(hf)
+        return cls.from_linear(np.polyfit(concentration, gain, 1), concentration)
+
+    @property
+    def key(self) -> tuple:
+        """Identifies the calibration, concentrations computed with an equal key can be reused"""
+        return (self.kind, *self.params)
+
+    @staticmethod
+    def normalize(peak_currents: np.ndarray, reference: float = None) -> np.ndarray:
+        """Gain in % of each peak current relative to the reference peak, the first one by default"""
+        peak_currents = np.asarray(peak_currents, dtype=float)
+        if reference is None:
+            reference = peak_currents[0] if peak_currents.size else np.nan
+        return (peak_currents / reference - 1) * 100
+
+    def concentration(self, peak_currents: np.ndarray, reference: float = None,
+                      extrapolate: bool = True) -> np.ndarray:
+        """Concentration of each peak current, NaN where the calibration can't invert it:
+        outside [bottom, top] for a Hill fit, and outside the fitted concentrations when extrapolate is False"""
+        gain = self.normalize(peak_currents, reference)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.kind == "Hill":
+                top, bottom, ec50, nH = self.params
+                concentration = ec50 * ((bottom - gain) / (gain - top)) ** (1 / nH)
+                concentration[~((bottom <= gain) & (gain <= top))] = np.nan
+            else:
+                a, b = self.params
+                concentration = (gain - b) / a
+        if not extrapolate:
+            low, high = self.concentration_range
+            concentration[~((low <= concentration) & (concentration <= high))] = np.nan
+        concentration[~np.isfinite(concentration)] = np.nan
+        return concentration
+
+    def concentration_interval(self, peak_currents: np.ndarray, param_samples: np.ndarray = None,
+                               reference: float = None, level: float = 0.95, extrapolate: bool = True) -> tuple:
+        """Percentile interval of the concentration of each peak current over Hill parameter samples, e.g. the
+        "samples" of HillFit.confidence_intervals, self.param_samples by default. Samples that can't invert a
+        current are left out of its interval. Returns (low, high) arrays, NaN where no sample inverts the current"""
+        if param_samples is None:
+            param_samples = self.param_samples if self.param_samples is not None else []
+        low = np.full(np.shape(peak_currents), np.nan)
+        if not len(param_samples):
+            return low, low.copy()
+        concentrations = np.array([Calibration("Hill", params, self.concentration_range).concentration(
+            peak_currents, reference, extrapolate) for params in param_samples])
+        high = low.copy()
+        inverted = np.isfinite(concentrations).any(axis=0)
+        if inverted.any():
+            low[inverted], high[inverted] = np.nanpercentile(concentrations[:, inverted],
+                                                             [50 * (1 - level), 50 * (1 + level)], axis=0)
+        return low, high
\ No newline at end of file
@@ -0,0 +1,91 @@
+import numpy as np
+
+# Level of detail of the long time series (peak voltages and concentrations of every scan of a run): only the points
+# in the visible x range are drawn, reduced to a few per pixel column of the axes, so drawing cost is bounded by the
+# axes width whatever the length of the run, and zooming in shows finer detail.
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, buckets: int) -> np.ndarray:
+    """Indices of the first, last, lowest and highest point of each of buckets equal intervals of x (sorted x).
+    A line through them covers the same pixels as a line through every point when there is one bucket per pixel
+    column, so peaks and outliers stay visible. NaN are skipped for the lowest and highest"""
+    n = x.size
+    if n <= 4 * buckets or buckets < 1:
+        return np.arange(n)
+    span = x[-1] - x[0]
+    if not span > 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    counts = ends - starts + 1
+    indices = [starts, ends]
+    for reduce, skipped in ((np.minimum, np.inf), (np.maximum, -np.inf)):
+        values = np.where(np.isnan(y), skipped, y)
+        extreme = reduce.reduceat(values, starts)
+        matches = np.flatnonzero(values == np.repeat(extreme, counts))  # first match of each bucket, O(n)
+        indices.append(matches[np.unique(bucket[matches], return_index=True)[1]])
+    return np.unique(np.concatenate(indices))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of points that keep the shape of the line (sorted x).
+    Smoother than minmax_indices but a single outlier within a bucket can be dropped"""
+    n = x.size
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = (np.linspace(0, n - 2, points - 1) + 1).astype(np.int64)  # points - 2 buckets between the ends
+    edges[-1] = n - 1
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        next_stop = edges[bucket + 2] if bucket + 2 < edges.size else n
+        next_x = np.mean(x[stop:next_stop]) if next_stop > stop else x[-1]
+        next_y = np.nanmean(y[stop:next_stop]) if next_stop > stop else y[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous]) -
+                       (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        selected[bucket + 1] = previous
+    return np.unique(selected)
+
+
+class DecimatedLine:
+    """Matplotlib line showing a decimated view of its data: the points within the visible x range of its axes,
+    reduced to minmax_indices over the axes width in pixels (or LTTB with method="lttb").
+    Call refresh() when the x range or the axes size change, Plot does it on xlim_changed and resize events."""
+
+    def __init__(self, line, method: str = "minmax"):
+        self.line = line
+        self.method = method
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self._key = None  # visible range and width of the data currently on the line
+
+    def set_data(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if x.size > 1 and np.any(np.diff(x) < 0):
+            order = np.argsort(x, kind="stable")
+            x, y = x[order], y[order]
+        self.x, self.y = x, y
+        self._key = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Decimates again if the data, the visible x range or the axes width changed, returns True if it did"""
+        axes = self.line.axes
+        low, high = sorted(axes.get_xlim())
+        width = max(int(axes.bbox.width), 1)
+        key = (low, high, width)
+        if key == self._key:
+            return False
+        self._key = key
+        start = max(int(np.searchsorted(self.x, low, side="left")) - 1, 0)  # one point beyond each side,
+        stop = min(int(np.searchsorted(self.x, high, side="right")) + 1, self.x.size)  # the line reaches the edges
+        x, y = self.x[start:stop], self.y[start:stop]
+        indices = lttb_indices(x, y, 2 * width) if self.method == "lttb" else minmax_indices(x, y, width)
+        self.line.set_data(x[indices], y[indices])
+        return True
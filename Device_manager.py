@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Serial_acquisition import is_port_name
+from Utils import debug
+
+
+class DeviceStatus:
+    """Progress and throughput of one device"""
+
+    def __init__(self, device_id: str, electrode):
+        self.device_id = device_id
+        self.electrode = electrode
+        self.test = None
+        self.state = "idle"  # idle, running, stopping
+        self.points = 0  # points received during the current sweep
+        self.expected_points = 0
+        self.scans = 0  # successful sweeps since the device was assigned
+        self.errors = 0
+        self.last_duration = 0.0
+        self.points_per_second = 0.0
+        self.last_result = None
+        self.stop_requested = threading.Event()
+
+    def count_point(self):
+        self.points += 1
+
+    def get_progress(self) -> dict:
+        return {"electrode": self.electrode.name if self.electrode is not None else None,
+                "test": self.test.type if self.test is not None else None,
+                "state": self.state,
+                "progress": min(self.points / self.expected_points, 1.0) if self.expected_points else 0.0,
+                "points": self.points,
+                "scans": self.scans,
+                "errors": self.errors,
+                "last_duration": self.last_duration,
+                "points_per_second": self.points_per_second,
+                "last_result": self.last_result}
+
+
+class DeviceManager:
+    """Runs tests on several SwiftMote boards at the same time.
+
+    Each serial port (COM port, device path or URL of Serial_acquisition.open_port) is mapped to an Electrode. Sweeps run in a worker thread per device,
+    the electrode is saved to its store from that thread after every successful scan, and finished runs are
+    queued for the GUI to pick up with poll_results(), so nothing blocks the Tk mainloop."""
+
+    def __init__(self, data_path: str, baudrate: int = 115200):
+        self.data_path = data_path
+        self.baudrate = baudrate
+        self.devices = {}  # device id -> DeviceStatus
+        self.results = queue.Queue()  # (device id, electrode, test, result) of every finished sweep
+        self._save_locks = {}  # electrode name -> lock, two devices may share an electrode
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(thread_name_prefix="Device")
+
+    def assign(self, device_id: str, electrode):
+        """Maps a serial port to an electrode, BLE boards are not handled by the device manager"""
+        if not is_port_name(device_id):
+            raise ValueError(f"{device_id} is not a serial port or a port URL, BLE devices can't be run "
+                             f"by the device manager")
+        with self._lock:
+            status = self.devices.get(device_id)
+            if status is not None and status.state != "idle":
+                raise RuntimeError(f"{device_id} is running a test")
+            if status is not None and status.electrode is electrode:
+                return  # keeps the counters of the device
+            self.devices[device_id] = DeviceStatus(device_id, electrode)
+            self._save_locks.setdefault(electrode.name, threading.Lock())
+
+    def unassign(self, device_id: str):
+        with self._lock:
+            status = self.devices.get(device_id)
+            if status is not None and status.state == "idle":
+                self.devices.pop(device_id)
+
+    def get_save_lock(self, electrode_name: str) -> threading.Lock:
+        """Lock held while the electrode is saved, readers of its unsaved results can hold it to see them or the store"""
+        return self._save_locks.setdefault(electrode_name, threading.Lock())
+
+    def get_electrode(self, device_id: str):
+        status = self.devices.get(device_id)
+        return status.electrode if status is not None else None
+
+    def is_busy(self, device_id: str) -> bool:
+        status = self.devices.get(device_id)
+        return status is not None and status.state != "idle"
+
+    def run(self, device_id: str, experiment_name: str, test_type: str, repeats: int = 1,
+            interval: float = 0.0) -> bool:
+        """Starts repeats sweeps of a test on a device, interval seconds apart. Returns False if the device is busy
+        or the same test (electrode, experiment and type) runs on another device: scan indices and stop flags
+        belong to the test, two runs would overwrite each other's scans"""
+        with self._lock:
+            status = self.devices[device_id]
+            if status.state != "idle":
+                return False
+            test = status.electrode.get_tests(experiment_name)[test_type]
+            if self.get_running_device(test) is not None:
+                return False
+            status.test = test
+            status.state = "running"
+            status.stop_requested.clear()
+        self._executor.submit(self._run, status, max(int(repeats), 1), interval)
+        return True
+
+    def get_running_device(self, test):
+        """Id of the device running a test, None if it is not running"""
+        for device_id, status in list(self.devices.items()):
+            if status.state != "idle" and status.test is test:
+                return device_id
+        return None
+
+    def run_all(self, experiment_name: str, test_type: str, repeats: int = 1, interval: float = 0.0) -> list:
+        """Starts the same test on every idle device, returns the ids of the devices started"""
+        return [device_id for device_id in list(self.devices)
+                if self.run(device_id, experiment_name, test_type, repeats, interval)]
+
+    def stop(self, device_id: str):
+        status = self.devices.get(device_id)
+        if status is not None and status.state == "running":
+            status.state = "stopping"
+            status.stop_requested.set()
+            status.test.stop_test()
+
+    def stop_all(self):
+        for device_id in list(self.devices):
+            self.stop(device_id)
+
+    def _run(self, status: DeviceStatus, repeats: int, interval: float):
+        test = status.test
+        test.stop_continuous = False
+        try:
+            for n in range(repeats):
+                if status.stop_requested.is_set() or test.stop_continuous:
+                    break
+                test.get_steps()
+                status.points = 0
+                status.expected_points = test.steps
+                started = time.perf_counter()
+                result = test.run_test(status.device_id, self.baudrate, on_record=status.count_point)
+                status.last_duration = time.perf_counter() - started
+                status.points_per_second = status.points / status.last_duration if status.last_duration else 0.0
+                status.last_result = result
+                if result == 1:
+                    status.scans += 1
+                    with self._save_locks[status.electrode.name]:
+                        status.electrode.save(self.data_path)
+                else:
+                    status.errors += 1
+                self.results.put((status.device_id, status.electrode, test, result))
+                if result != 1:
+                    break
+                if n < repeats - 1:
+                    status.stop_requested.wait(interval)
+        except Exception as e:
+            debug()
+            status.errors += 1
+            status.last_result = e
+            self.results.put((status.device_id, status.electrode, test, e))
+        finally:
+            status.state = "idle"
+
+    def poll_results(self) -> list:
+        """Finished sweeps since the last call, never blocks"""
+        finished = []
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def get_progress(self) -> dict:
+        return {device_id: status.get_progress() for device_id, status in list(self.devices.items())}
+
+    def shutdown(self):
+        self.stop_all()
+        self._executor.shutdown(wait=False)
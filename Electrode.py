@@ -1,5 +1,8 @@
+import copy
 import pickle
 from Tests import *
+from Experiment_store import ExperimentStore
+import Instrumentation
 import os
 
 class Electrode:
@@ -21,13 +24,60 @@ class Electrode:
     def get_tests(self,experiment_name:str) -> dict:
         return self.experiments[experiment_name]
 
+    def get_store(self, filepath: str) -> ExperimentStore:
+        return ExperimentStore(os.path.join(filepath, f"{self.name}.store"))
+
+    def sync_store(self, filepath: str):
+        """Appends the results added since the last save to the store, cost only depends on the new scans"""
+        store = self.get_store(filepath)
+        for experiment_name in store.experiments():
+            if experiment_name not in self.experiments:
+                store.delete_experiment(experiment_name)
+        for experiment_name, tests in self.experiments.items():
+            for test_type, test in tests.items():
+                for index in test.pop_unsaved():
+                    if index in test.results:
+                        store.append(experiment_name, test_type, index, test.get_row(index))
+
     def save(self,filepath:str):
-        filepath = f"{filepath}\\{self.name}"
+        """Writes new results to the electrode store, then pickles the electrode without its results"""
+        started = Instrumentation.start()
+        self.sync_store(filepath)
+        # pickle shallow copies, the live tests are never detached from their results while a device may be adding scans
+        header = copy.copy(self)
+        header.experiments = {experiment_name: {test_type: test.without_results() for test_type, test in tests.items()}
+                              for experiment_name, tests in list(self.experiments.items())}
+        filepath = os.path.join(filepath, self.name)
         with open(filepath, 'wb') as outp:  # Overwrites any existing file.
-            pickle.dump(self, outp, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(header, outp, pickle.HIGHEST_PROTOCOL)
+        Instrumentation.stop("store write", started)
+
+    @staticmethod
+    def load(filepath: str, name: str) -> "Electrode":
+        """Unpickles an electrode, results of each test are read from the store when first used"""
+        with open(os.path.join(filepath, name), "rb") as f:
+            electrode = pickle.load(f)
+        store = electrode.get_store(filepath)
+        for experiment_name, tests in electrode.experiments.items():
+            for test_type, test in tests.items():
+                if test._results is None:
+                    test.attach_store(lambda e=experiment_name, t=test_type: store.load_results(e, t))
+        return electrode
+
+    def unload_results(self, filepath: str) -> int:
+        """Frees the results that are all in the store, they are read again when next used. Returns the bytes freed"""
+        store = self.get_store(filepath)
+        freed = 0
+        for experiment_name, tests in self.experiments.items():
+            for test_type, test in tests.items():
+                if test._results is not None and not test.unsaved:
+                    freed += test._results.nbytes
+                    test.attach_store(lambda e=experiment_name, t=test_type: store.load_results(e, t))
+        return freed
 
     def delete(self,filepath:str):
-        os.remove(f"{filepath}\\{self.name}")
+        os.remove(os.path.join(filepath, self.name))
+        self.get_store(filepath).delete()
         del self
 if __name__ == "__main__":
     pass
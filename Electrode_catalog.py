@@ -0,0 +1,122 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from Electrode import Electrode
+
+
+class ElectrodeCatalog:
+    """Electrodes of the data folder, loaded once and kept in memory while their file is unchanged.
+
+    electrodes is the dict of loaded electrodes shared with the app. An electrode is read again only when its file
+    was modified by something else than save() (e.g. the command line importing CH files), and never while a device
+    uses it or while it holds scans not yet saved, so the objects the app works with are not replaced under it.
+    Memory is bounded by max_bytes of loaded results: results of the least recently used electrodes that are all
+    in the store are unloaded, and read again from the store when a test is plotted. Browsing (names, summaries,
+    experiments and tests) only reads the small pickled headers and the scalars of the stores."""
+
+    def __init__(self, data_path: str, electrodes: dict = None, max_bytes: int = 2 ** 30, in_use=None):
+        self.data_path = data_path
+        self.electrodes = electrodes if electrodes is not None else {}
+        self.max_bytes = max_bytes
+        self.in_use = in_use if in_use is not None else (lambda name: False)  # name -> True if a device uses it
+        self._mtimes = {}  # name -> modification time of the file when it was loaded or saved by the app
+        self._used = OrderedDict()  # names, least recently used first
+        self._names = []
+        self._folder_mtime = None
+        self._summaries = {}  # name -> (modification time of the file, summary)
+
+    def _mtime(self, name: str):
+        try:
+            return os.stat(os.path.join(self.data_path, name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def names(self) -> list:
+        """Names of the saved electrodes, the folder is listed again only when files were added or removed"""
+        folder_mtime = os.stat(self.data_path).st_mtime_ns
+        if folder_mtime != self._folder_mtime:
+            self._names = sorted(name for name in os.listdir(self.data_path)
+                                 if os.path.isfile(os.path.join(self.data_path, name)))  # skips the .store folders
+            self._folder_mtime = folder_mtime
+        return self._names
+
+    @staticmethod
+    def has_unsaved(electrode: Electrode) -> bool:
+        return any(test.unsaved for tests in list(electrode.experiments.values()) for test in tests.values())
+
+    def get(self, name: str) -> Electrode:
+        """Loaded electrode, read from its file if it is not loaded yet or the file changed"""
+        mtime = self._mtime(name)
+        electrode = self.electrodes.get(name)
+        if electrode is None or (mtime is not None and mtime != self._mtimes.get(name)
+                                 and not self.in_use(name) and not self.has_unsaved(electrode)):
+            electrode = Electrode.load(self.data_path, name)
+            self.electrodes[name] = electrode
+        self._mtimes[name] = mtime
+        self._used[name] = None
+        self._used.move_to_end(name)
+        self.trim(keep=name)
+        return electrode
+
+    def save(self, electrode: Electrode):
+        """Saves an electrode, the file it writes is not taken as modified by something else"""
+        electrode.save(self.data_path)
+        self.electrodes[electrode.name] = electrode
+        self._mtimes[electrode.name] = self._mtime(electrode.name)
+
+    def forget(self, name: str):
+        self.electrodes.pop(name, None)
+        self._mtimes.pop(name, None)
+        self._used.pop(name, None)
+        self._summaries.pop(name, None)
+
+    @staticmethod
+    def get_nbytes(electrode: Electrode) -> int:
+        """Memory of the results loaded by an electrode"""
+        return sum(test._results.nbytes for tests in list(electrode.experiments.values()) for test in tests.values()
+                   if test._results is not None)
+
+    def trim(self, keep: str = None) -> int:
+        """Unloads results of the least recently used electrodes until max_bytes is respected. Returns bytes freed"""
+        loaded = sum(self.get_nbytes(electrode) for electrode in list(self.electrodes.values()))
+        freed = 0
+        for name in [name for name in self._used if name in self.electrodes] + \
+                [name for name in self.electrodes if name not in self._used]:  # never used ones first
+            if loaded - freed <= self.max_bytes:
+                break
+            if name != keep and not self.in_use(name):
+                freed += self.electrodes[name].unload_results(self.data_path)
+        return freed
+
+    def summary(self, name: str) -> dict:
+        """Experiments, test types, scan counts and time ranges of an electrode, without loading its results.
+        {"experiments": {experiment: {test type: {"scans": n, "time": (first, last)}}},
+         "scans": total number of scans, "time": (first, last) over all tests}"""
+        mtime = self._mtime(name)
+        cached = self._summaries.get(name)
+        if cached is not None and cached[0] == mtime and mtime is not None:
+            return cached[1]
+        electrode = self.electrodes.get(name)
+        if electrode is None:  # only the header is unpickled, results stay in the store
+            electrode = Electrode.load(self.data_path, name)
+        store = electrode.get_store(self.data_path)
+        experiments = {}
+        for experiment_name, tests in list(electrode.experiments.items()):
+            experiments[experiment_name] = {}
+            for test_type, test in tests.items():
+                if test._results is not None:
+                    results = test._results
+                    time = results.column("time")
+                    experiments[experiment_name][test_type] = {
+                        "scans": len(results),
+                        "time": (float(np.nanmin(time)), float(np.nanmax(time))) if len(results) else (np.nan, np.nan)}
+                else:
+                    experiments[experiment_name][test_type] = store.summary(experiment_name, test_type)
+        tests = [test for tests in experiments.values() for test in tests.values() if test["scans"]]
+        summary = {"experiments": experiments,
+                   "scans": sum(test["scans"] for test in tests),
+                   "time": (min(test["time"][0] for test in tests), max(test["time"][1] for test in tests))
+                   if tests else (np.nan, np.nan)}
+        if not self.has_unsaved(electrode):  # otherwise the file doesn't tell when the summary changes
+            self._summaries[name] = (mtime, summary)
+        return summary
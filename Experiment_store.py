@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import numpy as np
+from Results_buffer import ResultsBuffer
+
+
+class ExperimentStore:
+    """Append-only columnar storage of the results of one electrode.
+
+    Every test of every experiment has its own folder holding one raw little-endian float64 file per column.
+    Array columns (voltammograms, coefficients) are written as fixed-width rows padded with NaN, so adding a scan
+    only appends to the end of each file, and loading can memory-map the columns instead of reading the history.
+    """
+    scalar_columns = ["index", "time", "peak_voltage", "peak_current", "concentration", "frequency"]
+    array_columns = ["raw_voltages", "raw_currents", "smooth_data", "baseline", "normalized_gain", "half_heigths"]
+    dtype = np.dtype('<f8')
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _folder(self, experiment_name: str, test_type: str) -> str:
+        return os.path.join(self.root, experiment_name, test_type)
+
+    def _read_meta(self, folder: str) -> dict:
+        try:
+            with open(os.path.join(folder, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"widths": {}}
+
+    def _write_meta(self, folder: str, meta: dict):
+        with open(os.path.join(folder, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+
+    def _widen(self, folder: str, column: str, old_width: int, new_width: int):
+        """Rewrites a column with wider rows, only happens when a longer scan than all previous ones is added"""
+        path = os.path.join(folder, f"{column}.f8")
+        data = np.fromfile(path, dtype=self.dtype)
+        rows = data.size // old_width
+        wider = np.full((rows, new_width), np.nan, dtype=self.dtype)
+        wider[:, :old_width] = data[:rows * old_width].reshape(rows, old_width)
+        wider.tofile(path)
+
+    def append(self, experiment_name: str, test_type: str, index: int, row: dict) -> int:
+        """Appends one scan, row holds the values of ResultsBuffer.columns. Returns the new number of rows"""
+        folder = self._folder(experiment_name, test_type)
+        os.makedirs(folder, exist_ok=True)
+        meta = self._read_meta(folder)
+        widths = meta["widths"]
+        values = {column: np.asarray([] if row[column] is None else row[column], dtype=self.dtype).ravel()
+                  for column in self.array_columns}
+        meta_changed = False
+        for column, value in values.items():
+            if column not in widths:
+                widths[column] = max(value.size, 1)
+                meta_changed = True
+            elif value.size > widths[column]:
+                self._widen(folder, column, widths[column], value.size)
+                widths[column] = value.size
+                meta_changed = True
+        if meta_changed:
+            self._write_meta(folder, meta)
+
+        for column, value in values.items():
+            padded = np.full(widths[column], np.nan, dtype=self.dtype)
+            padded[:value.size] = value
+            with open(os.path.join(folder, f"{column}.f8"), 'ab') as f:
+                f.write(padded.tobytes())
+        scalars = [index] + [np.nan if row[column] is None else row[column] for column in self.scalar_columns[1:]]
+        lengths = [values[column].size for column in self.array_columns]
+        with open(os.path.join(folder, "scalars.f8"), 'ab') as f:
+            f.write(np.asarray(scalars + lengths, dtype=self.dtype).tobytes())
+        return self.count(experiment_name, test_type)
+
+    def count(self, experiment_name: str, test_type: str) -> int:
+        """Number of complete rows, a row partially written by an interrupted append is ignored"""
+        folder = self._folder(experiment_name, test_type)
+        meta = self._read_meta(folder)
+        if not meta["widths"]:
+            return 0
+        sizes = [os.path.getsize(os.path.join(folder, "scalars.f8")) //
+                 (self.dtype.itemsize * (len(self.scalar_columns) + len(self.array_columns)))]
+        for column, width in meta["widths"].items():
+            sizes.append(os.path.getsize(os.path.join(folder, f"{column}.f8")) // (self.dtype.itemsize * width))
+        return min(sizes)
+
+    def load_columns(self, experiment_name: str, test_type: str, mmap: bool = True) -> dict:
+        """Returns every column as an array with one row per scan, memory-mapped by default.
+        Array columns are 2-D and padded with NaN, their true lengths are in the "lengths" dict."""
+        folder = self._folder(experiment_name, test_type)
+        meta = self._read_meta(folder)
+        rows = self.count(experiment_name, test_type)
+        n_scalars = len(self.scalar_columns) + len(self.array_columns)
+
+        def read(name, width):
+            path = os.path.join(folder, f"{name}.f8")
+            if rows == 0:
+                return np.empty((0, width), dtype=self.dtype)
+            if mmap:
+                return np.memmap(path, dtype=self.dtype, mode='r', shape=(rows, width))
+            return np.fromfile(path, dtype=self.dtype, count=rows * width).reshape(rows, width)
+
+        scalars = read("scalars", n_scalars)
+        data = {column: scalars[:, i] for i, column in enumerate(self.scalar_columns)}
+        data["lengths"] = {column: scalars[:, len(self.scalar_columns) + i].astype(int)
+                           for i, column in enumerate(self.array_columns)}
+        for column in self.array_columns:
+            data[column] = read(column, meta["widths"].get(column, 1))
+        return data
+
+    def summary(self, experiment_name: str, test_type: str) -> dict:
+        """Number of scans and time range of a test, read from the scalars file only"""
+        rows = self.count(experiment_name, test_type)
+        if rows == 0:
+            return {"scans": 0, "time": (np.nan, np.nan)}
+        scalars = np.fromfile(os.path.join(self._folder(experiment_name, test_type), "scalars.f8"), dtype=self.dtype,
+                              count=rows * (len(self.scalar_columns) + len(self.array_columns)))
+        scalars = scalars.reshape(rows, -1)
+        _, last = np.unique(scalars[::-1, 0], return_index=True)  # a rewritten index keeps its latest row
+        time = scalars[rows - 1 - last, 1]
+        return {"scans": int(last.size), "time": (float(np.nanmin(time)), float(np.nanmax(time)))}
+
+    def load_results(self, experiment_name: str, test_type: str) -> ResultsBuffer:
+        """Rebuilds the results of a test, a rewritten index keeps its latest row"""
+        return ResultsBuffer.from_columns(self.load_columns(experiment_name, test_type))
+
+    def experiments(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name))]
+
+    def delete_experiment(self, experiment_name: str):
+        folder = os.path.join(self.root, experiment_name)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+
+    def delete(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
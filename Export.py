@@ -0,0 +1,193 @@
+import gzip
+import os
+import numpy as np
+import pandas as pd
+from Results_buffer import ResultsBuffer
+
+# Export of the results to one file per test type, a column per electrode and parameter (the layout of the former
+# "Save to .csv"). Columns are taken from the results buffers without building the tests' DataFrames, aligned on
+# the union of the scan indices, and written a chunk of rows at a time: memory only depends on the chunk size,
+# and the export can report its progress and be cancelled between chunks.
+
+export_files = {"Titration": "titration", "CV": "lovric", "SWV": "voltammogram"}
+formats = {"csv": ".csv", "csv.gz": ".csv.gz", "parquet": ".parquet"}  # parquet needs pyarrow
+default_excluded = ("time", "frequency", "concentration")  # leading columns of every table
+
+
+class ExportTable:
+    """Columns of one output file, each from one test, aligned on the union of the scan indices of the tests"""
+
+    def __init__(self, test_type: str):
+        self.test_type = test_type
+        self.names = []
+        self.sources = []  # (scan indices, values, lengths of the rows of array columns or None)
+        self.index = np.empty(0, dtype=np.int64)
+        self._positions = []
+
+    def add(self, name: str, index: np.ndarray, values: np.ndarray, lengths: np.ndarray = None, suffix: str = ""):
+        if name in self.names:  # same test type, parameter and frequency in two experiments of an electrode
+            name = f"{name}_{suffix}"
+        self.names.append(name)
+        self.sources.append((index, values, lengths))
+
+    def finish(self):
+        """Aligns the columns, called once every column was added"""
+        self.index = np.unique(np.concatenate([index for index, _, _ in self.sources]))
+        self._positions = [np.searchsorted(self.index, index) for index, _, _ in self.sources]
+
+    def __len__(self) -> int:
+        return self.index.size
+
+    def get_chunk(self, start: int, stop: int) -> pd.DataFrame:
+        """Rows start to stop (excluded) in one DataFrame, array cells as lists, missing values empty"""
+        stop = min(stop, len(self))
+        frame = {}
+        for name, (_, values, lengths), positions in zip(self.names, self.sources, self._positions):
+            first, last = np.searchsorted(positions, [start, stop])
+            rows = positions[first:last] - start
+            if lengths is None:
+                column = np.full(stop - start, np.nan)
+                column[rows] = values[first:last]
+            else:
+                column = np.full(stop - start, None, dtype=object)
+                for row, cell, length in zip(rows, values[first:last].tolist(), lengths[first:last]):
+                    column[row] = cell[:length]
+            frame[name] = column
+        return pd.DataFrame(frame, index=self.index[start:stop])
+
+
+def get_column(results: ResultsBuffer, name: str):
+    """(values, lengths) of a results column, lengths is None for scalar columns"""
+    if name in ResultsBuffer.array_columns:
+        return results.column(name), results.lengths(name)
+    return results.column(name), None
+
+
+def get_tables(electrodes: dict, columns: dict = None, calibration=None) -> dict:
+    """ExportTable of each test type with data. columns selects the parameters by test type, all of them but the
+    leading time, frequency and concentration for a missing type. calibration fills the SWV concentrations, and
+    their 95% intervals when it has the parameters of bootstrap refits"""
+    tables = {}
+    for electrode in list(electrodes.values()):
+        for experiment_name in electrode.get_experiments():
+            for test_type, test in electrode.get_tests(experiment_name).items():
+                if test_type not in export_files or len(test.results) == 0:
+                    continue
+                results = test.results.snapshot()  # a device may add scans while the export runs
+                index = results.index.copy()
+                selected = (columns or {}).get(test_type)
+                names = [name for name in ResultsBuffer.columns
+                         if (name not in default_excluded if selected is None else name in selected)]
+                frequency = results.column("frequency")[0]
+                suffix = f"_{electrode.name}" if test_type == "CV" else f"_{electrode.name}_{frequency}hz"
+                scalars = {}
+                if test_type == "SWV" and calibration is not None:
+                    scalars["concentration"] = calibration.concentration(results.column("peak_current"))
+                table = tables.get(test_type)
+                if table is None:
+                    table = tables[test_type] = ExportTable(test_type)
+                    for name in ("time", "frequency" if test_type == "CV" else "concentration"):
+                        table.add(name, index, scalars.get(name, results.column(name)))
+                    if "concentration" in scalars and calibration.param_samples is not None:  # bootstrap refits
+                        low, high = calibration.concentration_interval(results.column("peak_current"))
+                        table.add("concentration_low", index, low)
+                        table.add("concentration_high", index, high)
+                if test_type == "CV":
+                    table.add(f"charge_{electrode.name}", index,
+                              results.column("peak_current") / results.column("frequency"))
+                for name in names:
+                    values, lengths = get_column(results, name)
+                    table.add(f"{name}{suffix}", index, scalars.get(name, values), lengths, experiment_name)
+    for table in tables.values():
+        table.finish()
+    return tables
+
+
+class ParquetWriter:
+    """Writes chunks as row groups of one parquet file, with a schema fixed by the table so that chunks where a
+    column has no value still match"""
+
+    def __init__(self, path: str, table: ExportTable):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        fields = [pa.field("index", pa.int64())]
+        for name, (_, _, lengths) in zip(table.names, table.sources):
+            fields.append(pa.field(name, pa.float64() if lengths is None else pa.list_(pa.float64())))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, chunk: pd.DataFrame):
+        arrays = [self.pa.array(chunk.index.to_numpy(), type=self.pa.int64())]
+        for field in list(self.schema)[1:]:
+            arrays.append(self.pa.array(chunk[field.name].to_numpy(), type=field.type, from_pandas=True))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def write_table(table: ExportTable, path: str, file_format: str = "csv", chunk_rows: int = 1000,
+                on_chunk=None, cancel=None) -> bool:
+    """Writes a table chunk by chunk to a temporary file renamed to path when complete.
+    on_chunk(rows) is called after each chunk, cancel is a threading.Event checked between chunks.
+    Returns False, leaving no file, if cancelled"""
+    temporary = path + ".part"
+    if file_format == "parquet":
+        writer = ParquetWriter(temporary, table)
+    elif file_format == "csv.gz":
+        writer = gzip.open(temporary, "wt", compresslevel=6, newline="")  # level 9 is slower for little gain
+    else:
+        writer = open(temporary, "w", newline="")
+    completed = False
+    try:
+        for start in range(0, len(table), chunk_rows):
+            if cancel is not None and cancel.is_set():
+                return False
+            chunk = table.get_chunk(start, start + chunk_rows)
+            if file_format == "parquet":
+                writer.write(chunk)
+            else:
+                chunk.to_csv(writer, header=start == 0)
+            if on_chunk is not None:
+                on_chunk(len(chunk))
+        completed = True
+    finally:
+        writer.close()
+        if completed:
+            os.replace(temporary, path)
+        else:
+            os.remove(temporary)
+    return True
+
+
+def export(electrodes: dict, output_folder: str, columns: dict = None, calibration=None, file_format: str = "csv",
+           chunk_rows: int = 1000, progress=None, cancel=None) -> dict:
+    """Writes titration, lovric and voltammogram files to output_folder for the tests with data.
+    progress(rows written, total rows) is called after each chunk, from the calling thread.
+    Returns the paths written by test type, None if cancelled (files written before are kept)"""
+    if file_format not in formats:
+        raise ValueError(f"Unknown format {file_format}, use one of {', '.join(formats)}")
+    if file_format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+    tables = get_tables(electrodes, columns, calibration)
+    total = sum(len(table) for table in tables.values())
+    written = 0
+
+    def on_chunk(rows):
+        nonlocal written
+        written += rows
+        if progress is not None:
+            progress(written, total)
+
+    os.makedirs(output_folder, exist_ok=True)
+    paths = {}
+    for test_type, table in tables.items():
+        path = os.path.join(output_folder, export_files[test_type] + formats[file_format])
+        if not write_table(table, path, file_format, chunk_rows, on_chunk, cancel):
+            return None
+        paths[test_type] = path
+    return paths
@@ -0,0 +1,125 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from Data_processing import HillFit, r2_score
+
+
+def fit_hill(concentration: np.ndarray, gain: np.ndarray, p0=None, reverse: bool = False) -> HillFit:
+    """Hill fit of titration points, gains in reverse order if reverse. Runs in a worker process of the analysis"""
+    hf = HillFit(concentration, gain[::-1] if reverse else gain)
+    hf.fitting(p0=p0)
+    if reverse:
+        hf.y_fit = np.flip(hf.y_fit)
+    return hf
+
+
+class FitCache:
+    """Fits of the displayed titration by range of points, so moving the fit limits back and forth doesn't refit.
+
+    Fits are keyed by (titration, first index, last index, model). The titration is identified by a digest of its
+    concentrations and gains: a new scan or another titration makes new keys, and the least recently used fits
+    are dropped beyond max_fits. A Hill fit of a new range starts from the parameters of the cached fit of the
+    same titration with the closest range. Positions of the concentrations are kept in a dict, looking up
+    the limits costs O(1) instead of a list.index() scan."""
+
+    def __init__(self, max_fits: int = 256):
+        self.max_fits = max_fits
+        self.titration = None  # digest of the titration set last
+        self.concentration = np.empty(0)
+        self.gain = np.empty(0)
+        self.positions = {}  # concentration -> index of its first point
+        self.sorted_concentrations = np.empty(0)
+        self._fits = OrderedDict()  # (titration, start, stop, model) -> fit, least recently used first
+        self.stats = {"hits": 0, "misses": 0, "warm_starts": 0}
+
+    def set_titration(self, concentration, gain) -> bool:
+        """Selects the titration to fit, returns False if it is the one already selected"""
+        concentration = np.ascontiguousarray(concentration, dtype=float)
+        gain = np.ascontiguousarray(gain, dtype=float)
+        titration = hashlib.blake2b(concentration.tobytes() + gain.tobytes(), digest_size=16).digest()
+        if titration == self.titration:
+            return False
+        self.titration = titration
+        self.concentration, self.gain = concentration, gain
+        self.positions = {}
+        for position, value in enumerate(concentration.tolist()):
+            self.positions.setdefault(value, position)  # first point, like list.index()
+        self.sorted_concentrations = np.unique(concentration[np.isfinite(concentration)])
+        return True
+
+    def index(self, concentration: float) -> int:
+        """Index of the first point of the titration at this concentration"""
+        return self.positions[float(concentration)]
+
+    def nearest(self, concentration: float) -> float:
+        """Concentration of the titration closest to a value, e.g. where the user clicked"""
+        values = self.sorted_concentrations
+        position = int(np.clip(np.searchsorted(values, concentration), 1, len(values) - 1)) if len(values) > 1 else 0
+        if position and concentration - values[position - 1] <= values[position] - concentration:
+            position -= 1
+        return float(values[position])
+
+    def _get(self, key: tuple):
+        fit = self._fits.get(key)
+        if fit is not None:
+            self._fits.move_to_end(key)
+            self.stats["hits"] += 1
+        return fit
+
+    def _put(self, key: tuple, fit):
+        self.stats["misses"] += 1
+        self._fits[key] = fit
+        if len(self._fits) > self.max_fits:
+            self._fits.popitem(last=False)
+
+    def _nearest_params(self, start: int, stop: int, model: str):
+        """Parameters of the cached fit of the current titration whose range is the closest to [start, stop]"""
+        best, distance = None, None
+        for (titration, fit_start, fit_stop, fit_model), fit in self._fits.items():
+            if titration == self.titration and fit_model == model and hasattr(fit, "params"):
+                fit_distance = abs(fit_start - start) + abs(fit_stop - stop)
+                if distance is None or fit_distance < distance:
+                    best, distance = fit.params, fit_distance
+        return best
+
+    def get_key(self, start: int, stop: int, reverse: bool = False) -> tuple:
+        """Key of the Hill fit of the points start to stop of the current titration"""
+        return self.titration, start, stop, "Hill reversed" if reverse else "Hill"
+
+    def lookup_hill(self, start: int, stop: int, reverse: bool = False):
+        """Cached Hill fit of the points start to stop (inclusive), None if it was not fitted yet"""
+        return self._get(self.get_key(start, stop, reverse))
+
+    def prepare_hill(self, start: int, stop: int, reverse: bool = False) -> tuple:
+        """Arguments of fit_hill for the points start to stop, warm-started from the closest cached fit"""
+        p0 = self._nearest_params(start, stop, self.get_key(start, stop, reverse)[3])
+        if p0 is not None:
+            self.stats["warm_starts"] += 1
+        return self.concentration[start:stop + 1], self.gain[start:stop + 1], p0, reverse
+
+    def add(self, key: tuple, fit):
+        """Caches a fit computed elsewhere, e.g. by the analysis executor, under the key it was prepared for"""
+        self._put(key, fit)
+
+    def get_hill(self, start: int, stop: int, reverse: bool = False) -> HillFit:
+        """Hill fit of the points start to stop (inclusive), gains in reverse order if reverse"""
+        hf = self.lookup_hill(start, stop, reverse)
+        if hf is None:
+            hf = fit_hill(*self.prepare_hill(start, stop, reverse))
+            self._put(self.get_key(start, stop, reverse), hf)
+        return hf
+
+    def get_linear(self, start: int, stop: int) -> tuple:
+        """(coefs, fitted gains, R²) of the linear fit of the points start to stop (inclusive)"""
+        key = (self.titration, start, stop, "Linear")
+        fit = self._get(key)
+        if fit is None:
+            concentration, gain = self.concentration[start:stop + 1], self.gain[start:stop + 1]
+            coefs = np.polyfit(concentration, gain, 1)
+            fitted = np.polyval(coefs, concentration)
+            fit = (coefs, fitted, r2_score(gain, fitted))
+            self._put(key, fit)
+        return fit
+
+    def clear(self):
+        self._fits.clear()
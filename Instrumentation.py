@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from time import perf_counter_ns
+
+# Latency histograms and counters of the acquisition-to-plot pipeline: serial/BLE chunks, line parsing and frame
+# decoding, extract_gains, add_result, store writes and plot redraws. Off by default, a disabled probe costs one
+# function call and a test:
+#
+#     started = Instrumentation.start()
+#     ...
+#     Instrumentation.stop("stage", started)
+#
+# Turned on with "python SwiftMote_gui.py --instrument" or from the Help menu, see snapshot() for what is recorded.
+# Worker processes of the analysis pool have their own copy of this module: jobs running there are timed by the
+# caller, submission and result transfer included.
+
+enabled = False
+_lock = threading.Lock()
+_histograms = {}  # stage -> Histogram
+_counters = {}  # name -> count
+_started = time.time()
+_profile = None  # cProfile.Profile while a capture runs
+
+
+class Histogram:
+    """Latency histogram with buckets of powers of 2 microseconds, O(1) per sample.
+    Bucket 0 holds samples under 1 µs, bucket k samples from 2^(k-1) to 2^k µs"""
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0  # ns
+        self.max = 0  # ns
+
+    def add(self, ns: int):
+        self.counts[min((ns // 1000).bit_length(), self.buckets - 1)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q: float) -> float:
+        """Upper bound in ms of the bucket holding the q-th percentile (q in 0-100)"""
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** bucket / 1000, self.max / 1e6)
+        return self.max / 1e6
+
+    def to_dict(self) -> dict:
+        return {"count": self.count,
+                "mean_ms": self.total / self.count / 1e6 if self.count else 0.0,
+                "p50_ms": self.percentile(50), "p90_ms": self.percentile(90), "p99_ms": self.percentile(99),
+                "max_ms": self.max / 1e6,
+                "buckets_us": {f"<{2 ** bucket}": count for bucket, count in enumerate(self.counts) if count}}
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def start() -> int:
+    """Start time of a probe, 0 when disabled"""
+    return perf_counter_ns() if enabled else 0
+
+
+def stop(stage: str, started: int):
+    """Records the time since start() in the histogram of a stage, nothing if the probe started disabled"""
+    if started:
+        record(stage, perf_counter_ns() - started)
+
+
+def record(stage: str, ns: int):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.add(ns)
+
+
+def count(name: str, n: int = 1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def snapshot() -> dict:
+    """{"enabled", "since": time the counts started, "stages": {stage: Histogram.to_dict()}, "counters": {}}"""
+    with _lock:
+        return {"enabled": enabled, "since": _started, "time": time.time(),
+                "stages": {stage: histogram.to_dict() for stage, histogram in _histograms.items()},
+                "counters": dict(_counters)}
+
+
+def reset():
+    global _started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def dump(filepath: str, extra: dict = None):
+    """Writes snapshot() (and extra sections) as JSON, replacing the file atomically"""
+    data = snapshot()
+    if extra:
+        data.update(extra)
+    temporary = filepath + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f, indent=1, default=str)  # e.g. exceptions in device progress
+    os.replace(temporary, filepath)
+
+
+def toggle_profile(output_folder: str, top: int = 25) -> str:
+    """Starts a cProfile capture, or stops the running one and saves it to output_folder.
+    Only the calling thread is profiled, i.e. the Tk/asyncio thread when called from the GUI.
+    Returns a message, with the functions taking the most cumulative time when a capture stops"""
+    global _profile
+    import cProfile
+    import io
+    import pstats
+    if _profile is None:
+        _profile = cProfile.Profile()
+        _profile.enable()
+        return "Profiling started, press the shortcut again to stop"
+    _profile.disable()
+    profile, _profile = _profile, None
+    filepath = os.path.join(output_folder, time.strftime("profile_%Y-%m-%d_%H-%M-%S.prof"))
+    profile.dump_stats(filepath)
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(top)
+    return f"Profile saved to {filepath}\n{text.getvalue()}"
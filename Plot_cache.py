@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class PlotCache:
+    """Values derived from each scan of the displayed test, computed once per scan instead of on every redraw.
+
+    Rows are keyed by (index, time): a rewritten index comes from a new scan and gets a new time.
+    Evaluated baseline and gain curves and the per-scan current/gain extrema only depend on the scan,
+    inferred concentrations also depend on the Calibration and are dropped only when it changes."""
+
+    def __init__(self):
+        self.owner = None
+        self._rows = {}  # (index, time) -> derived values of the scan
+        self._calibration = None
+        self._concentrations = {}  # (index, time) -> concentration, NaN when the calibration can't invert the scan
+
+    def bind(self, owner):
+        """Clears the cache when the plots switch to the results of another test"""
+        if owner is not self.owner:
+            self.owner = owner
+            self._rows = {}
+            self._calibration = None
+            self._concentrations = {}
+
+    @staticmethod
+    def _keys(df) -> list:
+        return list(zip(df.index, df['time']))
+
+    def get_rows(self, df) -> list:
+        """Derived values of every row of df, in the order of df; only new scans are evaluated"""
+        rows = []
+        for position, key in enumerate(self._keys(df)):
+            row = self._rows.get(key)
+            if row is None:
+                voltages = df['raw_voltages'].iloc[position]
+                raw_currents = np.asarray(df['raw_currents'].iloc[position][25:], dtype=float)
+                gain = np.polyval(df['normalized_gain'].iloc[position], voltages)
+                row = {"baseline": np.polyval(df['baseline'].iloc[position], voltages),
+                       "gain": gain,
+                       "min_current": raw_currents.min() if raw_currents.size else np.nan,
+                       "max_current": raw_currents.max() if raw_currents.size else np.nan,
+                       "min_gain": np.min(gain),
+                       "max_gain": np.max(gain)}
+                self._rows[key] = row
+            rows.append(row)
+        return rows
+
+    def get_extrema(self, df) -> dict:
+        """Minimum and maximum raw current and gain over all scans of df"""
+        rows = self.get_rows(df)
+        return {name: np.nanmin([row[name] for row in rows]) if name.startswith("min")
+                else np.nanmax([row[name] for row in rows])
+                for name in ("min_current", "max_current", "min_gain", "max_gain")}
+
+    def get_concentrations(self, df, calibration) -> np.ndarray:
+        """Concentration inferred by a Calibration from the peak current of each row of df, NaN where it can't
+        be inverted. Rows not seen since the calibration last changed are converted in one call."""
+        peak_currents = df['peak_current'].to_numpy(dtype=float)
+        key = calibration.key + (peak_currents[0],)  # gains are normalized by the first scan
+        if key != self._calibration:
+            self._calibration = key
+            self._concentrations = {}
+        keys = self._keys(df)
+        missing = [position for position, row in enumerate(keys) if row not in self._concentrations]
+        if missing:
+            values = calibration.concentration(peak_currents[missing], reference=peak_currents[0])
+            self._concentrations.update(zip((keys[position] for position in missing), values))
+        return np.array([self._concentrations[row] for row in keys], dtype=float)
@@ -5,18 +5,24 @@ from dateutil import tz
 import tkinter as tk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import numpy as np
+from Decimation import DecimatedLine
 
 class Plot():
     prev_min_pt = None
     prev_max_pt = None
 
-    def __init__(self,master,frame):
+    def __init__(self,master,frame, blit: bool = True):
         """Initializes plots
                 param self: reference to parent object
+                param blit: only redraw the real-time lines over a cached background, see render()
                 """
         self.master = master
         self.min_pt = 10000
         self.max_pt = -10000
+        self.blit = blit
+        self._background = None  # figure without the animated lines, captured after each full draw
+        self._layout_key = None  # axes limits and figure size of the captured background
+        self._full_redraw = True
 
 
         plt.rcParams['axes.grid'] = True  # enables all grid lines globally
@@ -80,6 +86,12 @@ class Plot():
         plt.setp(self.rt_concentration.get_xticklabels(), rotation=45, horizontalalignment='right')
         self.rt_concentration.set_xlabel("Time")
         self.rt_concentration.set_ylabel("Concentration (mol/L)")
+
+        # time series of a whole run: set through rt_lines, which draw the visible range decimated to the axes width
+        self.rt_lines = {name: DecimatedLine(line) for name, line in
+                         (*self.rt_peak_data.items(), *self.rt_concentration_data.items()) if name != "current rt Peak"}
+        for ax in (self.rt_peak, self.rt_concentration):
+            ax.callbacks.connect('xlim_changed', self._on_xlim_changed)  # zoom and pan fetch finer detail
         #####################################################################################################################################################
 
         frame_plots = tk.Frame(master=frame)
@@ -111,10 +123,7 @@ class Plot():
                             x = event.xdata
                             concentrations = (self.titration_data["titration"].get_data())[0]
                             mid_val = np.median(concentrations)
-                            minimum = {_conc: abs(_conc - x) for _conc in concentrations}
-                            values = list(minimum.values())
-                            min_val = np.min(list(minimum.values()))
-                            conc_ = list(minimum.keys())[values.index(min_val)]
+                            conc_ = master.fit_cache.nearest(x)
                             if x <= mid_val:
                                 self.min_pt = conc_
                             else:
@@ -130,6 +139,8 @@ class Plot():
                 debug()
 
         self.canvas.mpl_connect('button_press_event', onclick)
+        self.canvas.mpl_connect('draw_event', self._on_draw)  # full draws also come from resizing, pan and zoom
+        self.set_blit(blit)
 
         def apply_tight_layout(event: tk.Event):
             """when resize the whole window, the plot part of the window is resized """
@@ -150,7 +161,69 @@ class Plot():
         frame_toolbar.grid(row=0, column=0, sticky="nsew", rowspan=2)
         frame_slider.grid(row=0, column=1, sticky="ns")
 
+    def get_animated_lines(self) -> list:
+        """Lines updated in real time, blitted over the background when blitting is on"""
+        return [*self.volt_graph_data.values(), *self.gain_data.values(), *self.rt_peak_data.values(),
+                *self.rt_concentration_data.values()]
+
+    def set_blit(self, blit: bool):
+        self.blit = blit
+        for line in self.get_animated_lines():
+            line.set_animated(blit)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forces a full redraw on the next render, e.g. after the titration graph, labels or legends changed"""
+        self._full_redraw = True
+
+    def _on_xlim_changed(self, ax):
+        for decimated in self.rt_lines.values():
+            if decimated.line.axes is ax:
+                decimated.refresh()
+
+    def refresh_decimated(self):
+        """Decimates the rt lines again if the visible range or the width of their axes changed"""
+        for decimated in self.rt_lines.values():
+            decimated.refresh()
+
+    def _get_layout_key(self) -> tuple:
+        return (self.fig.bbox.width, self.fig.bbox.height,
+                *(limit for ax in (self.volt_graph, self.gain, self.rt_peak, self.titration, self.rt_concentration)
+                  for limit in (*ax.get_xlim(), *ax.get_ylim())))
+
+    def _on_draw(self, event):
+        if self.blit:
+            self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self._layout_key = self._get_layout_key()
+            self._draw_animated()
+
+    def _draw_animated(self):
+        for line in self.get_animated_lines():
+            line.axes.draw_artist(line)
+
+    def render(self):
+        """Shows the current data. Without blitting, the whole figure is laid out and drawn.
+        With blitting, the layout and static parts (axes, ticks, labels, titration graph) are only redrawn
+        when an axis range or the figure size changed or after invalidate(), otherwise the cached background
+        is restored and only the real-time lines are drawn over it."""
+        if not self.blit:
+            self.fig.tight_layout()
+            self.refresh_decimated()
+            self.canvas.draw()
+            return
+        if self._full_redraw or self._background is None or self._layout_key != self._get_layout_key():
+            self._full_redraw = False
+            self.fig.tight_layout()
+            self.refresh_decimated()  # the axes width may have changed
+            self.canvas.draw()  # the draw_event captures the new background and draws the lines
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_animated()
+        self.canvas.blit(self.fig.bbox)
+
     def reset_titration_graph(self):
+        if len(self.titration_data["titration"].get_xdata()):
+            self.invalidate()
         self.titration_data["titration"].set_data([], [])
         self.titration_data["fit"].set_data([], [])
         self.titration_data["lims"].set_data([], [])
@@ -163,8 +236,6 @@ class Plot():
         self.gain_data["Gain"].set_data([], [])
         self.gain_data["PeakX"].set_data([], [])
         self.gain_data["PeakY"].set_data([], [])
-        self.rt_peak_data["rt Peaks"].set_data([], [])
-        self.rt_peak_data["rt Peaks max"].set_data([], [])
-        self.rt_peak_data["rt Peaks min"].set_data([], [])
+        for decimated in self.rt_lines.values():
+            decimated.set_data([], [])
         self.rt_peak_data["current rt Peak"].set_data([], [])
-        self.rt_concentration_data["rt concentration"].set_data([], [])
@@ -1,103 +1,156 @@
-import pickle
-
 from dateutil import parser
-from tkinter import filedialog
+from concurrent.futures import ProcessPoolExecutor
+import io
 import os
+import time
+import numpy as np
+from Data_processing import extract_gains
 from Electrode import Electrode
 from  Utils import debug
 import pandas as pd
 
 
+def ask_CH_files(test_type: str):
+    """Asks for a CH data folder, and the concentration file of a titration.
+    Returns (data path, concentration list or None), None if cancelled"""
+    data_path = find_data_filepath()
+    if data_path is None:
+        return None
+    concentration_list = None
+    if test_type == "Titration":
+        concentration = find_concentration_file()
+        if concentration is None:
+            return None
+        concentration_list = read_concentration_file(concentration)
+    return data_path, concentration_list
+
+
 def process_CH_File(master, data_folder, test_type: str):
     try:
-        data_path = find_data_filepath()
-        if data_path is None:
+        selected = ask_CH_files(test_type)
+        if selected is None:
             return
-        if test_type == "Titration":
-            concentration = find_concentration_file()
-            if concentration is not None:
-                with open(concentration) as Conc_file:
-                    temp_concentration = Conc_file.read().split()
-                    concentration_list = [float(item)for item in temp_concentration]
-            else:
-                return
-            if concentration_list[0] == 0:
-                concentration_list[0] = concentration_list[1]
-        electrode_list = {}
-        for fi in os.listdir(data_path):
-            if fi.__contains__(".txt") and fi.__contains__("Hz_"):
-                ##################################### opeining file to get data ################
-                try:
-                    df = pd.read_table(data_path + "\\" + fi, encoding='utf-8')
-                except UnicodeEncodeError:
-                    print("cant open utf-8")
-                    try:
-                        df = pd.read_table(data_path + "\\" + fi, encoding='ANSI')
-                    except UnicodeEncodeError as e:
-                        print("cant open ansi")
-                        break
-                ##############################################################
-                dt = str(df.iloc[0]).split("    ")[0]
-                dt = parser.parse(dt)
-                exp_datetime = float(dt.timestamp() / 86400)
-                df = pd.read_csv(data_path + "\\" + fi, header=7)
-
-                file = fi.replace(".txt", "")
-                for i in range(10):
-                    file = file.replace("__", "_")
-                file = file.split("_")
-                frequency = int(file[-2].replace("Hz", ""))
-                experiment_name = f'{str(file[-3])}_{frequency}Hz'
-                sample = int(file[-1])
-                index = 1
-                for i in range(1, df.shape[1] - 1, 3): # splitting CH file into electrodes
-                    electrode_name = f"E{str(index)}_{str(file[-3])}"
-
-                    if electrode_name in os.listdir(f"{os.getcwd()}\\data"): # if electrode not in list but is saved in data, load it and add to list
-                        with open(f"{os.getcwd()}\\data\\{electrode_name}", "rb") as f:
-                            electrode_list[electrode_name] = (pickle.load(f))
-                        # print(f'{electrode_name} already in data folder')
-
-                    elif electrode_name in electrode_list.keys(): # if electrode is already in the list, pass
-                        # print(f'{electrode_name} already in list')
-                        pass
-
-                    else:
-                        electrode_list[electrode_name] = Electrode(electrode_name) # else, create new electrode
-                        # print(f'creating {electrode_name}')
-
-                    if experiment_name not in electrode_list[electrode_name].get_experiments():
-                        electrode_list[electrode_name].create_experiment(experiment_name)
-                        # print(f'creating experiment {experiment_name} for {electrode_name}')
-
-                    exp = electrode_list[electrode_name].get_tests(experiment_name)
-                    sorted_vals = sorted(list(zip(df.iloc[:, 0].tolist(), df.iloc[:,i].tolist())))
-                    voltages = [val[0] for val in sorted_vals]
-                    currents = [val[1] * 1e6 for val in sorted_vals]
-                    exp[test_type].add_result(sample, exp_datetime, voltages, currents, frequency, concentration_list[sample - 1])
-                    index += 1
-
-
-                master.print(str(fi) + ' processed')
-
-        master.print('All files have been processed without error')
-
-        for electrode in electrode_list.values():
-            electrode.save(data_folder)
-
-        return electrode_list
+        data_path, concentration_list = selected
+        return import_CH_files(data_path, data_folder, test_type, concentration_list, log=master.print)
     except Exception as e:
         debug()
         master.print(f"{e}")
         return 0
 
 
+def read_concentration_file(filepath: str) -> list:
+    with open(filepath) as Conc_file:
+        concentration_list = [float(item) for item in Conc_file.read().split()]
+    if concentration_list[0] == 0:
+        concentration_list[0] = concentration_list[1]
+    return concentration_list
+
+
+def parse_CH_filename(filename: str):
+    """Splits "<name>_<frequency>Hz_<sample>.txt" into (experiment name, frequency, sample, name)"""
+    file = filename.replace(".txt", "")
+    for i in range(10):
+        file = file.replace("__", "_")
+    file = file.split("_")
+    frequency = int(file[-2].replace("Hz", ""))
+    return f'{str(file[-3])}_{frequency}Hz', frequency, int(file[-1]), str(file[-3])
+
+
+def read_CH_file(filepath: str):
+    """Reads a CH Instruments export once, returns (date in days, DataFrame of the data table)"""
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        print("cant open utf-8")
+        text = raw.decode('latin-1')
+    dt = parser.parse(text.splitlines()[0].split("    ")[0])  # first line of the file holds the date
+    return float(dt.timestamp() / 86400), pd.read_csv(io.StringIO(text), header=7)
+
+
+def process_CH_columns(filepath: str):
+    """Parses one CH file and extracts the gains of each of its electrodes, run in a worker process.
+    Returns (date, [(electrode number, voltages, currents, gains), ...]), gains is None when extraction failed"""
+    exp_datetime, df = read_CH_file(filepath)
+    all_voltages = df.iloc[:, 0].to_numpy(dtype=float)
+    columns = []
+    index = 1
+    for i in range(1, df.shape[1] - 1, 3):  # splitting CH file into electrodes
+        all_currents = df.iloc[:, i].to_numpy(dtype=float)
+        order = np.lexsort((all_currents, all_voltages))  # sorted by voltage, then current
+        voltages = all_voltages[order].tolist()
+        currents = (all_currents[order] * 1e6).tolist()
+        try:
+            gains = extract_gains(voltages, currents)
+        except Exception:
+            debug()
+            gains = None
+        columns.append((index, voltages, currents, gains))
+        index += 1
+    return exp_datetime, columns
+
+
+def import_CH_files(data_path: str, data_folder: str, test_type: str, concentration_list: list = None,
+                    max_workers: int = None, log=print) -> dict:
+    """Imports every "*Hz_*.txt" file of a CH Instruments folder into the electrodes of data_folder.
+
+    Files are parsed and their gains extracted in a process pool (max_workers=1 runs in this process),
+    electrodes stay in memory for the whole batch and each one is saved once at the end.
+    Returns the electrodes by name."""
+    started = time.perf_counter()
+    files = [fi for fi in sorted(os.listdir(data_path)) if fi.__contains__(".txt") and fi.__contains__("Hz_")]
+    paths = [os.path.join(data_path, fi) for fi in files]
+    electrode_list = {}
+
+    def get_electrode(electrode_name):
+        if electrode_name not in electrode_list:
+            if os.path.isfile(os.path.join(data_folder, electrode_name)):  # saved in data, load it once for the batch
+                electrode_list[electrode_name] = Electrode.load(data_folder, electrode_name)
+            else:
+                electrode_list[electrode_name] = Electrode(electrode_name)
+        return electrode_list[electrode_name]
+
+    if max_workers == 1:
+        parsed = map(process_CH_columns, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        parsed = executor.map(process_CH_columns, paths, chunksize=max(1, len(paths) // (4 * (os.cpu_count() or 1))))
+    try:
+        for fi, (exp_datetime, columns) in zip(files, parsed):
+            experiment_name, frequency, sample, name = parse_CH_filename(fi)
+            concentration = concentration_list[sample - 1] if concentration_list is not None else None
+            for index, voltages, currents, gains in columns:
+                if gains is None:
+                    log(f"{fi}: could not extract the gains of electrode {index}")
+                    continue
+                electrode = get_electrode(f"E{str(index)}_{name}")
+                if experiment_name not in electrode.get_experiments():
+                    electrode.create_experiment(experiment_name)
+                exp = electrode.get_tests(experiment_name)
+                exp[test_type].add_result(sample, exp_datetime, voltages, currents, frequency, concentration, gains)
+            log(str(fi) + ' processed')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    for electrode in electrode_list.values():
+        electrode.save(data_folder)
+    elapsed = time.perf_counter() - started
+    log(f'All files have been processed without error: {len(files)} files in {elapsed:.1f} s '
+        f'({len(files) / elapsed if elapsed else 0:.1f} files/s)')
+    return electrode_list
+
+
 def find_data_filepath():
+    from tkinter import filedialog
     filepath = filedialog.askdirectory(title="Please Select CH data folder")
     if os.path.isdir(filepath):
         return filepath
 
 def find_concentration_file():
+    from tkinter import filedialog
     filepath = filedialog.askopenfilename(title="Please Select CH concentration file", filetypes=(("text files", "*.txt"),))
     if os.path.isfile(filepath):
         return filepath
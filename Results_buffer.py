@@ -0,0 +1,212 @@
+import copy
+import numpy as np
+import pandas as pd
+
+
+class ResultsBuffer:
+    """Growable, array-backed results of a test.
+
+    Scalars are kept in 1-D NumPy buffers and voltammograms/coefficients in 2-D buffers padded with NaN.
+    Capacity doubles when full, so adding a scan is amortized O(1), and rewriting an existing index is done in place.
+    Rows are kept in arrival order, sorting by index only happens when a column or the DataFrame is asked for.
+    The DataFrame with list cells used by the GUI and the CSV export is built by get_df() and cached until the next add.
+    One thread adds rows (a device worker) while others read: add() writes the values of a new row before it publishes
+    it, and readers needing several columns of the same rows take a snapshot().
+    """
+    columns = ["time",
+               "raw_voltages",
+               "raw_currents",
+               "baseline",
+               "normalized_gain",
+               "peak_voltage",
+               "peak_current",
+               "half_heigths",
+               "smooth_data",
+               "concentration",
+               "frequency"]
+    scalar_columns = ["time", "peak_voltage", "peak_current", "concentration", "frequency"]
+    array_columns = ["raw_voltages", "raw_currents", "smooth_data", "baseline", "normalized_gain", "half_heigths"]
+
+    def __init__(self, capacity: int = 16):
+        self.size = 0
+        self._capacity = max(capacity, 1)
+        self._index = np.empty(self._capacity, dtype=np.int64)
+        self._scalars = {column: np.empty(self._capacity) for column in self.scalar_columns}
+        self._arrays = {column: np.full((self._capacity, 1), np.nan) for column in self.array_columns}
+        self._lengths = {column: np.zeros(self._capacity, dtype=np.int64) for column in self.array_columns}
+        self._positions = {}  # index -> row in the buffers
+        self._monotonic = True  # indices were added in ascending order, columns can be returned as views
+        self._order = None
+        self._df = None  # (version, DataFrame)
+        self._version = 0  # incremented by every add
+        self._shared = False  # the buffers belong to the caller of from_columns (e.g. read-only memmaps)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, index) -> bool:
+        return index in self._positions
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the buffers, memory-mapped columns are left on disk and not counted"""
+        return self._index.nbytes + sum(values.nbytes for buffers in (self._scalars, self._arrays, self._lengths)
+                                        for values in buffers.values() if not isinstance(values, np.memmap))
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_order"] = None
+        state["_df"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_version", 0)  # pickled by older versions
+        self.__dict__.setdefault("_shared", False)
+
+    def _grow(self, capacity: int):
+        """Copies the rows into new buffers of capacity rows, which this buffer owns"""
+        self._index = np.resize(self._index, capacity)
+        for column, values in self._scalars.items():
+            grown = np.empty(capacity)
+            grown[:self.size] = values[:self.size]
+            self._scalars[column] = grown
+        for column, values in self._arrays.items():
+            grown = np.full((capacity, values.shape[1]), np.nan)
+            grown[:self.size] = values[:self.size]
+            self._arrays[column] = grown
+            grown = np.zeros(capacity, dtype=np.int64)
+            grown[:self.size] = self._lengths[column][:self.size]
+            self._lengths[column] = grown
+        self._capacity = capacity
+        self._shared = False
+
+    def _widen(self, column: str, width: int):
+        values = self._arrays[column]
+        wider = np.full((self._capacity, width), np.nan)
+        wider[:, :values.shape[1]] = values
+        self._arrays[column] = wider
+
+    def add(self, index: int, row: dict) -> int:
+        """Adds or overwrites the row of an index, row holds the values of ResultsBuffer.columns.
+        Returns the position of the row in the buffers. A new row is only published (size, positions) once its values
+        are written, so threads reading the buffer meanwhile don't see it half-written."""
+        position = self._positions.get(index)
+        new = position is None
+        if new and self.size == self._capacity:
+            self._grow(2 * self._capacity)
+        elif self._shared:  # copy-on-write of the columns of from_columns
+            self._grow(self._capacity)
+        if new:
+            position = self.size
+        for column in self.scalar_columns:
+            value = row[column]
+            self._scalars[column][position] = np.nan if value is None else value
+        for column in self.array_columns:
+            value = np.asarray([] if row[column] is None else row[column], dtype=float).ravel()
+            if value.size > self._arrays[column].shape[1]:
+                self._widen(column, value.size)
+            self._arrays[column][position, :value.size] = value
+            self._arrays[column][position, value.size:] = np.nan
+            self._lengths[column][position] = value.size
+        if new:
+            self._index[position] = index
+            if self.size > 0 and index < self._index[self.size - 1]:
+                self._monotonic = False
+            self._positions[index] = position
+            self.size += 1
+        self._order = None
+        self._version += 1
+        return position
+
+    def row(self, index: int) -> dict:
+        """Values of one index, array columns as lists"""
+        position = self._positions[index]
+        data = {column: self._scalars[column][position] for column in self.scalar_columns}
+        for column in self.array_columns:
+            data[column] = self._arrays[column][position, :self._lengths[column][position]].tolist()
+        return data
+
+    def _sorted(self, values: np.ndarray) -> np.ndarray:
+        """Rows of a buffer ordered by index, a view when indices arrived in ascending order"""
+        size = self.size
+        if self._monotonic:
+            return values[:size]
+        order = self._order
+        if order is None or order.size != size:  # the order of fewer rows if one was added meanwhile
+            order = self._order = np.argsort(self._index[:size], kind='stable')
+        return values[order]
+
+    def snapshot(self) -> "ResultsBuffer":
+        """Read-only view of the rows added so far, sharing the buffers: its size, index and columns stay the same
+        while rows are added to this buffer, e.g. for an export running in a thread"""
+        snapshot = copy.copy(self)
+        snapshot._scalars = dict(self._scalars)  # _grow and _widen replace the buffers of this one
+        snapshot._arrays = dict(self._arrays)
+        snapshot._lengths = dict(self._lengths)
+        snapshot._order = None
+        snapshot._df = None
+        return snapshot
+
+    @property
+    def index(self) -> np.ndarray:
+        return self._sorted(self._index)
+
+    def column(self, name: str) -> np.ndarray:
+        """Column ordered by index, 1-D for scalars, 2-D padded with NaN for array columns"""
+        if name in self._scalars:
+            return self._sorted(self._scalars[name])
+        return self._sorted(self._arrays[name])
+
+    def lengths(self, name: str) -> np.ndarray:
+        """Number of values of each row of an array column, ordered by index"""
+        return self._sorted(self._lengths[name])
+
+    def get_df(self) -> pd.DataFrame:
+        cached = self._df
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        version = self._version
+        results = self.snapshot()
+        frame = {}
+        for column in self.columns:
+            if column in results._arrays:
+                frame[column] = [values[:length] for values, length in
+                                 zip(results.column(column).tolist(), results.lengths(column))]
+            else:
+                frame[column] = results.column(column).copy()
+        df = pd.DataFrame(frame, columns=self.columns, index=results.index.copy())
+        self._df = (version, df)  # rebuilt by the next call if a row was added meanwhile
+        return df
+
+    @classmethod
+    def from_columns(cls, data: dict) -> "ResultsBuffer":
+        """Builds a buffer from columns laid out like ExperimentStore.load_columns, the last row of an index wins.
+        When no index was rewritten the columns themselves back the buffer, memory-mapped ones stay on disk until
+        the first add copies them into buffers of its own"""
+        index = np.asarray(data["index"]).astype(np.int64)
+        if index.size == 0:
+            return cls()
+        _, last = np.unique(index[::-1], return_index=True)
+        if last.size == index.size:  # every row kept, in order
+            keep = slice(None)
+        else:
+            keep = np.sort(index.size - 1 - last)
+        buffer = cls(capacity=1)
+        buffer._index = index[keep]
+        buffer.size = buffer._capacity = buffer._index.size
+        buffer._positions = {int(value): position for position, value in enumerate(buffer._index)}
+        buffer._monotonic = bool(np.all(np.diff(buffer._index) > 0))
+        buffer._scalars = {column: data[column][keep] for column in cls.scalar_columns}
+        buffer._arrays = {column: data[column][keep] for column in cls.array_columns}
+        buffer._lengths = {column: data["lengths"][column][keep] for column in cls.array_columns}
+        buffer._shared = True
+        return buffer
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "ResultsBuffer":
+        """Converts the results DataFrame of tests pickled by older versions"""
+        buffer = cls(capacity=max(2 * len(df), 16))
+        for index, row in zip(df.index, df.to_dict(orient='records')):
+            buffer.add(int(index), row)
+        return buffer
@@ -0,0 +1,333 @@
+import binascii
+import importlib
+import queue
+import re
+import struct
+import threading
+import numpy as np
+import serial
+import Instrumentation
+from Utils import debug
+
+_devices = {}  # comport -> SerialDevice, one persistent port per device
+_devices_lock = threading.Lock()
+port_handlers = {}  # URL scheme -> factory(url, baudrate, timeout) of a serial-like object, e.g. "sim" of Simulator
+port_handler_modules = {"sim": "Simulator"}  # URL scheme -> module registering its handler when imported
+
+# Binary framing, requested by adding "Binary:1" to the test command:
+#   sync (A5 5A) | uint8 payload length | payload | uint16 CRC-16/CCITT-FALSE of length + payload, little endian
+# The payload holds whole records of (uint32 time, int16 voltage, float32 current), a frame with an empty payload
+# ends the run like the "Done" line of the text protocol.
+frame_sync = b"\xa5\x5a"
+record_dtype = np.dtype([("time", "<u4"), ("voltage", "<i2"), ("current", "<f4")])
+max_records_per_frame = 255 // record_dtype.itemsize
+
+
+def parse_record(line: str):
+    """Parses a "time: ..., voltage: ..., current: ..." line, returns (time, voltage, current) or None"""
+    fields = line.split(",")
+    try:
+        return (float(fields[0].split(":")[1]),
+                float(fields[1].split(":")[1]),
+                float(fields[2].split(":")[1].strip()))
+    except (IndexError, ValueError):
+        return None
+
+
+def encode_frames(time, voltage, current) -> bytes:
+    """Encodes records into binary frames followed by the end frame, used by simulated boards"""
+    records = np.empty(len(time), dtype=record_dtype)
+    records["time"], records["voltage"], records["current"] = time, voltage, current
+    frames = []
+    for start in range(0, len(records), max_records_per_frame):
+        frames.append(encode_frame(records[start:start + max_records_per_frame].tobytes()))
+    frames.append(encode_frame(b""))
+    return b"".join(frames)
+
+
+def encode_frame(payload: bytes) -> bytes:
+    body = struct.pack("<B", len(payload)) + payload
+    return frame_sync + body + struct.pack("<H", binascii.crc_hqx(body, 0xFFFF))
+
+
+class FrameDecoder:
+    """Incremental decoder of the binary framing, chunks can split frames anywhere.
+
+    Payloads of valid frames are collected and turned into record arrays with one np.frombuffer per chunk.
+    Frames failing the CRC are dropped and the decoder resynchronizes on the next sync bytes."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.time = np.empty(0, dtype=record_dtype["time"])
+        self.voltage = np.empty(0, dtype=record_dtype["voltage"])
+        self.current = np.empty(0, dtype=record_dtype["current"])
+        self.count = 0
+        self.done = False
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0  # bytes outside of frames
+        self.preamble = bytearray()  # bytes skipped before the first frame, kept to detect a text answer
+        self.text_detected = False  # the board answered with text lines, it does not support the binary framing
+
+    def _append(self, records: np.ndarray):
+        if self.count + len(records) > len(self.time):
+            capacity = max(2 * len(self.time), self.count + len(records), 256)
+            self.time, self.voltage, self.current = (np.resize(values, capacity) for values in
+                                                     (self.time, self.voltage, self.current))
+        end = self.count + len(records)
+        self.time[self.count:end] = records["time"]
+        self.voltage[self.count:end] = records["voltage"]
+        self.current[self.count:end] = records["current"]
+        self.count = end
+
+    def _skip(self, start: int, end: int):
+        self.skipped_bytes += end - start
+        if not self.frames and len(self.preamble) < 4096:
+            self.preamble += self.buffer[start:end]
+
+    def feed(self, chunk: bytes) -> int:
+        """Decodes the frames completed by chunk, returns the number of new records"""
+        self.buffer += chunk
+        payloads = bytearray()
+        position = 0
+        while not self.done:
+            start = self.buffer.find(frame_sync, position)
+            if start < 0:
+                skipped = max(len(self.buffer) - 1, position)  # the last byte may be the start of a sync
+                self._skip(position, skipped)
+                position = skipped
+                break
+            self._skip(position, start)
+            if len(self.buffer) < start + 3:
+                position = start
+                break
+            length = self.buffer[start + 2]
+            end = start + 3 + length + 2
+            if len(self.buffer) < end:
+                position = start
+                break
+            body = bytes(self.buffer[start + 2:end - 2])
+            if binascii.crc_hqx(body, 0xFFFF) != struct.unpack_from("<H", self.buffer, end - 2)[0] \
+                    or length % record_dtype.itemsize:
+                self.crc_errors += 1
+                self._skip(start, start + 1)
+                position = start + 1  # resynchronize after the false sync
+                continue
+            self.frames += 1
+            if length == 0:
+                self.done = True
+            payloads += body[1:]
+            position = end
+        del self.buffer[:position]
+        if not self.frames and b"time:" in self.preamble:
+            self.text_detected = True
+        before = self.count
+        if payloads:
+            self._append(np.frombuffer(bytes(payloads), dtype=record_dtype))
+        return self.count - before
+
+    def get_records(self):
+        """(time, voltage, current) arrays of the records decoded so far"""
+        return self.time[:self.count], self.voltage[:self.count], self.current[:self.count]
+
+
+class AcquisitionRun:
+    """Records of one test run, filled by the reader thread of a SerialDevice.
+    Text runs queue (time, voltage, current) tuples, binary runs queue the number of records their decoder added."""
+    _done_marker = None
+
+    def __init__(self, binary: bool = False):
+        self.records = queue.Queue()
+        self.done = threading.Event()
+        self.error = None
+        self.dropped_lines = 0  # lines looking like records that could not be parsed
+        self.decoder = FrameDecoder() if binary else None
+
+    @property
+    def binary(self) -> bool:
+        return self.decoder is not None
+
+    def put(self, record: tuple):
+        self.records.put(record)
+
+    def finish(self, error: Exception = None):
+        self.error = error
+        self.done.set()
+        self.records.put(self._done_marker)
+
+    def iter_records(self, stop=lambda: False, poll_interval: float = 0.1):
+        """Yields (time, voltage, current) records until the "Done" marker.
+        Blocks on the queue, stop() is checked between records and every poll_interval while none arrives."""
+        while not stop():
+            try:
+                record = self.records.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+            if record is self._done_marker:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield record
+
+
+class SerialDevice:
+    """Persistent serial port of one SwiftMote board.
+
+    A reader thread blocks on the port, frames the incoming bytes into lines, and parses the records of the
+    current run into its queue, so no thread spins on inWaiting() while a sweep is running."""
+
+    def __init__(self, comport: str, baudrate: int, timeout: float = 0.1):
+        self.comport = comport
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ser = None
+        self.run = None
+        self._line_buffer = b""
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._reader_thread = None
+
+    def is_open(self) -> bool:
+        return self.ser is not None and self.ser.is_open and self._reader_thread is not None \
+            and self._reader_thread.is_alive()
+
+    def open(self):
+        self._closing.clear()
+        self.ser = open_port(self.comport, self.baudrate, self.timeout)
+        self._reader_thread = threading.Thread(target=self._reader, name=f"Serial reader {self.comport}",
+                                               daemon=True)
+        self._reader_thread.start()
+
+    def close(self):
+        self._closing.set()
+        if self._reader_thread is not None:
+            self._reader_thread.join(timeout=2 * self.timeout + 1)
+        if self.ser is not None:
+            self.ser.close()
+        with self._lock:
+            if self.run is not None:
+                self.run.finish(ConnectionError(f"{self.comport} closed"))
+                self.run = None
+
+    def start_run(self, command: str, binary: bool = False) -> AcquisitionRun:
+        """Sends a test command, the returned run receives the records until the "Done" marker or the end frame"""
+        with self._lock:
+            if self.run is not None:
+                self.run.finish(RuntimeError("Run replaced by a new command"))
+            self.ser.reset_input_buffer()  # discard leftovers of a previous, stopped run
+            self._line_buffer = b""
+            self.run = AcquisitionRun(binary)
+            run = self.run
+        self.ser.write(command.encode())
+        return run
+
+    def abort(self, run: AcquisitionRun):
+        """Detaches a run, the lines the board still sends for it are ignored"""
+        with self._lock:
+            if self.run is run:
+                self.run = None
+
+    def _reader(self):
+        while not self._closing.is_set():
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)  # blocks up to timeout when nothing arrives
+            except Exception as e:
+                debug()
+                with self._lock:
+                    if self.run is not None:
+                        self.run.finish(e)
+                        self.run = None
+                return
+            if not chunk:
+                continue
+            Instrumentation.count("serial bytes", len(chunk))
+            started = Instrumentation.start()
+            try:
+                self._handle_chunk(chunk)
+            finally:
+                Instrumentation.stop("serial chunk", started)
+
+    def _handle_chunk(self, chunk: bytes):
+        with self._lock:
+            run = self.run
+        if run is not None and run.binary:
+            chunk = self._handle_frames(run, chunk)
+            if not chunk:
+                return
+        self._line_buffer += chunk
+        *lines, self._line_buffer = self._line_buffer.split(b"\n")
+        for line in lines:
+            self._handle_line(line.decode(errors="replace").strip())
+        if b"Done" in self._line_buffer:  # the marker may come without a line ending
+            self._handle_line(self._line_buffer.decode(errors="replace").strip())
+            self._line_buffer = b""
+
+    def _handle_frames(self, run: AcquisitionRun, chunk: bytes) -> bytes:
+        """Feeds a binary run, returns the bytes to parse as text when the board answered in text instead"""
+        decoder = run.decoder
+        started = Instrumentation.start()
+        new_records = decoder.feed(chunk)
+        Instrumentation.stop("frame decode", started)
+        with self._lock:
+            if decoder.text_detected:  # old firmware ignores "Binary:1", fall back to the text protocol
+                run.decoder = None
+                return bytes(decoder.preamble + decoder.buffer)
+            if new_records:
+                run.put(new_records)
+            if decoder.done and self.run is run:
+                self.run = None
+                run.finish()
+        return b""
+
+    def _handle_line(self, line: str):
+        with self._lock:
+            run = self.run
+            if run is None:
+                return
+            if "Done" in line:
+                self.run = None
+                run.finish()
+            elif "time:" in line:
+                started = Instrumentation.start()
+                record = parse_record(line)
+                Instrumentation.stop("line parse", started)
+                if record is None:
+                    run.dropped_lines += 1
+                else:
+                    run.put(record)
+
+
+def is_port_name(comport: str) -> bool:
+    """True for what open_port can open: COM ports, device paths (/dev/ttyUSB0) and URLs (sim://, socket://...)"""
+    return "://" in comport or bool(re.fullmatch(r"COM\d+", comport, re.IGNORECASE)) or \
+        comport.startswith(("/dev/", "\\\\.\\"))
+
+
+def open_port(comport: str, baudrate: int, timeout: float):
+    """Opens a COM port, a pyserial URL (loop://, socket://...) or a URL of a registered port handler"""
+    scheme = comport.split("://", 1)[0].lower() if "://" in comport else None
+    if scheme in port_handler_modules and scheme not in port_handlers:
+        importlib.import_module(port_handler_modules[scheme])  # imported on first use only
+    if scheme in port_handlers:
+        return port_handlers[scheme](comport, baudrate, timeout)
+    return serial.serial_for_url(comport, baudrate=baudrate, timeout=timeout)
+
+
+def get_device(comport: str, baudrate: int) -> SerialDevice:
+    """Returns the persistent device of a port, opening it on first use or after an error"""
+    with _devices_lock:
+        device = _devices.get(comport)
+        if device is None or device.baudrate != baudrate or not device.is_open():
+            if device is not None:
+                device.close()
+            device = SerialDevice(comport, baudrate)
+            device.open()
+            _devices[comport] = device
+        return device
+
+
+def close_all():
+    with _devices_lock:
+        for device in _devices.values():
+            device.close()
+        _devices.clear()
@@ -0,0 +1,313 @@
+import argparse
+import inspect
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+import numpy as np
+import Serial_acquisition
+from Utils import debug
+
+
+class SimulatedBoard:
+    """Stand-in for a SwiftMote board, answers the test commands of Tests.Test without hardware.
+
+    A command such as "SWV,E1:-300,E2:100,...,Concentration:5" produces one sweep: a Gaussian peak on a
+    sloped baseline with noise, whose height follows a Hill response to the Concentration parameter.
+    It is sent rate points per second (0 sends as fast as possible) in the firmware text format
+    "time: ..., voltage: ..., current: ..." followed by "Done", or in binary frames if the command has
+    "Binary:1". Faults can be injected to reproduce transport bugs: output split into random pieces of at
+    most fragment_size bytes, a byte of a record replaced with probability corruption_rate, and pauses of
+    stall_duration seconds with probability stall_rate per write.
+
+    The board talks to the host through open_pty() (a pseudo-terminal, POSIX only) or through a
+    SimulatedSerial port, opened by Serial_acquisition for "sim://" URLs."""
+
+    def __init__(self, rate: float = 2000.0, noise: float = 0.005, baseline_offset: float = 1.0,
+                 baseline_slope: float = 0.001, peak_potential: float = None, peak_width: float = 40.0,
+                 peak_height: float = 1.0, hill_gain: float = 0.5, hill_kd: float = 10.0, hill_n: float = 1.0,
+                 fragment_size: int = 0, corruption_rate: float = 0.0, stall_rate: float = 0.0,
+                 stall_duration: float = 0.5, seed: int = None):
+        self.rate = rate
+        self.noise = noise
+        self.baseline_offset = baseline_offset
+        self.baseline_slope = baseline_slope
+        self.peak_potential = peak_potential  # mV, middle of the sweep if None
+        self.peak_width = peak_width
+        self.peak_height = peak_height
+        self.hill_gain = hill_gain  # relative peak increase at saturating concentration
+        self.hill_kd = hill_kd
+        self.hill_n = hill_n
+        self.fragment_size = fragment_size
+        self.corruption_rate = corruption_rate
+        self.stall_rate = stall_rate
+        self.stall_duration = stall_duration
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.stats = {"commands": 0, "unknown_commands": 0, "points": 0, "bytes": 0, "corrupted": 0, "stalls": 0}
+        self._input = b""
+        self._input_changed = threading.Condition()
+        self._closing = threading.Event()
+        self._thread = None
+        self._write = None
+        self._pty = None
+
+    #### Sweeps ####
+    @staticmethod
+    def parse_command(command: str):
+        """Splits "SWV,E1:0,E2:200" into ("SWV", {"E1": 0.0, "E2": 200.0}), non numeric values are skipped"""
+        name, *fields = command.strip().split(",")
+        parameters = {}
+        for field in fields:
+            key, _, value = field.partition(":")
+            try:
+                parameters[key.strip()] = float(value)
+            except ValueError:
+                continue
+        return name.strip(), parameters
+
+    def get_peak_height(self, concentration: float) -> float:
+        concentration = max(concentration, 0.0)
+        response = concentration ** self.hill_n / (self.hill_kd ** self.hill_n + concentration ** self.hill_n)
+        return self.peak_height * (1 + self.hill_gain * response)
+
+    def generate(self, name: str, parameters: dict):
+        """Voltages (mV) and currents (uA) of one sweep, None for an unknown test"""
+        if name in ("SWV", "Titration"):
+            e1, e2 = parameters.get("E1", -300.0), parameters.get("E2", 100.0)
+            voltages = np.linspace(e1, e2, int(abs(e2 - e1)) + 1)
+            center = (e1 + e2) / 2 if self.peak_potential is None else self.peak_potential
+            peak = self.get_peak_height(parameters.get("Concentration", 0.0)) * \
+                np.exp(-((voltages - center) / self.peak_width) ** 2 / 2)
+        elif name == "CV":
+            v1, v2 = parameters.get("vertex1", 0.0), parameters.get("vertex2", 200.0)
+            sweep = np.linspace(v1, v2, int(abs(v2 - v1)) + 1)
+            cycles = max(int(parameters.get("Cycles", 1)), 1)
+            voltages = np.tile(np.concatenate([sweep, sweep[::-1]]), cycles)
+            center = (v1 + v2) / 2 if self.peak_potential is None else self.peak_potential
+            direction = np.tile(np.repeat([1.0, -1.0], len(sweep)), cycles)  # oxidation going up, reduction down
+            peak = direction * self.peak_height * np.exp(-((voltages - center) / self.peak_width) ** 2 / 2)
+        else:
+            return None
+        currents = self.baseline_offset + self.baseline_slope * voltages + peak + \
+            self.rng.normal(0.0, self.noise, len(voltages))
+        return voltages, currents
+
+    def get_response(self, command: str) -> list:
+        """Pieces of the answer to a command as (bytes, number of points), ending with the end marker"""
+        name, parameters = self.parse_command(command)
+        sweep = self.generate(name, parameters)
+        self.stats["commands"] += 1
+        if sweep is None:
+            self.stats["unknown_commands"] += 1
+            return []
+        voltages, currents = sweep
+        period = 1000.0 / self.rate if self.rate else 1.0
+        times = np.arange(len(voltages)) * period  # ms since the command
+        if parameters.get("Binary", 0):
+            records = np.empty(len(times), dtype=Serial_acquisition.record_dtype)
+            records["time"], records["voltage"], records["current"] = times, voltages, currents
+            step = Serial_acquisition.max_records_per_frame
+            pieces = [(Serial_acquisition.encode_frame(records[start:start + step].tobytes()),
+                       len(records[start:start + step]))
+                      for start in range(0, len(records), step)]
+            return pieces + [(Serial_acquisition.encode_frame(b""), 0)]
+        pieces = [(f"time: {t:.0f}, voltage: {v:.0f}, current: {i:.6f}\n".encode(), 1)
+                  for t, v, i in zip(times, voltages, currents)]
+        return pieces + [(b"Done\n", 0)]
+
+    def corrupt(self, piece: bytes) -> bytes:
+        position = self.random.randrange(len(piece) - 1)  # keeps the line ending
+        self.stats["corrupted"] += 1
+        return piece[:position] + bytes([self.random.randrange(256)]) + piece[position + 1:]
+
+    def send(self, pieces: list, write):
+        """Writes pieces at the configured rate, injecting the configured faults"""
+        started = time.perf_counter()
+        points = 0
+        pending = b""
+        for piece, count in pieces:
+            if self._closing.is_set():
+                return
+            if count and self.corruption_rate and self.random.random() < self.corruption_rate:
+                piece = self.corrupt(piece)
+            pending += piece
+            points += count
+            delay = started + points / self.rate - time.perf_counter() if self.rate else 0.0
+            if delay < 0.005 and count and len(pending) < 4096:  # batches small writes
+                continue
+            if delay > 0:
+                time.sleep(delay)
+            self._send_chunk(pending, write)
+            pending = b""
+        self._send_chunk(pending, write)
+        self.stats["points"] += points
+
+    def _send_chunk(self, data: bytes, write):
+        while data:
+            size = self.random.randint(1, self.fragment_size) if self.fragment_size else len(data)
+            if self.stall_rate and self.random.random() < self.stall_rate:
+                self.stats["stalls"] += 1
+                time.sleep(self.stall_duration)
+            write(data[:size])
+            self.stats["bytes"] += len(data[:size])
+            data = data[size:]
+
+    #### Command handling ####
+    def feed(self, data: bytes):
+        """Bytes sent by the host, a command ends with a new line or after 20 ms without new bytes"""
+        with self._input_changed:
+            self._input += data
+            self._input_changed.notify()
+
+    def _next_commands(self) -> list:
+        with self._input_changed:
+            while not self._input and not self._closing.is_set():
+                self._input_changed.wait(0.1)
+            length = -1
+            while length != len(self._input) and b"\n" not in self._input:  # waits for the end of the command
+                length = len(self._input)
+                self._input_changed.wait(0.02)
+            data, self._input = self._input, b""
+        return [line for line in data.decode(errors="replace").splitlines() if line.strip()]
+
+    def start(self, write):
+        """Answers the commands given to feed() from a thread, write(bytes) sends to the host"""
+        self._closing.clear()
+        self._write = write
+        self._thread = threading.Thread(target=self._serve, name="Simulated board", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._closing.is_set():
+            try:
+                for command in self._next_commands():
+                    self.send(self.get_response(command), self._write)
+            except Exception:
+                if not self._closing.is_set():
+                    debug()
+                return
+
+    def close(self):
+        self._closing.set()
+        with self._input_changed:
+            self._input_changed.notify()
+        if self._pty is not None:
+            for fd in self._pty:
+                os.close(fd)
+            self._pty = None
+
+    def open_pty(self) -> str:
+        """Serves the board on a new pseudo-terminal, returns the port name to give to the host"""
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+
+        def write(data: bytes):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(master, view):]
+
+        def read_commands():
+            while not self._closing.is_set():
+                try:
+                    data = os.read(master, 1024)
+                except OSError:
+                    return
+                if data:
+                    self.feed(data)
+
+        threading.Thread(target=read_commands, name="Simulated board input", daemon=True).start()
+        self.start(write)
+        self._pty = (master, slave)  # keeps the slave open, the port would hang up when the host closes it
+        return name
+
+
+class SimulatedSerial:
+    """Serial port connected in memory to a SimulatedBoard, the subset of serial.Serial used by SerialDevice.
+
+    Opened by Serial_acquisition for "sim://<name>?<parameter>=<value>&..." URLs, where the parameters are
+    those of SimulatedBoard, e.g. "sim://board1?rate=0&fragment_size=7&seed=1"."""
+
+    def __init__(self, url: str, baudrate: int = 115200, timeout: float = None):
+        self.port = url
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.board = SimulatedBoard(**parse_board_parameters(url))
+        self._received = queue.Queue()
+        self._buffer = b""
+        self.is_open = True
+        self.board.start(self._received.put)
+
+    @property
+    def in_waiting(self) -> int:
+        while True:
+            try:
+                self._buffer += self._received.get_nowait()
+            except queue.Empty:
+                return len(self._buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self._buffer:
+            try:
+                self._buffer = self._received.get(timeout=self.timeout)
+            except queue.Empty:
+                return b""
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        self.board.feed(bytes(data))
+        return len(data)
+
+    def reset_input_buffer(self):
+        while not self._received.empty():
+            self._received.get_nowait()
+        self._buffer = b""
+
+    def close(self):
+        self.is_open = False
+        self.board.close()
+
+
+def parse_board_parameters(url: str) -> dict:
+    """Keyword arguments of SimulatedBoard from the query of a "sim://" URL, converted like their defaults"""
+    defaults = {name: parameter.default
+                for name, parameter in inspect.signature(SimulatedBoard.__init__).parameters.items()
+                if name != "self"}
+    parameters = {}
+    for name, value in urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query):
+        if name not in defaults:
+            raise ValueError(f"Unknown simulator parameter {name}")
+        default = defaults[name]
+        parameters[name] = int(value) if isinstance(default, int) or name == "seed" else float(value)
+    return parameters
+
+
+Serial_acquisition.port_handlers["sim"] = SimulatedSerial
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Simulated SwiftMote board on a pseudo-terminal")
+    arg_parser.add_argument("--rate", type=float, default=2000.0, help="points per second, 0 for no limit")
+    arg_parser.add_argument("--noise", type=float, default=0.005)
+    arg_parser.add_argument("--fragment-size", type=int, default=0)
+    arg_parser.add_argument("--corruption-rate", type=float, default=0.0)
+    arg_parser.add_argument("--stall-rate", type=float, default=0.0)
+    arg_parser.add_argument("--stall-duration", type=float, default=0.5)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args()
+    board = SimulatedBoard(rate=args.rate, noise=args.noise, fragment_size=args.fragment_size,
+                           corruption_rate=args.corruption_rate, stall_rate=args.stall_rate,
+                           stall_duration=args.stall_duration, seed=args.seed)
+    print(f"Simulated board on {board.open_pty()}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        board.close()
+        print(board.stats)
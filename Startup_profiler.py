@@ -0,0 +1,52 @@
+import builtins
+import sys
+import time
+
+# Import time breakdown of "python SwiftMote_gui.py --profile-startup", only uses the standard library so that it
+# can be installed before the other imports of the GUI, frozen executables included.
+
+started = time.perf_counter()
+imports = []  # (module, seconds including its own imports, nesting depth) of the first import of each module
+_original_import = builtins.__import__
+_depth = 0
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    if level or name in sys.modules:  # relative or already imported, nothing to time
+        return _original_import(name, globals, locals, fromlist, level)
+    _depth += 1
+    import_started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        imports.append((name, time.perf_counter() - import_started, _depth))
+
+
+def install():
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    builtins.__import__ = _original_import
+
+
+def report(stage: str, top: int = 15):
+    """Prints the time since install() and the slowest imports: the ones of the GUI module itself,
+    then every package by the time of its outermost import"""
+    uninstall()
+    elapsed = time.perf_counter() - started
+    direct = sorted(((seconds, name) for name, seconds, depth in imports if depth == 0), reverse=True)
+    packages = {}
+    for name, seconds, depth in imports:
+        root = name.partition(".")[0]
+        packages[root] = max(packages.get(root, 0.0), seconds)
+    print(f"Startup profile: {stage} after {elapsed * 1000:.0f} ms, "
+          f"{sum(seconds for seconds, name in direct) * 1000:.0f} ms in imports, {len(sys.modules)} modules loaded")
+    print("  Imports of the GUI module:")
+    for seconds, name in direct[:top]:
+        print(f"    {seconds * 1000:8.1f} ms  {name}")
+    print("  Packages (including their own imports):")
+    for root, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"    {seconds * 1000:8.1f} ms  {root}")
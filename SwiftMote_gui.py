@@ -1,11 +1,11 @@
+import sys
+if "--profile-startup" in sys.argv:  # installed first to time the other imports
+    import Startup_profiler
+    Startup_profiler.install()
 import asyncio
-import cProfile
 import importlib
-import json
-import math
-import pstats
-import struct
-import tkinter.tix
+import multiprocessing
+import tkinter as tk
 import warnings
 import time
 import threading
@@ -15,12 +15,13 @@ import re
 import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from tkinter import filedialog, messagebox, ttk
-import bleak
 import matplotlib
 import nest_asyncio
 from dateutil import tz
 from matplotlib import dates, ticker, pyplot as plt
-import BLE_connector_Bleak
+import Serial_acquisition
+from Device_manager import DeviceManager
+from Autosave import Autosave
 from Process_CH_data import *
 from Data_processing import *
 import pickle
@@ -28,9 +29,15 @@ import datetime
 import serial.tools.list_ports
 from Tests import Test
 from Plots import Plot
+from Plot_cache import PlotCache
+from Fit_cache import FitCache
+from Electrode_catalog import ElectrodeCatalog
+from Analysis_executor import AnalysisExecutor, FrameBudget
+import Instrumentation
+import Export
+from BLE_packets import TransactionReassembler
 from Titrations import titration
-
-from memory_profiler import profile
+# bleak and BLE_connector_Bleak are imported when BLE is first used, scipy by the analysis functions
 
 font1 = 'Helvetica 15 bold'
 font2 = 'Helvetica 11 bold'
@@ -68,19 +75,31 @@ class App(tk.Tk):
         self.data_path = os.getcwd() + "\\data"
         self.titration_path = os.getcwd() + "\\data_titration"
         self.create_directories([self.output_path, self.data_path])
+        self.device_manager = DeviceManager(self.data_path)
+        self.autosave = Autosave(os.path.join(self.output_path, "autosave.journal"))
 
         self.electrode_list = {}
+        self.catalog = ElectrodeCatalog(self.data_path, self.electrode_list, in_use=lambda name: any(
+            status.electrode.name == name for status in list(self.device_manager.devices.values())))
         self.titration_list = {}
         self.current_electrode = None
         self.raw_data_df = None
+        self.plot_cache = PlotCache()  # baseline, gain and concentration of each scan of raw_data_df
+        self.fit_cache = FitCache()  # titration fits by range of points, reused when the fit limits move
+        # fits, gain extraction, imports and exports run in the analysis executor, the UI thread only takes
+        # their results, within frame_budget
+        self.analysis = AnalysisExecutor(on_log=self.print)
+        self.frame_budget = FrameBudget(budget=0.010)
+        self.device_results = []  # sweeps finished by the device manager, not handed to the GUI yet
+        self.pending_fit = None  # FitCache key of the titration fit running in the analysis executor
+        Test.gains_function = self.analysis.get_gains
         self.update_raw_data_graph = False
         self.titration_df = None
         self.update_titration_graph = False
         self.to_update_plots = False
         self.datapoint_select_N = 0
-        self.thread_result = -1
-        self.data_received = False
         self.isHill = False
+        self.calibration = None  # Calibration of the displayed titration, shared by the plots and the .csv export
         self.check_params = False
         self.continuous_running = False
 
@@ -174,88 +193,63 @@ class App(tk.Tk):
                 Lovric_frame.pack(side=tk.TOP, anchor="nw")
                 volta_frame.pack(side=tk.TOP, anchor="nw")
 
+                file_format = tk.StringVar(value="csv")
+                ttk.Combobox(master=save_btn_frame, textvariable=file_format, values=list(Export.formats),
+                             state="readonly", width=8).pack(side=tk.LEFT, padx=5)
+                progress_bar = ttk.Progressbar(master=save_btn_frame, length=200, mode="determinate")
+                cancel = threading.Event()
+                messages = queue.Queue()  # (rows written, total rows), then ("done", paths) or ("error", exception)
+
                 def on_button_save():
-                    date = datetime.datetime.now().strftime('%Y-%m-%d')
-                    path = f"{self.output_path}\\{date}"
-                    if not os.path.exists(path):
-                        os.makedirs(path)
-
-                    titration_df = None
-                    lovric_df = None
-                    volta_df = None
-                    first_titration = True
-                    first_lovric = True
-                    first_volta = True
-                    for (electrode_chckbtn, electrode_obj) in elec_lst.items():
-                        if "selected" in electrode_chckbtn.state():
-                            for exp in list(electrode_obj.get_experiments()):
-                                for (test_type, test) in enumerate(self.electrode_list[key].get_tests(exp).values()):
-                                    e_name = electrode_obj.name
-                                    if test.type == "Titration":
-                                        if not test.get_df().empty:
-                                            df = test.get_df()
-                                            frequency = list(df["frequency"])[0]
-                                            if first_titration:
-                                                titration_df = df[["time", "concentration"]].copy()
-                                                first_titration = False
-                                            for (chk_btn, p_name) in titration_lst.items():
-                                                if "selected" in chk_btn.state():
-                                                    data = df[[p_name]].copy()
-                                                    data.rename(columns={p_name: f'{p_name}_{e_name}_{frequency}hz'},
-                                                                inplace=True)
-                                                    titration_df = pd.concat([titration_df, data], axis=1)
-
-                                    elif test.type == "CV":
-                                        if not test.get_df().empty:
-                                            df = test.get_df()
-                                            charge = df['peak_current'] / df["frequency"]
-                                            charge.columns = [f'charge_{e_name}']
-                                            if first_lovric:
-                                                lovric_df = df[["time", "frequency"]].copy()
-                                                first_lovric = False
-                                            lovric_df = pd.concat([lovric_df, charge], axis=1)
-                                            for (chk_btn, p_name) in lovric_lst.items():
-                                                if "selected" in chk_btn.state():
-                                                    data = df[[p_name]].copy()
-                                                    data.rename(columns={p_name: f'{p_name}_{e_name}'}, inplace=True)
-                                                    pd.concat(data, charge)
-                                                    lovric_df = pd.concat([lovric_df, data], axis=1)
-
-                                    elif test.type == "SWV":
-                                        if not test.get_df().empty:
-                                            df = test.get_df()
-                                            frequency = list(df["frequency"])[0]
-                                            if first_volta:
-                                                volta_df = df[["time", "concentration"]].copy()
-                                                first_volta = False
-                                            for (chk_btn, p_name) in volta_lst.items():
-                                                if "selected" in chk_btn.state():
-                                                    data = df[[p_name]].copy()
-                                                    data.rename(columns={p_name: f'{p_name}_{e_name}_{frequency}hz'},
-                                                                inplace=True)
-                                                    volta_df = pd.concat([volta_df, data], axis=1)
-                                    else:
-                                        self.print(f"test type {test.type} doen't exist")
-                                    try:
-                                        print(f"{test.type} for {e_name}_{frequency} has been saved")
-                                    except Exception:
-                                        pass
+                    # the export runs in a thread, the window shows its progress until it finishes or is cancelled
+                    electrodes = {electrode_obj.name: electrode_obj for (electrode_chckbtn, electrode_obj)
+                                  in elec_lst.items() if "selected" in electrode_chckbtn.state()}
+                    columns = {}
+                    for test_type, parameters in (("Titration", titration_lst), ("CV", lovric_lst),
+                                                  ("SWV", volta_lst)):
+                        if parameters:  # types without checkboxes are exported with all their parameters
+                            columns[test_type] = [p_name for (chk_btn, p_name) in parameters.items()
+                                                  if "selected" in chk_btn.state()]
+                    path = os.path.join(self.output_path, datetime.datetime.now().strftime('%Y-%m-%d'))
+
+                    def on_done(result):
+                        messages.put(("error", result.error) if result.error is not None else ("done", result.value))
+
+                    save_btn.config(state="disabled")
+                    progress_bar.pack(side=tk.LEFT, padx=5)
+                    self.analysis.submit("export", electrodes, path, columns, self.calibration, file_format.get(),
+                                         progress=lambda written, total: messages.put((written, total)),
+                                         cancel=cancel, on_done=on_done)
+                    saving_window.after(100, poll_export)
+
+                def poll_export():
                     try:
-                        if titration_df is not None:
-                            titration_df.to_csv(path_or_buf=f"{path}\\titration.csv")
-                        if lovric_df is not None:
-                            lovric_df.to_csv(path_or_buf=f"{path}\\lovric.csv")
-                        if volta_df is not None:
-                            volta_df.to_csv(path_or_buf=f"{path}\\voltammogram.csv")
-                    except PermissionError as e:
-                        debug()
-                        messagebox.showerror('Error', e.__str__())
-                    else:
-                        messagebox.showinfo('Info', f"Data has been save to {path}")
-                    saving_window.quit()
+                        while True:
+                            state, value = messages.get_nowait()
+                            if state == "done":
+                                if value is not None:  # None: cancelled
+                                    messagebox.showinfo('Info', f"Data has been save to {path_text(value)}")
+                                saving_window.destroy()
+                                return
+                            if state == "error":
+                                messagebox.showerror('Error', value.__str__())
+                                saving_window.destroy()
+                                return
+                            progress_bar.config(maximum=max(value, 1), value=state)
+                    except queue.Empty:
+                        saving_window.after(100, poll_export)
+
+                def path_text(paths: dict) -> str:
+                    return os.path.dirname(next(iter(paths.values()))) if paths else "nowhere, no data to save"
+
+                def on_close_saving_window():
+                    cancel.set()  # a running export stops at its next chunk and removes its partial file
                     saving_window.destroy()
 
-                tk.Button(master=save_btn_frame, text="Save", command=on_button_save).pack(side=tk.TOP, anchor="center")
+                saving_window.protocol("WM_DELETE_WINDOW", on_close_saving_window)
+                save_btn = tk.Button(master=save_btn_frame, text="Save", command=on_button_save)
+                save_btn.pack(side=tk.LEFT, anchor="center")
+                tk.Button(master=save_btn_frame, text="Cancel", command=on_close_saving_window).pack(side=tk.LEFT)
 
             except Exception as e:
                 self.print(e)
@@ -271,6 +265,11 @@ class App(tk.Tk):
 
                 except Exception:
                     pass
+                self.device_manager.shutdown()
+                self.autosave.close()
+                self.analysis.shutdown()
+                shutdown_executor()
+                Serial_acquisition.close_all()
                 for task in self.tasks:
                     self.tasks[task].cancel()
                 self.loop.stop()
@@ -283,10 +282,10 @@ class App(tk.Tk):
                 messagebox.showerror('Error', e.__str__())
 
         def on_button_process_CH_titration():
-            process_CH_File(self, self.data_path, "Titration")
+            self.import_CH("Titration")
 
         def on_button_process_CH_Experiment():
-            process_CH_File(self, self.data_path, "SWV")
+            self.import_CH("SWV")
 
         def on_button_set_output_path():
             try:
@@ -299,11 +298,153 @@ class App(tk.Tk):
                 debug()
                 messagebox.showerror('Error', e.__str__())
 
+        def on_button_devices():
+            try:
+                devices_window = tk.Toplevel(master=self)
+                devices_window.resizable(width=False, height=False)
+                devices_window.title("Devices")
+                run_frame = tk.Frame(master=devices_window)
+                devices_frame = tk.Frame(master=devices_window)
+                btn_frame = tk.Frame(master=devices_window)
+                run_frame.pack(side=tk.TOP, fill=tk.X)
+                devices_frame.pack(side=tk.TOP, fill=tk.BOTH)
+                btn_frame.pack(side=tk.TOP, fill=tk.X)
+
+                experiment_name = tk.StringVar(value=self.Experiment_cBox.get())
+                test_type = tk.StringVar(value="SWV")
+                repeats = tk.IntVar(value=1)
+                interval = tk.DoubleVar(value=3)
+                for column, (text, widget) in enumerate([
+                    ("Experiment", tk.Entry(master=run_frame, textvariable=experiment_name, width=self.width + 5)),
+                    ("Test", ttk.Combobox(master=run_frame, textvariable=test_type, values=["Titration", "CV", "SWV"],
+                                          width=self.width, state="readonly")),
+                    ("Runs", tk.Entry(master=run_frame, textvariable=repeats, width=5)),
+                    ("Interval (s)", tk.Entry(master=run_frame, textvariable=interval, width=5))]):
+                    tk.Label(master=run_frame, text=text, font=font3).grid(row=0, column=column)
+                    widget.grid(row=1, column=column, padx=2)
+
+                rows = {}  # port -> (electrode combobox, status label)
+
+                def refresh_ports():
+                    for child in devices_frame.winfo_children():
+                        child.destroy()
+                    rows.clear()
+                    elec_list = self.catalog.names()
+                    ports = sorted(port for port, _, _ in serial.tools.list_ports.comports())
+                    for port in set(self.device_manager.devices) - set(ports):  # keep BLE or unplugged devices
+                        ports.append(port)
+                    for row, port in enumerate(ports):
+                        tk.Label(master=devices_frame, text=port, font=font2).grid(row=row, column=0, sticky="W")
+                        electrode_cbox = ttk.Combobox(master=devices_frame, values=elec_list, width=self.width + 5,
+                                                      state="readonly")
+                        electrode = self.device_manager.get_electrode(port)
+                        if electrode is not None:
+                            electrode_cbox.set(electrode.name)
+                        electrode_cbox.grid(row=row, column=1, padx=2)
+                        status_label = tk.Label(master=devices_frame, text="", font=font3, width=45, anchor="w")
+                        status_label.grid(row=row, column=2, sticky="W")
+                        rows[port] = (electrode_cbox, status_label)
+
+                def get_electrode(name):
+                    if self.current_electrode is not None and self.current_electrode.name == name:
+                        return self.current_electrode
+                    return self.catalog.get(name)
+
+                def run_all():
+                    try:
+                        name = experiment_name.get()
+                        if name == "":
+                            messagebox.showerror('Error', 'please add experiment name')
+                            return
+                        for port, (electrode_cbox, _) in rows.items():
+                            if electrode_cbox.get() == "" or self.device_manager.is_busy(port):
+                                continue
+                            electrode = get_electrode(electrode_cbox.get())
+                            if name not in electrode.get_experiments():
+                                electrode.create_experiment(name)
+                                self.catalog.save(electrode)
+                            self.device_manager.assign(port, electrode)
+                        started = self.device_manager.run_all(name, test_type.get(), repeats.get(), interval.get())
+                        self.print(f"{test_type.get()} started on {', '.join(started) if started else 'no device'}")
+                        skipped = [port for port, (electrode_cbox, _) in rows.items()
+                                   if electrode_cbox.get() != "" and port not in started
+                                   and not self.device_manager.is_busy(port)]
+                        if skipped:  # their electrode's test was already started on another device
+                            self.print(f"Not started on {', '.join(skipped)}: the same electrode test is running on "
+                                       f"another device")
+                    except Exception as e:
+                        self.print(e)
+                        debug()
+                        messagebox.showerror('Error', e.__str__())
+
+                def update_status():
+                    if not devices_window.winfo_exists():
+                        return
+                    progress = self.device_manager.get_progress()
+                    for port, (_, status_label) in rows.items():
+                        status = progress.get(port)
+                        if status is None or status["test"] is None:
+                            status_label["text"] = ""
+                            continue
+                        status_label["text"] = f"{status['test']} {status['state']} {status['progress']:.0%}, " \
+                                               f"{status['points_per_second']:.0f} pts/s, {status['scans']} scans, " \
+                                               f"{status['errors']} errors"
+                    devices_window.after(500, update_status)
+
+                tk.Button(master=btn_frame, text="Refresh ports", command=refresh_ports).pack(side=tk.LEFT, fill=tk.X,
+                                                                                              expand=True)
+                tk.Button(master=btn_frame, text="Run all", command=run_all).pack(side=tk.LEFT, fill=tk.X,
+                                                                                  expand=True)
+                tk.Button(master=btn_frame, text="Stop all", command=self.device_manager.stop_all).pack(
+                    side=tk.LEFT, fill=tk.X, expand=True)
+                refresh_ports()
+                update_status()
+            except Exception as e:
+                self.print(e)
+                debug()
+                messagebox.showerror('Error', e.__str__())
+
         def on_button_Toggle_fit():
             self.isHill = not self.isHill
             self.update_titration_graph = True
             self.to_update_plots = True
 
+        def on_button_Hill_intervals():
+            try:
+                hf = getattr(self, "hf", None)
+                if not self.isHill or hf is None or not hasattr(hf, "params"):
+                    messagebox.showerror('Error', "Show the Hill fit of a titration first")
+                    return
+                intervals = hf.confidence_intervals(n_resamples=1000)
+                if "ec50" not in intervals:
+                    messagebox.showerror('Error', "No resampled fit converged")
+                    return
+                self.print(f"Hill fit, 95% bootstrap intervals of {len(intervals['samples'])} refits "
+                           f"({intervals['failed']} failed): k {intervals['ec50'][0]:.3E} to {intervals['ec50'][1]:.3E}, "
+                           f"n {intervals['nH'][0]:.3} to {intervals['nH'][1]:.3}")
+                self.calibration = Calibration.from_hill(hf)  # the export adds the intervals of the concentrations
+                if self.raw_data_df is not None and len(self.raw_data_df) > 0 and self.test_cBox.get() != 'CV':
+                    # selected scan, normalized to the first one like the whole series
+                    peak_currents = self.raw_data_df['peak_current'].to_numpy(dtype=float)[[0, self.datapoint_select_N]]
+                    concentration = self.calibration.concentration(peak_currents)[1]
+                    low, high = self.calibration.concentration_interval(peak_currents)
+                    self.print(f"Scan {self.datapoint_select_N + 1}: concentration {concentration:.3E}, "
+                               f"95% interval {low[1]:.3E} to {high[1]:.3E}")
+            except Exception as e:
+                self.print(e)
+                debug()
+                messagebox.showerror('Error', e.__str__())
+
+        def on_button_Toggle_blit():
+            self.plots.set_blit(not self.plots.blit)
+            self.print(f"Blitting {'on' if self.plots.blit else 'off'}")
+            self.to_update_plots = True
+
+        def on_button_Toggle_binary():
+            Test.binary_protocol = not Test.binary_protocol
+            self.print(f"Binary serial protocol {'on' if Test.binary_protocol else 'off'}, "
+                       f"boards without it keep answering in text")
+
         def on_button_about():
             try:
                 self.print('Opening About file ...')
@@ -314,9 +455,69 @@ class App(tk.Tk):
                 debug()
                 messagebox.showerror('Error', e.__str__())
 
+        def on_button_Toggle_instrumentation():
+            Instrumentation.enable(not Instrumentation.enabled)
+            self.print(f"Pipeline instrumentation {'on' if Instrumentation.enabled else 'off'}, written to "
+                       f"{os.path.join(self.output_path, 'instrumentation.json')} every 10 s")
+
+        def on_button_profile():
+            try:
+                self.print(Instrumentation.toggle_profile(self.output_path))
+            except Exception as e:
+                self.print(e)
+                debug()
+
+        def on_button_stats():
+            try:
+                stats_window = tk.Toplevel(master=self)
+                stats_window.title("Pipeline stats")
+                columns = ("count", "mean", "p50", "p90", "p99", "max")
+                tree = ttk.Treeview(master=stats_window, columns=columns, height=25)
+                tree.heading("#0", text="Stage")
+                tree.column("#0", width=220)
+                for column in columns:
+                    tree.heading(column, text=column if column == "count" else f"{column} (ms)")
+                    tree.column(column, width=80, anchor="e")
+                tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+                state = tk.Label(master=stats_window, font=font3)
+                state.pack(side=tk.TOP, anchor="w")
+
+                def refresh():
+                    if not stats_window.winfo_exists():
+                        return
+                    snapshot = Instrumentation.snapshot()
+                    tree.delete(*tree.get_children())
+                    for stage, histogram in snapshot["stages"].items():
+                        tree.insert("", tk.END, text=stage, values=(histogram["count"], *(
+                            f"{histogram[f'{column}_ms']:.3f}" for column in columns[1:])))
+                    for stage, frame_stats in self.frame_budget.get_stats().items():
+                        if isinstance(frame_stats, dict) and "count" in frame_stats:  # measured even when disabled
+                            tree.insert("", tk.END, text=f"UI {stage}", values=(
+                                frame_stats["count"], f"{frame_stats['mean_ms']:.3f}", "", "", "",
+                                f"{frame_stats['max_ms']:.3f}"))
+                    counters = {**snapshot["counters"], **{f"analysis {name}": value for name, value
+                                                           in self.analysis.stats.items()},
+                                **{f"UI {stage} deferred": value for stage, value
+                                   in self.frame_budget.deferred.items()}}
+                    for name, value in counters.items():
+                        tree.insert("", tk.END, text=name, values=(value,))
+                    state.config(text=f"Instrumentation {'on' if snapshot['enabled'] else 'off (Help menu)'}, "
+                                      f"{self.frame_budget.over_budget} of {self.frame_budget.frames} UI frames over "
+                                      f"{self.frame_budget.budget * 1000:.0f} ms")
+                    stats_window.after(1000, refresh)
+
+                tk.Button(master=stats_window, text="Reset", command=Instrumentation.reset).pack(side=tk.LEFT)
+                refresh()
+            except Exception as e:
+                self.print(e)
+                debug()
+                messagebox.showerror('Error', e.__str__())
+
         def keyPressed(event):
             try:
-                if event.keysym == 'Left':
+                if event.keysym == 'F9':
+                    on_button_profile()
+                elif event.keysym == 'Left':
                     if not self.chkBtn_show_latest_voltammogram_var.get() and self.volta_slider.get() > 0:
                         self.volta_slider.set(self.volta_slider.get() - 1)
                 elif event.keysym == 'Right':
@@ -344,14 +545,21 @@ class App(tk.Tk):
 
         serialmenu = tk.Menu(menubar, tearoff=0)
         serialmenu.add_command(label="Change Output filepath", command=on_button_set_output_path)
+        serialmenu.add_command(label="Devices...", command=on_button_devices)
+        serialmenu.add_command(label="Toggle binary serial protocol", command=on_button_Toggle_binary)
         menubar.add_cascade(label="Tests", menu=serialmenu)
 
         Graphmenu = tk.Menu(menubar, tearoff=0)
         Graphmenu.add_command(label="Toggle Hill/Linear fit", command=on_button_Toggle_fit)
+        Graphmenu.add_command(label="Hill fit confidence intervals", command=on_button_Hill_intervals)
+        Graphmenu.add_command(label="Toggle fast rendering (blitting)", command=on_button_Toggle_blit)
         menubar.add_cascade(label="Graph", menu=Graphmenu)
 
         helpmenu = tk.Menu(menubar, tearoff=0)
         helpmenu.add_command(label="About...", command=on_button_about)
+        helpmenu.add_command(label="Toggle pipeline instrumentation", command=on_button_Toggle_instrumentation)
+        helpmenu.add_command(label="Pipeline stats...", command=on_button_stats)
+        helpmenu.add_command(label="Start/stop profiling", command=on_button_profile, accelerator="F9")
         menubar.add_cascade(label="Help", menu=helpmenu)
 
         self.config(menu=menubar)
@@ -379,8 +587,16 @@ class App(tk.Tk):
 
         self.tasks["UI"] = loop.create_task(self.update_ui_loop(interval=1 / 60), name="UI")
         time.sleep(0.005)  # small delay to let dicts init
-        self.tasks["Plot"] = loop.create_task(self.update_plot_loop(interval=1 / 60), name="Plot")
-        # self.tasks["Autosave"] = loop.create_task(self.autosave_loop(percentage_of_time=20), name="Autosave")
+        self.tasks["BLE reassembly"] = loop.create_task(self.ble_reassembly_loop(interval=0.2), name="BLE reassembly")
+        try:  # scans journaled but not saved when the app last stopped
+            self.autosave.recover(self.electrode_list, self.data_path, log=self.print)
+        except Exception as e:
+            self.print(e)
+            debug()
+        self.tasks["Autosave"] = loop.create_task(self.autosave_loop(interval=5), name="Autosave")
+        if "--instrument" in sys.argv:
+            Instrumentation.enable()
+        self.tasks["Instrumentation"] = loop.create_task(self.instrumentation_loop(interval=10), name="Instrumentation")
         #################################################################
         # Testing purposes
         self.time_type = True
@@ -492,8 +708,7 @@ class App(tk.Tk):
 
         ############################ Electrode selection with dropdown Experiment updating #############################################
         def update_electrode_list():
-            elec_list = list(os.listdir(f"{self.data_path}"))
-            self.Electrode_cBox["values"] = elec_list
+            self.Electrode_cBox["values"] = self.catalog.names()
 
         self.Electrode_cBox = ttk.Combobox(master=frameElectrodebox,
                                            values=[],
@@ -516,13 +731,13 @@ class App(tk.Tk):
         def del_electrode():
             electrode = self.current_electrode
             electrode.delete(self.data_path)
-            self.electrode_list.pop(electrode.name)
+            self.catalog.forget(electrode.name)
             self.print(f"{electrode.name} deleted successfully")
             self.Electrode_cBox.set("")
 
         def load_electrode(name):
-            with open(f"{self.data_path}\\{name}", "rb") as f:
-                self.electrode_list[name] = pickle.load(f)
+            # kept in memory while its file is unchanged, results are read from the store when a test is plotted
+            self.catalog.get(name)
 
 
         def load_titration(name):
@@ -533,10 +748,9 @@ class App(tk.Tk):
 
         def set_electrode(event):
             electrode_name = self.Electrode_cBox.get()
-            # if electrode_name not in self.electrode_list.keys():
-            #     load_electrode(electrode_name)
             load_electrode(electrode_name)
             self.current_electrode = self.electrode_list[electrode_name]
+            print_summary(electrode_name)
             self.Experiment_cBox['state'] = "active"
             self.Experiment_cBox.set("")
             self.titration_df = None
@@ -548,6 +762,18 @@ class App(tk.Tk):
             del_experiment_btn['state'] = "active"
             save_titration_btn['state'] = "active"
 
+        def print_summary(electrode_name):
+            try:
+                summary = self.catalog.summary(electrode_name)
+                experiments = []
+                for experiment_name, tests in summary["experiments"].items():
+                    scans = ", ".join(f"{test_type} {test['scans']}" for test_type, test in tests.items() if test["scans"])
+                    experiments.append(f"{experiment_name} ({scans or 'no scan'})")
+                self.print(f"{electrode_name}: {summary['scans']} scans in {len(experiments)} experiments"
+                           + (f": {'; '.join(experiments)}" if experiments else ""))
+            except Exception:
+                debug()
+
 
         def set_new_electrode():
             electrode_name = self.Electrode_cBox.get()
@@ -570,8 +796,7 @@ class App(tk.Tk):
             elif name == "":
                 messagebox.showerror('Error', f'please add electrode name')
             else:
-                self.electrode_list[name] = Electrode(name)
-                self.electrode_list[name].save(self.data_path)
+                self.catalog.save(Electrode(name))
                 self.print(f"{name} created successfully")
                 self.Electrode_cBox.set(self.electrode_list[name].name)
                 set_new_electrode()
@@ -646,14 +871,14 @@ class App(tk.Tk):
                     electrode.create_experiment(self.Experiment_cBox.get())
                     self.print(f"{name} created successfully")
                     self.Experiment_cBox.event_generate('<<ComboboxSelected>>')
-                    electrode.save(self.data_path)
+                    self.catalog.save(electrode)
 
         def del_experiment():
             name = self.Experiment_cBox.get()
             electrode = self.current_electrode
             if name in electrode.get_experiments():
                 electrode.del_experiment(name)
-                electrode.save(self.data_path)
+                self.catalog.save(electrode)
                 self.print(f"{name} deleted successfuly")
                 self.Experiment_cBox.set("")
                 self.titration_df = None
@@ -724,9 +949,10 @@ class App(tk.Tk):
 
         def set_test_graph(event):
             if self.test_cBox.get() != "":
-                self.raw_data_df = self.current_electrode.get_tests(self.Experiment_cBox.get())[
-                    self.test_cBox.get()].get_df()
-                self.plots.rt_concentration_data["rt concentration"].set_data([], [])
+                test = self.current_electrode.get_tests(self.Experiment_cBox.get())[self.test_cBox.get()]
+                self.plot_cache.bind(test)
+                self.raw_data_df = test.get_df()
+                self.plots.rt_lines["rt concentration"].set_data([], [])
                 self.update_raw_data_graph = True
                 self.to_update_plots = True
 
@@ -892,68 +1118,52 @@ class App(tk.Tk):
         def Create_SWV():
             Update_test_variable_frame(self.current_electrode.get_tests(self.Experiment_cBox.get())["SWV"])
 
-        def run_test_thread(test, comport):
-            self.thread_result = test.run_test(comport, 115200)
-
-        def handle_test_results_delayed(test):
-            while self.thread_result == -1:
-                app.update()  # Allow the GUI to update
-                time.sleep(0.1)  # Sleep for 100ms
-            handle_test_results(test)  # Call handle_test_results once result is not -1
-            self.data_received = True
-
-        def handle_test_results(test):
-            if self.thread_result == 1:
-                self.current_electrode.save(self.data_path)
-                self.print("Test ran successfully")
-                app.update()
+        def handle_test_results(device_id, electrode, test, result):
+            # called by device_results_loop, the device manager already saved the electrode
+            if result == 1:
+                self.print(f"Test ran successfully on {device_id}")
             elif not self.continuous_running:
-                messagebox.showerror('Error 2', self.thread_result.__str__())
+                messagebox.showerror('Error 2', result.__str__())
             else:
-                if self.thread_result == "Test stopped by user":
-                    messagebox.showerror('Error', self.thread_result.__str__())
+                if result == "Test stopped by user":
+                    messagebox.showerror('Error', result.__str__())
                 else:
-                    print('Error', self.thread_result.__str__())
-            self.thread_result = -1
-            self.Experiment_cBox.event_generate('<<ComboboxSelected>>')
-            self.Titration_cBox.event_generate('<<ComboboxSelected>>')
-            self.test_cBox.event_generate('<<ComboboxSelected>>')
-            self.volta_slider.set(len(test.get_df()) + 1)
+                    print('Error', result.__str__())
+            if electrode is self.current_electrode:
+                self.Experiment_cBox.event_generate('<<ComboboxSelected>>')
+                self.Titration_cBox.event_generate('<<ComboboxSelected>>')
+                self.test_cBox.event_generate('<<ComboboxSelected>>')
+                self.volta_slider.set(len(test.get_df()) + 1)
+
+        self.handle_test_results = handle_test_results
+
+        def start_test(test: Test, repeats: int = 1, interval: float = 0.0):
+            param = dict([(p[0], p[1].get()) for p in self.test_params.items()])
+            test.update_param(param)
+            comport = self.comport_cbox.get()
+            if self.device_manager.is_busy(comport):
+                messagebox.showerror('Error 1', f"A test is already running on {comport}")
+                return
+            running = self.device_manager.get_running_device(test)
+            if running is not None:
+                messagebox.showerror('Error 1', f"This test is already running on {running}")
+                return
+            self.device_manager.assign(comport, self.current_electrode)
+            self.device_manager.run(comport, self.Experiment_cBox.get(), test.type, repeats, interval)
 
         def run_test(test: Test):
             try:
-                self.thread_result == -1
-                self.data_received = False
-                param = dict([(p[0], p[1].get()) for p in self.test_params.items()])
-                test.update_param(param)
-                comport = self.comport_cbox.get()
-                threading.Thread(target=run_test_thread, args=(test, comport)).start()
-                handle_test_results_delayed(test)
+                start_test(test)
             except Exception as e:
                 messagebox.showerror('Error 1', e.__str__())
 
         def run_continuous_test(test:Test):
-            test.stop_continuous = False
-            self.continuous_running = True
-
-            def update_gui():
-                app.update()
-
-            def run_test_and_update_gui():
-                try:
-                    run_test(test)
-                    update_gui()
-                    index = 0
-                    if index < test.get_params()["RunTime"] and not test.stop_continuous:
-                        while self.data_received == False:
-                            pass
-                        app.after(3000, run_test_and_update_gui)  # Schedule the next run
-                    else:
-                        self.continuous_running = False
-                except Exception as e:
-                    messagebox.showerror('Error 1', e.__str__())
-
-            run_test_and_update_gui()  # Start the continuous test
+            try:
+                self.continuous_running = True
+                start_test(test, repeats=int(self.test_params["RunTime"].get()), interval=3)
+            except Exception as e:
+                self.continuous_running = False
+                messagebox.showerror('Error 1', e.__str__())
 
         frameTest_params_params.pack(side=tk.TOP, fill=tk.BOTH, expand=False)
         frameTest_params_btn.pack(side=tk.TOP, fill=tk.BOTH, expand=False)
@@ -1004,6 +1214,7 @@ class App(tk.Tk):
         self.time_changed_threshold = 0
 
         # create an object, but not connect yet
+        import BLE_connector_Bleak
         self.BLE_connector_instance = BLE_connector_Bleak.BLE_connector(to_connect=False)
         await self.start_scanning_process()
         await self.BLE_connector_instance.keep_connections_to_device(uuids=uuids_default,
@@ -1034,16 +1245,31 @@ class App(tk.Tk):
         try:
             time_delivered = datetime.datetime.now(datetime.timezone.utc)
             if data_joined:
-                data_joined = data_joined
-                time_best_effort = time_delivered
-            else:
-                status, transaction = self.process_packet(data=data, time_delivered=time_delivered)
-                if status != 0:  # Transaction is not complete
-                    return
+                self.add_SWV_data(sender, data_joined, time_delivered)
+                return
+            # packets may arrive reordered or get lost, the reassembler emits complete transactions, and partial ones
+            # once they timed out (see ble_reassembly_loop) or fell out of its window
+            self.ble_sender = sender
+            self.handle_transactions(sender, self.process_packet(data=data, time_delivered=time_delivered))
+        except ValueError as e:
+            self.print(e)
+            debug()
+        except Exception as e:
+            self.print(e)
+            debug()
+            messagebox.showerror('Error', e.__str__())
 
-                data_joined = transaction.get_joined_data()
-                if data_joined is None:
-                    return
+    def handle_transactions(self, sender, transactions: list):
+        """Adds the data of transactions emitted by the reassembler, oldest first"""
+        try:
+            for transaction in transactions:
+                data_joined = self.reassembler.get_values(transaction, 3)
+                missing = transaction.get_missing_packets()
+                if missing:
+                    self.print(f"Transaction {transaction.transaction_number} incomplete, packets {missing} lost")
+                if data_joined is None:  # the zeros of lost packets are not measurements
+                    self.print(f"Transaction {transaction.transaction_number} discarded, its values were lost")
+                    continue
 
                     # Time can only increment. If it decremented, it likely means BlueNRG chip rebooted.
                 if self.last_transaction_time <= transaction.get_min_time_of_transaction_creation():
@@ -1061,11 +1287,22 @@ class App(tk.Tk):
                         self.print(temp)
                     else:
                         self.print("Likely stale data, discarding Transaction")
-                        return
+                        continue
                 self.last_transaction_time = transaction.get_min_time_of_transaction_creation()
 
                 time_best_effort = transaction.get_min_time_of_transaction_creation() + self.offest_time
+                self.add_SWV_data(sender, data_joined, time_best_effort)
+
+        except ValueError as e:
+            self.print(e)
+            debug()
+        except Exception as e:
+            self.print(e)
+            debug()
+            messagebox.showerror('Error', e.__str__())
 
+    def add_SWV_data(self, sender, data_joined, time_best_effort):
+        try:
             if sender not in self.SwiftMote_df.get_df_list():  # if data recieved from this sender very first time, create new Dataframe
                 self.SwiftMote_df.add_dataframe(sender)
 
@@ -1088,296 +1325,270 @@ class App(tk.Tk):
             debug()
             messagebox.showerror('Error', e.__str__())
 
-    def process_packet(self, data, time_delivered):
-        """Processes a packet and returns transaction when finalized
-        Worst part of the code, needs to be optimized, but I don't know how"""
-        transaction_finished = None
-
-        if "transaction_in_progress" not in dir(self):  # if not defined, create new transaction
-            self.transaction_in_progress = Transaction()  # Transaction object, called only when the app starts
-        #  -1: transaction is complete, -2: transaction was just completed because new transaction code was detected
-        if self.transaction_in_progress.add_packet(data=data, time_delivered=time_delivered) in [-1, -2]:
-            # if error, maybe it is beginning of a new transaction? Try to add packet second time
-            transaction_finished = self.transaction_in_progress  # save reference of the previous transaction that has completed
-            self.transaction_in_progress = Transaction()  # create a new Transaction object, used in the following transactions
-            # -2 should never happen
-            if self.transaction_in_progress.add_packet(data=data, time_delivered=time_delivered) == -1:
-                # self.print("Error of starting new transaction, datahex: ", datahex)
-                return -1, None
-
-        if transaction_finished is not None and transaction_finished.finalized:
-            return 0, transaction_finished
-        if self.transaction_in_progress.finalized:  # Will execute only if 1 packet was expected, in theory
-            return 0, self.transaction_in_progress
-        else:
-            # self.print("Transaction is not complete yet")
-            return -2, None
+    async def ble_reassembly_loop(self, interval):
+        """Emits the BLE transactions that timed out, also when packets stopped arriving
 
-    async def update_plot_loop(self, interval):
-        """Updates plots inside UI, at regular intervals
-
-        param interval: minimum time between 2 updates, time of execution is taken in account
+        param interval: minimum time between 2 polls, time of execution is taken in account
         """
-        self.print('Plotting started')
         waiter = StableWaiter(interval=interval)
         while True:
             try:
                 await waiter.wait_async()
+                if "reassembler" in dir(self) and self.reassembler.in_flight:
+                    self.handle_transactions(self.ble_sender, self.reassembler.poll())
+            except Exception as e:
+                self.print(e)
+                debug()
 
-                if self.to_update_plots is False:
-                    # optimization to prevent re-drawing when there is no new data or when plotting is paused
-                    continue
-                self.to_update_plots = False
-                ######################################## Titration Graph ###################################################
-                if self.titration_df is not None:
-                    if self.plots.prev_min_pt is not None:
-                        Plot.prev_min_pt = self.plots.min_pt
-                    if self.plots.prev_max_pt is not None:
-                        self.plots.max_pt = Plot.prev_max_pt
-
-                    if self.update_titration_graph:
-                        concentration = list(self.titration_df['concentration'])
-                        max_gain = []
-                        for i in range(len(self.titration_df['raw_voltages'].iloc[:])):
-                            g = self.titration_df['peak_current'].iloc[i]
-                            max_gain.append(g)
-                        # normalized
-                        first_peak_value = max_gain[0]
-                        max_gain = [x / first_peak_value for x in max_gain]
-                        max_gain = [(x-1)*100 for x in max_gain]
-                        if self.isHill:
-                            if concentration[concentration.index(self.plots.min_pt)] < concentration[
-                                concentration.index(self.plots.max_pt)]:
-                                self.hf = HillFit(concentration[
-                                                  concentration.index(self.plots.min_pt):concentration.index(
-                                                      self.plots.max_pt) + 1],
-                                                  max_gain[concentration.index(self.plots.min_pt):concentration.index(
-                                                      self.plots.max_pt) + 1])
-                                self.hf.fitting()
-                            else:
-                                conc = concentration[concentration.index(self.plots.min_pt):concentration.index(
-                                    self.plots.max_pt) + 1]
-                                gain = max_gain[concentration.index(self.plots.min_pt):concentration.index(
-                                    self.plots.max_pt) + 1]
-                                gain.reverse()
-                                self.hf = HillFit(conc, gain)
-                                self.hf.fitting()
-                                self.hf.y_fit = np.flip(self.hf.y_fit)
-
-                            self.plots.titration_data["titration"].set_data(concentration, max_gain)
+    def process_packet(self, data, time_delivered):
+        """Processes a packet and returns the transactions it finalized, see TransactionReassembler.get_stats()
+        for the loss, duplicate and latency counters"""
+        if "reassembler" not in dir(self):  # if not defined, create the reassembler, called only when the app starts
+            self.reassembler = TransactionReassembler()
+        Instrumentation.count("BLE bytes", len(data))
+        started = Instrumentation.start()
+        transactions = self.reassembler.add_packet(data=data, time_delivered=time_delivered)
+        Instrumentation.stop("BLE packet decode", started)
+        return transactions
+
+    def fit_hill_async(self, start: int, stop: int, reverse: bool):
+        """Fits a range of the titration in the analysis pool, the titration graph is updated when the fit is done.
+        Only the range selected last is drawn, fits of ranges left meanwhile are dropped"""
+        key = self.fit_cache.get_key(start, stop, reverse)
+        if key == self.pending_fit:
+            return
+
+        def on_done(result):
+            self.pending_fit = None
+            if result.error is not None:
+                self.print(f"Hill fit failed: {result.error}")
+                return
+            self.fit_cache.add(key, result.value)
+            self.update_titration_graph = True
+            self.to_update_plots = True
+
+        self.pending_fit = key
+        self.analysis.submit("hill", *self.fit_cache.prepare_hill(start, stop, reverse), key="titration fit",
+                             on_done=on_done)
+
+    def import_CH(self, test_type: str):
+        """Imports a CH Instruments folder in the analysis executor, the UI stays responsive meanwhile"""
+        try:
+            selected = ask_CH_files(test_type)  # dialogs stay on the UI thread
+            if selected is None:
+                return
+            data_path, concentration_list = selected
+            self.print(f"Importing {data_path} ...")
+
+            def on_done(result):  # the catalog reads the imported electrodes again from their new files
+                if result.error is not None:
+                    self.print(result.error)
+                    messagebox.showerror('Error', result.error.__str__())
+
+            self.analysis.submit("import", data_path, self.data_path, test_type, concentration_list,
+                                 log=self.analysis.log, on_done=on_done)
+        except Exception as e:
+            self.print(e)
+            debug()
+            messagebox.showerror('Error', e.__str__())
+
+    def update_plots(self):
+        """Updates plots inside UI, called by the frames of update_ui_loop when there is something new to show"""
+        try:
+            self.to_update_plots = False
+            redraw_started = Instrumentation.start()
+            ######################################## Titration Graph ###################################################
+            if self.titration_df is not None:
+                if self.plots.prev_min_pt is not None:
+                    Plot.prev_min_pt = self.plots.min_pt
+                if self.plots.prev_max_pt is not None:
+                    self.plots.max_pt = Plot.prev_max_pt
+
+                if self.update_titration_graph:
+                    self.plots.invalidate()  # the titration graph is part of the static background
+                    # gains normalized to the first peak, fits of the ranges already shown come from the cache
+                    self.fit_cache.set_titration(self.titration_df['concentration'],
+                                                 Calibration.normalize(self.titration_df['peak_current']))
+                    concentration, max_gain = self.fit_cache.concentration, self.fit_cache.gain
+                    start = self.fit_cache.index(self.plots.min_pt)
+                    stop = self.fit_cache.index(self.plots.max_pt)
+                    if self.isHill:
+                        reverse = not concentration[start] < concentration[stop]
+                        hf = self.fit_cache.lookup_hill(start, stop, reverse)
+                        self.plots.titration_data["titration"].set_data(concentration, max_gain)
+                        if hf is None:  # fitted in the analysis pool, the graph is updated again when done
+                            self.fit_hill_async(start, stop, reverse)
+                            self.plots.titration_data["fit"].set_data([], [])
+                            self.plots.titration_data["fit"].set_label("Fitting...")
+                        else:
+                            self.hf = hf
+                            self.calibration = Calibration.from_hill(self.hf)
                             self.plots.titration_data["fit"].set_data(self.hf.x_fit, self.hf.y_fit)
                             self.plots.titration_data["fit"].set_label(
                                 f"$R^2$={self.hf.r_2:.3}, k ={self.hf.ec50:.3E}, n ={self.hf.nH:.3E}")
-                            self.plots.titration_data["lims"].set_data([self.plots.min_pt, self.plots.max_pt], [
-                                max_gain[concentration.index(self.plots.min_pt)],
-                                max_gain[concentration.index(self.plots.max_pt)]])
-                            self.plots.titration_data["lims"].set_label(f"Hill limits")
+                        self.plots.titration_data["lims"].set_data([self.plots.min_pt, self.plots.max_pt], [
+                            max_gain[start], max_gain[stop]])
+                        self.plots.titration_data["lims"].set_label(f"Hill limits")
 
-                        else:
-                            self.linear_coefs = np.polyfit(concentration[
-                                                           concentration.index(self.plots.min_pt):concentration.index(
-                                                               self.plots.max_pt) + 1], max_gain[concentration.index(
-                                self.plots.min_pt):concentration.index(self.plots.max_pt) + 1], 1)
-                            fit_for_r2 = list(np.polyval(self.linear_coefs, concentration[concentration.index(
-                                self.plots.min_pt):concentration.index(self.plots.max_pt) + 1]))
-                            r_2 = r2_score(max_gain[concentration.index(self.plots.min_pt):concentration.index(
-                                self.plots.max_pt) + 1], fit_for_r2)
-                            self.plots.titration_data["titration"].set_data(concentration, max_gain)
-                            self.plots.titration_data["fit"].set_data(concentration[concentration.index(
-                                self.plots.min_pt):concentration.index(self.plots.max_pt) + 1], fit_for_r2)
-                            self.plots.titration_data["fit"].set_label(
-                                f"$R^2$={r_2:.3},a={self.linear_coefs[0]:.3}, b ={self.linear_coefs[1]:.3E}")
-                            self.plots.titration_data["lims"].set_data([self.plots.min_pt, self.plots.max_pt], [
-                                max_gain[concentration.index(self.plots.min_pt)],
-                                max_gain[concentration.index(self.plots.max_pt)]])
-                            self.plots.titration_data["lims"].set_label(f"Linear limits")
-
-                        max_x = np.max(max_gain)
-                        min_x = np.min(max_gain)
-                        max_concentration = np.max(concentration)
-                        min_concentration = np.min(concentration)
-
-                        self.plots.titration.set_ylim(min_x - abs(min_x / 3), max_x + abs(min_x / 3))
-                        self.plots.titration.set_xlim(min_concentration - abs(min_concentration / 3),
-                                                      max_concentration + abs(min_concentration / 3))
-                        self.plots.titration.legend().set_visible(True)
-                else:
-                    self.plots.reset_titration_graph()
-                ##################################################### voltammogram Graph #######################################################
-                if self.raw_data_df is not None and len(self.raw_data_df) != 0:
-                    length = len(self.raw_data_df)
-                    if self.chkBtn_show_latest_voltammogram_var.get():
-                        self.datapoint_select_N = length - 1
-                        self.volta_slider.set(self.datapoint_select_N + 1)
-                        self.volta_slider.config(state="disabled", sliderlength=0)
-                        self.volta_slider_text.config(text=f"{length}/{length}")
                     else:
-                        self.volta_slider.config(state="active")
-                        self.volta_slider.config(to=length, sliderlength=30, showvalue=False)
-                        self.datapoint_select_N = self.volta_slider.get() - 1 if len(self.raw_data_df) > 0 else 0
-                        self.volta_slider_text.config(text=f"{self.datapoint_select_N + 1}/{length}")
-
-                    ################################################ change time format on axes ###################################
-                    if self.update_raw_data_graph == True:
-                        self.plots.rt_concentration.get_xaxis().set_major_formatter(
-                            matplotlib.dates.DateFormatter('%y-%m-%d %H:%M:%S', tz=tz.gettz('America/Montreal')))
-                        self.plots.rt_peak.get_xaxis().set_major_formatter(
-                            matplotlib.dates.DateFormatter('', tz=tz.gettz('America/Montreal')))
-                        _time = self.raw_data_df['time'].tolist()
-
-                        ############################################### Voltammogram Graph ######################################
-                        # try:
-                        self.plots.volt_graph_data["raw_data"].set_data(
-                            self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25:],
-                            self.raw_data_df['raw_currents'].iloc[self.datapoint_select_N][25:])
+                        self.linear_coefs, fit_for_r2, r_2 = self.fit_cache.get_linear(start, stop)
+                        self.calibration = Calibration.from_linear(self.linear_coefs,
+                                                                   concentration[start:stop + 1])
+                        self.plots.titration_data["titration"].set_data(concentration, max_gain)
+                        self.plots.titration_data["fit"].set_data(concentration[start:stop + 1], fit_for_r2)
+                        self.plots.titration_data["fit"].set_label(
+                            f"$R^2$={r_2:.3},a={self.linear_coefs[0]:.3}, b ={self.linear_coefs[1]:.3E}")
+                        self.plots.titration_data["lims"].set_data([self.plots.min_pt, self.plots.max_pt], [
+                            max_gain[start], max_gain[stop]])
+                        self.plots.titration_data["lims"].set_label(f"Linear limits")
+
+                    max_x = np.max(max_gain)
+                    min_x = np.min(max_gain)
+                    max_concentration = np.max(concentration)
+                    min_concentration = np.min(concentration)
+
+                    self.plots.titration.set_ylim(min_x - abs(min_x / 3), max_x + abs(min_x / 3))
+                    self.plots.titration.set_xlim(min_concentration - abs(min_concentration / 3),
+                                                  max_concentration + abs(min_concentration / 3))
+                    self.plots.titration.legend().set_visible(True)
+            else:
+                self.plots.reset_titration_graph()
+            ##################################################### voltammogram Graph #######################################################
+            if self.raw_data_df is not None and len(self.raw_data_df) != 0:
+                length = len(self.raw_data_df)
+                if self.chkBtn_show_latest_voltammogram_var.get():
+                    self.datapoint_select_N = length - 1
+                    self.volta_slider.set(self.datapoint_select_N + 1)
+                    self.volta_slider.config(state="disabled", sliderlength=0)
+                    self.volta_slider_text.config(text=f"{length}/{length}")
+                else:
+                    self.volta_slider.config(state="active")
+                    self.volta_slider.config(to=length, sliderlength=30, showvalue=False)
+                    self.datapoint_select_N = self.volta_slider.get() - 1 if len(self.raw_data_df) > 0 else 0
+                    self.volta_slider_text.config(text=f"{self.datapoint_select_N + 1}/{length}")
+
+                ################################################ change time format on axes ###################################
+                if self.update_raw_data_graph == True:
+                    self.plots.rt_concentration.get_xaxis().set_major_formatter(
+                        matplotlib.dates.DateFormatter('%y-%m-%d %H:%M:%S', tz=tz.gettz('America/Montreal')))
+                    self.plots.rt_peak.get_xaxis().set_major_formatter(
+                        matplotlib.dates.DateFormatter('', tz=tz.gettz('America/Montreal')))
+                    _time = self.raw_data_df['time'].tolist()
+
+                    ############################################### Voltammogram Graph ######################################
+                    # try:
+                    self.plots.volt_graph_data["raw_data"].set_data(
+                        self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25:],
+                        self.raw_data_df['raw_currents'].iloc[self.datapoint_select_N][25:])
 
-                        try:
-                            self.plots.volt_graph_data["smooth_data"].set_data(
-                                self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25:],
-                                self.raw_data_df['smooth_data'].iloc[self.datapoint_select_N][25:])
-                            if len(self.plots.volt_graph_data["smooth_data"].get_xdata()) != len(self.plots.volt_graph_data["smooth_data"].get_ydata()):
-                                self.plots.volt_graph_data["smooth_data"].set_data([],[])
-                        except:
-                            print("No smooth data")
-
-
-                        baseline = []
-                        normalized_gain = []
-                        for i in range(len(self.raw_data_df['raw_voltages'].iloc[:])):
-                            baseline.append(list(np.polyval(self.raw_data_df['baseline'].iloc[i],
-                                                            self.raw_data_df['raw_voltages'].iloc[i])))
-                            normalized_gain.append(list(np.polyval(self.raw_data_df['normalized_gain'].iloc[i],
-                                                                   self.raw_data_df['raw_voltages'].iloc[i])))
-
-                        self.plots.volt_graph_data["baseline"].set_data(
+                    try:
+                        self.plots.volt_graph_data["smooth_data"].set_data(
                             self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25:],
-                            baseline[self.datapoint_select_N][25:])
+                            self.raw_data_df['smooth_data'].iloc[self.datapoint_select_N][25:])
+                        if len(self.plots.volt_graph_data["smooth_data"].get_xdata()) != len(self.plots.volt_graph_data["smooth_data"].get_ydata()):
+                            self.plots.volt_graph_data["smooth_data"].set_data([],[])
+                    except:
+                        print("No smooth data")
 
-                        # self.plots.gain_data["Gain"].set_data(self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N],normalized_gain[self.datapoint_select_N])
 
-                        # Red line to show peak on voltammogram
-                        index = normalized_gain[self.datapoint_select_N].index(max(normalized_gain[self.datapoint_select_N]))
+                    # baseline, gain and extrema are evaluated once per scan by the plot cache
+                    derived = self.plot_cache.get_rows(self.raw_data_df)
+                    extrema = self.plot_cache.get_extrema(self.raw_data_df)
 
-                        self.plots.volt_graph.set_xlim(
-                            self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25],
-                            self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][-1])
+                    self.plots.volt_graph_data["baseline"].set_data(
+                        self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25:],
+                        derived[self.datapoint_select_N]["baseline"][25:])
 
+                    # self.plots.gain_data["Gain"].set_data(self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N],derived[self.datapoint_select_N]["gain"])
 
-                        max_raw_current = [max(raw_curr[25:]) for raw_curr in self.raw_data_df['raw_currents']]
-                        min_raw_current = [min(raw_curr[25:]) for raw_curr in self.raw_data_df['raw_currents']]
-                        max_gain = [max(gain) for gain in normalized_gain]
-                        min_gain = [min(gain) for gain in normalized_gain]
-                        self.plots.gain_data['PeakX'].set_data(
-                            [self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N],
-                             self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N]],
-                            [min(min_gain), max(max_gain)])
+                    self.plots.volt_graph.set_xlim(
+                        self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][25],
+                        self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][-1])
 
-                        self.plots.volt_graph.set_ylim(min(min_raw_current), max(max_raw_current))
-                        self.plots.gain.set_ylim(min(min_gain), max(max_gain))
+                    # Red line to show peak on voltammogram
+                    self.plots.gain_data['PeakX'].set_data(
+                        [self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N],
+                         self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N]],
+                        [extrema["min_gain"], extrema["max_gain"]])
 
-                else:
-                    self.plots.reset_rt_graphs()
-                    self.volta_slider_text.config(text="No data in dataframe")
-                    self.volta_slider.config(state="disabled", sliderlength=0)
-                    self.plots.canvas.draw()
-                    pass
+                    self.plots.volt_graph.set_ylim(extrema["min_current"], extrema["max_current"])
+                    self.plots.gain.set_ylim(extrema["min_gain"], extrema["max_gain"])
 
-                ###############################################  rt Graphs ####################################################
-                if self.raw_data_df is not None and len(self.raw_data_df) != 0 and self.titration_df is not None:
-                    if self.update_titration_graph == True or self.update_raw_data_graph == True:
-                        h0 = []
-                        h1 = []
-                        _time = self.raw_data_df['time'].tolist()
-                        for heights in list(self.raw_data_df['half_heigths'][:]):
-                            h0.append(heights[0])
-                            h1.append(heights[1])
-                        _peak_voltage = list(self.raw_data_df['peak_voltage'][:])
-                        _half_height0 = h0
-                        _half_height1 = h1
-                        self.plots.rt_peak_data["rt Peaks"].set_data(_time, _peak_voltage)
-                        self.plots.rt_peak_data["rt Peaks max"].set_data(_time, _half_height0)
-                        self.plots.rt_peak_data["rt Peaks min"].set_data(_time, _half_height1)
-                        self.plots.rt_peak.set_xlim(min(_time), max(_time))
-                        self.plots.rt_peak.set_ylim(self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][0],
-                                                    self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][-1])
-
-                        ########################################## rt Concentration ##########################################
-                        if self.test_cBox.get() != 'CV':
-                            try:
-                                real_concentration = []
-                                _t = []
-                                first = True
-                                for i in range(len(self.raw_data_df['raw_voltages'].iloc[:])):
-                                    # normalized_gain = list(np.polyval(self.raw_data_df['normalized_gain'].iloc[i], self.raw_data_df['raw_voltages'].iloc[i]))
-                                    # maximum_gain = np.max(normalized_gain)
-                                    #
-                                    baseline = list(np.polyval(self.raw_data_df['baseline'].iloc[i],
-                                                               self.raw_data_df['raw_voltages'].iloc[i]))
-                                    # g = self.raw_data_df['peak_current'].iloc[i] - baseline[
-                                    #     list(self.raw_data_df['raw_currents'].iloc[i]).index(
-                                    #         self.raw_data_df['peak_current'].iloc[i])]
-                                    g = self.raw_data_df['peak_current'].iloc[i] #- baseline[list(self.raw_data_df['raw_currents'].iloc[i]).index(self.raw_data_df['peak_current'].iloc[i])]
-
-                                    maximum_gain = g
-
-                                    if first:
-                                        first_peak_value = maximum_gain
-                                        first = False
-                                    # normalized
-                                    maximum_gain = maximum_gain/first_peak_value
-                                    maximum_gain = (maximum_gain - 1)*100
-
-                                    if self.isHill:
-                                        top, bottom, ec50, nH = self.hf.params
-                                        if bottom <= maximum_gain <= top:
-                                            if not np.isnan(ec50 * (((bottom - maximum_gain) / (maximum_gain - top)) ** (1 / nH))):
-                                                real_concentration.append(ec50 * (((bottom - maximum_gain) / (maximum_gain - top)) ** (1 / nH)))
-                                                _t.append(_time[i])
-                                        print("Max_gain :", maximum_gain)
-                                        print("Concentration :",ec50 * (((bottom - maximum_gain) / (maximum_gain - top)) ** (1 / nH)) )
-                                    else:
-                                        c = (maximum_gain - self.linear_coefs[1]) / self.linear_coefs[0]
-                                        real_concentration.append(c)
-                                        _t.append(_time[i])
-
-                                    if self.test_cBox.get() == 'SWV':
-                                        try:
-                                            self.raw_data_df['concentration'].iloc[i] = real_concentration[-1]
-                                        except IndexError:
-                                            pass
-                                if len(real_concentration) > 0:
-                                    self.plots.rt_concentration.set_ylim(min(real_concentration),
-                                                                         max(real_concentration))
-                                    self.plots.rt_concentration.set_xlim(min(_t), max(_t))
-                                    self.plots.rt_peak.set_xlim(min(_t), max(_t))
-                                    self.plots.rt_concentration_data["rt concentration"].set_data(_t,real_concentration)
-
-                            except Exception:
-                                debug()
-                                pass
-                self.update_titration_graph = False
-                self.update_raw_data_graph = False
-                self.plots.fig.tight_layout()
-                ############################################ Axes settings ##################################################
-
-                if self.toggle_cursor:
-                    self.cursors_v['peak_voltage_3'].set_data(
-                        [self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N],
-                         self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N]], [0, 1])
+            else:
+                self.plots.reset_rt_graphs()
+                self.volta_slider_text.config(text="No data in dataframe")
+                self.volta_slider.config(state="disabled", sliderlength=0)
+                self.plots.canvas.draw()
+                pass
 
-                    self.cursors_h['peak_current_3'].set_data(
-                        [0, 1],
-                        [self.raw_data_df['peak_current'].iloc[self.datapoint_select_N],
-                         self.raw_data_df['peak_current'].iloc[self.datapoint_select_N]])
+            ###############################################  rt Graphs ####################################################
+            if self.raw_data_df is not None and len(self.raw_data_df) != 0 and self.titration_df is not None:
+                if self.update_titration_graph == True or self.update_raw_data_graph == True:
+                    # the full series are kept by rt_lines, which only draw a few points per pixel column
+                    _time = self.raw_data_df['time'].to_numpy(dtype=float)
+                    _half_heights = [heights for heights in self.raw_data_df['half_heigths']]
+                    self.plots.rt_lines["rt Peaks"].set_data(_time, self.raw_data_df['peak_voltage'])
+                    self.plots.rt_lines["rt Peaks max"].set_data(_time, [heights[0] for heights in _half_heights])
+                    self.plots.rt_lines["rt Peaks min"].set_data(_time, [heights[1] for heights in _half_heights])
+                    self.plots.rt_peak.set_xlim(np.nanmin(_time), np.nanmax(_time))
+                    self.plots.rt_peak.set_ylim(self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][0],
+                                                self.raw_data_df['raw_voltages'].iloc[self.datapoint_select_N][-1])
+
+                    ########################################## rt Concentration ##########################################
+                    if self.test_cBox.get() != 'CV' and self.calibration is not None:
+                        try:
+                            # the calibration converts the peak currents of new scans only, the cache is dropped
+                            # when the calibration changes. Concentrations of SWV scans are not stored: the
+                            # export computes them from the same Calibration
+                            concentrations = self.plot_cache.get_concentrations(self.raw_data_df, self.calibration)
+                            known = ~np.isnan(concentrations)
+                            real_concentration = concentrations[known]
+                            _t = _time[known]
+                            if len(real_concentration) > 0:
+                                self.plots.rt_concentration.set_ylim(np.min(real_concentration),
+                                                                     np.max(real_concentration))
+                                self.plots.rt_lines["rt concentration"].set_data(_t, real_concentration)
+                                self.plots.rt_concentration.set_xlim(np.min(_t), np.max(_t))
+                                self.plots.rt_peak.set_xlim(np.min(_t), np.max(_t))
+
+                        except Exception:
+                            debug()
+                            pass
+            self.update_titration_graph = False
+            self.update_raw_data_graph = False
+            ############################################ Axes settings ##################################################
+
+            if self.toggle_cursor:
+                self.cursors_v['peak_voltage_3'].set_data(
+                    [self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N],
+                     self.raw_data_df['peak_voltage'].iloc[self.datapoint_select_N]], [0, 1])
+
+                self.cursors_h['peak_current_3'].set_data(
+                    [0, 1],
+                    [self.raw_data_df['peak_current'].iloc[self.datapoint_select_N],
+                     self.raw_data_df['peak_current'].iloc[self.datapoint_select_N]])
+        except Exception as e:
+            debug()
+            pass
+        else:
+            try:
+                self.plots.render()  # full layout and draw only when axes ranges or the window size changed
+                Instrumentation.stop("plot redraw", redraw_started)
             except Exception as e:
                 debug()
                 pass
-            else:
-                try:
-                    self.plots.canvas.draw()
-                except Exception as e:
-                    debug()
-                    pass
+
+    def handle_device_results(self, deadline: float):
+        """Hands the sweeps finished by the device manager to the GUI until deadline (at least one per call),
+        the others wait for the next frames"""
+        self.device_results.extend(self.device_manager.poll_results())
+        handled = 0
+        while self.device_results and (not handled or time.perf_counter() < deadline):
+            self.handle_test_results(*self.device_results.pop(0))
+            handled += 1
+        if self.continuous_running and not self.device_results and not any(
+                self.device_manager.is_busy(device_id) for device_id in list(self.device_manager.devices)):
+            self.continuous_running = False
 
     async def update_ui_loop(self, interval):
         """Updates UI, at regular intervals
@@ -1389,7 +1600,19 @@ class App(tk.Tk):
         while True:
             try:
                 await waiter.wait_async()
-                self.update()
+                # one frame: Tk events, then finished sweeps and analysis results and the plot redraw while the
+                # frame budget lasts, what doesn't fit is handed over in the next frames
+                deadline = self.frame_budget.start()
+                with self.frame_budget.measure("events"):
+                    self.update()
+                with self.frame_budget.measure("devices"):
+                    self.handle_device_results(deadline)
+                with self.frame_budget.measure("analysis results"):
+                    self.analysis.poll(deadline)
+                if self.to_update_plots and self.frame_budget.should_run("plot"):
+                    with self.frame_budget.measure("plot"):
+                        self.update_plots()
+                self.frame_budget.end()
             except Exception as e:
                 self.print(e)
                 debug()
@@ -1436,57 +1659,48 @@ class App(tk.Tk):
                 # debug()
                 # messagebox.showerror('Error', e.__str__())
 
-    async def autosave_loop(self, percentage_of_time):
-        """Automatically saves data to file, at regular intervals
+    async def autosave_loop(self, interval):
+        """Journals the scans not yet saved to the electrode stores, at regular intervals
 
-        param interval: minimum time between 2 updates, time of execution is taken in account
+        param interval: minimum time between 2 checkpoints, time of execution is taken in account
         """
         self.print('Auto save loop started')
-
-        waiter = StableWaiter(percentage_of_time=percentage_of_time)
-        i = 0
+        waiter = StableWaiter(interval=interval)
         while True:
             try:
-                await waiter.wait_async_constant_avg_time()
-                temp = [datetime.datetime.now().strftime('%x %X'), 'Autosaving...', i]
-                self.print(temp)
-                i += 1
-
-                date = datetime.datetime.now().strftime('%Y-%m-%d')
-                if date not in os.listdir(f"{self.output_path}"):
-                    os.mkdir(f"{self.output_path}\\{date}")
-                    os.makedirs(f"{self.output_path}\\{date}\\titrations")
-                    os.makedirs(f"{self.output_path}\\{date}\\experiments")
-                    os.makedirs(f"{self.output_path}\\{date}\\SW_experiments")
-
-                save_temp = {}
-                for df in self.curr_Titration_df.get_df_list():
-                    save_temp[df] = self.curr_Titration_df.get_df_data(df).to_dict(orient='index')
-                with open(f"{self.output_path}\\{date}\\titrations\\autosave.json",
-                          'w') as f:  # overwrite previous autosave
-                    json.dump(save_temp, f, indent=4, default=str)
-                    f.close()
-
-                save_temp = {}
-                for df in self.curr_Experiment_df.get_df_list():
-                    save_temp[df] = self.curr_Experiment_df.get_df_data(df).to_dict(orient='index')
-                with open(f"{self.output_path}\\{date}\\experiments\\autosave.json",
-                          'w') as f:  # overwrite previous autosave
-                    json.dump(save_temp, f, indent=4, default=str)
-                    f.close()
-
-                save_temp = {}
-                for df in self.SwiftMote_df.get_df_list():
-                    save_temp[df] = self.SwiftMote_df.get_df_data(df).to_dict(orient='index')
-                with open(f"{self.output_path}\\{date}\\SW_experiments\\autosave.json",
-                          'w') as f:  # overwrite previous autosave
-                    json.dump(save_temp, f, indent=4, default=str)
-                    f.close()
+                await waiter.wait_async()
+                electrodes = dict(self.electrode_list)
+                for device_id in list(self.device_manager.devices):  # electrodes running a test may not be selected
+                    electrode = self.device_manager.get_electrode(device_id)
+                    if electrode is not None:
+                        electrodes[electrode.name] = electrode
+                # only the new scans are written, but fsync can take a while: kept off the Tk thread
+                await self.loop.run_in_executor(None, self.autosave.checkpoint, electrodes,
+                                                self.device_manager.get_save_lock)
+            except Exception as e:
+                self.print(e)
+                debug()
+
+    async def instrumentation_loop(self, interval):
+        """Writes the pipeline stats to instrumentation.json in the output folder while instrumentation is on
 
+        param interval: minimum time between 2 dumps, time of execution is taken in account
+        """
+        waiter = StableWaiter(interval=interval)
+        while True:
+            try:
+                await waiter.wait_async()
+                if not Instrumentation.enabled:
+                    continue
+                extra = {"ui_frames": self.frame_budget.get_stats(), "analysis": dict(self.analysis.stats),
+                         "devices": self.device_manager.get_progress()}
+                if "reassembler" in dir(self):
+                    extra["ble"] = self.reassembler.get_stats()
+                await self.loop.run_in_executor(None, Instrumentation.dump,
+                                                os.path.join(self.output_path, "instrumentation.json"), extra)
             except Exception as e:
                 self.print(e)
                 debug()
-                messagebox.showerror('Error', e.__str__())
 
     def print(self, txt):
         self.info_screen.config(state='normal')
@@ -1508,6 +1722,7 @@ class App(tk.Tk):
 
 class BLE_connector:
     def __init__(self, address="", to_connect=True):
+        import bleak
         importlib.reload(bleak)  # to prevent deadlock
         self.address = address
         self.to_connect = to_connect
@@ -1589,6 +1804,7 @@ class BLE_connector:
     # def detection_callback(device, advertisement_data):
     #    print(device.address, "RSSI:", device.rssi, advertisement_data)
     async def start_scanning(self):
+        import bleak
         try:
             dict_of_devices = {}
 
@@ -1719,7 +1935,7 @@ class StableWaiter:
         """Waits constant average time as a percentage of total execution time
         O(1) avg difficulty, used to accelerate O(N^2) or worse algorithms by running them less frequently as N increases
         This is not mandatory, but makes UI smoother
-        Can be roughly simplified with asyncio.sleep(interval), for example, it is used by autosaving in this app"""
+        Can be roughly simplified with asyncio.sleep(interval)"""
 
         t2 = datetime.datetime.now(datetime.timezone.utc)
         previous_frame_time = ((t2 - self.t1).total_seconds())
@@ -1728,167 +1944,11 @@ class StableWaiter:
         await asyncio.sleep(previous_frame_time / self.duty_cycle - previous_frame_time)
 
 
-class Packet:
-    transaction_number_bytes = 1  # use 1 byte to represent transaction field
-    packet_number_bytes = 1  # use 1 byte to represent packet field
-    time_number_bytes = 4  # 4*1-byte fields represent time: hours, minutes, seconds, microseconds
-    metadata_length_total_bytes = transaction_number_bytes + packet_number_bytes + time_number_bytes
-    datapoint_length_bytes = 2  # each data point is 2 bytes
-
-    def __init__(self, data: bytearray, time_delivered):
-        """Parse packet"""
-        self.data = data
-        self.time_delivered = time_delivered
-        # self.datahex=data.hex()
-
-        # self.print(data.hex())
-
-        self.transaction_number = struct.unpack('<B', self.data[0:0 + self.transaction_number_bytes])[0]
-        self.packet_number = struct.unpack('<B', self.data[1:1 + self.packet_number_bytes])[0]
-        time_packet_created = struct.unpack('<BBBB', self.data[2:2 + self.time_number_bytes])[::-1]
-        # time_packet_created.reverse()
-        # self.print(time_transmitted)
-
-        # transmit only 24 hours of time, year/month/date is not transmitted since experiment lasts only 6 hours,
-        # modify if longer interval is needed with no added jitter,
-        # but it is not required since overflow will lead to auto adjustment of offset
-        self.time_created = datetime.datetime(year=2000, month=1, day=1,
-                                              hour=time_packet_created[0],
-                                              minute=time_packet_created[1],
-                                              second=time_packet_created[2],
-                                              microsecond=round(
-                                                  1000000 * (math.pow(2, 8) - time_packet_created[3] - 1) /
-                                                  (math.pow(2, 8) + 1)
-                                              ),
-                                              tzinfo=datetime.timezone.utc
-                                              )  # .timestamp()
-        # cself.print(self.time_transmitted_datetime)
-
-        length = len(data) - self.metadata_length_total_bytes  # 2 bytes are metadata
-        number_of_datapoints = math.floor(length / self.datapoint_length_bytes)  # 2 bytes per datapoint
-
-        self.datapoints = [-1] * number_of_datapoints  # initialize list of datapoints
-
-        for i in range(number_of_datapoints):
-            self.datapoints[i] = struct.unpack('<H',
-                                               self.data[
-                                               self.metadata_length_total_bytes + self.datapoint_length_bytes * i:
-                                               self.metadata_length_total_bytes + self.datapoint_length_bytes * (i + 1)
-                                               ])[0]
-
-    def get_datapoints(self):
-        """Data load of the BLE packet"""
-        return self.datapoints
-
-
-class Transaction:
-    """One indivisible piece of useful data
-    2 modes of operation:
-    1) Size is known
-    2) Size is unknown
-    """
-
-    def __init__(self, size=0):
-        self.size = size
-        self.packets: {Packet} = {}
-        self.transaction_number = -1
-        self.finalized = False
-
-    def add_packet(self, data: bytearray, time_delivered):
-        if self.finalized:
-            # self.print("Error, this transaction is already finalized")
-            return -1
-
-        packet = Packet(data=data, time_delivered=time_delivered)  # create a Packet object
-
-        if self.transaction_number == -1:
-            # self.print("First packet of new transaction received")
-            self.transaction_number = packet.transaction_number
-
-        if self.transaction_number == packet.transaction_number:
-            # self.print("Adding new packet")
-            if packet.packet_number not in self.packets:
-                self.packets[packet.packet_number] = packet
-            else:
-                self.print("Error, this packet was already received")
-                return -1
-        else:
-            if self.size != 0:  # if size is not set, estimate number of packets.
-                self.print("Transaction probably finished successfully")
-                self.finalized = True
-                self.size = len(self.packets)
-                self.print("Transaction size")
-                return -2
-            else:
-                self.print("Error, Transaction number is different, this should never happen")
-                return -1
-
-        if len(self.packets) == self.size:
-            self.print("Transaction finished successfully")
-            self.finalized = True
-            return 0
-        else:
-            return 1  # continue waiting for more packets
-
-    def get_joined_data(self):
-        try:
-            if self.finalized:
-                all_datapoints = []
-                for i in range(self.size):
-                    all_datapoints.extend(self.packets[i].get_datapoints())
-
-                # removes 0s at the end, hopefully it does not delete useful data
-                while len(all_datapoints) >= 1 and all_datapoints[-1] == 0:
-                    all_datapoints.pop(-1)
-
-                self.print(all_datapoints)
-
-                return all_datapoints
-            else:
-                # self.print("Error, not finalized yet")
-                return None
-        except Exception:
-            return None
-
-    def get_times_of_delivery(self):
-        # should be in ascending order, but no checks are done
-        if self.finalized:
-            all_times_of_delivery = {}
-            for i in range(self.size):
-                all_times_of_delivery[i] = self.packets[i].time_delivered
-            return all_times_of_delivery
-        else:
-            # self.print("Error, not finalized yet")
-            return None
-
-    def get_min_time_of_transaction_delivery(self):
-        if self.finalized:
-            return min(self.get_times_of_delivery().values())
-        else:
-            return None
-
-    def get_times_of_packet_creation(self):  # for debugging
-        # should be in ascending order, but no checks are done
-        if self.finalized:
-            all_times_of_transmitting = {}
-            for i in range(self.size):
-                all_times_of_transmitting[i] = self.packets[i].time_created
-            return all_times_of_transmitting
-        else:
-            # self.print("Error, not finalized yet")
-            return None
-
-    def get_min_time_of_transaction_creation(self):
-        if self.finalized:
-            return min(self.get_times_of_packet_creation().values())
-        else:
-            return None
-
-    def print(self, all_datapoints):
-        pass
-
-
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # the analysis process pool, in the .exe built by pyinstaller
     loop = asyncio.get_event_loop()
     app = App(loop)
+    if "--profile-startup" in sys.argv:
+        app.update()
+        Startup_profiler.report("first window")
     loop.run_forever()
\ No newline at end of file
@@ -1,18 +1,20 @@
+import copy
 import datetime
-from tkinter import messagebox
 import pandas as pd
-import serial
 from Data_processing import extract_gains
+from Serial_acquisition import get_device
+from Results_buffer import ResultsBuffer
 from Utils import debug
+import Instrumentation
 import time
 import numpy as np
-from tqdm import tqdm
-from progress.bar import Bar
-from alive_progress import alive_bar
 
 epsilon = 1e-30
 
 class Test:
+    binary_protocol = False  # ask the board for binary frames, boards answering in text are still understood
+    gains_function = None  # extracts the gains of new sweeps, e.g. in the analysis process pool, extract_gains if None
+
     def __init__(self, test_type: str):
         self.type = test_type
         self.stop_test_flag = False
@@ -26,20 +28,48 @@ class Test:
             "Rload": 10,
             "Rtia": 0
         }
-        self.results = pd.DataFrame(
-            columns=[
-                "time",
-                "raw_voltages",
-                "raw_currents",
-                "baseline",
-                "normalized_gain",
-                "peak_voltage",
-                "peak_current",
-                "half_heigths",
-                "smooth_data",
-                "concentration",
-                "frequency"
-            ])
+        self.results = ResultsBuffer()
+        self.unsaved = []  # indices added since the last write to the electrode's ExperimentStore
+
+    def __setstate__(self, state: dict):
+        if "results" in state:  # pickled before results were kept in the electrode's ExperimentStore
+            state["_results"] = state.pop("results")
+            state.setdefault("unsaved", list(state["_results"].index))
+        if isinstance(state.get("_results"), pd.DataFrame):  # pickled before results were kept in a ResultsBuffer
+            state["_results"] = ResultsBuffer.from_df(state["_results"])
+        state.setdefault("_load_results", None)
+        self.__dict__.update(state)
+
+    @property
+    def results(self) -> ResultsBuffer:
+        """Results are loaded from the ExperimentStore the first time they are needed"""
+        if self._results is None:
+            self._results = self._load_results() if self._load_results is not None else ResultsBuffer()
+            self._load_results = None
+        return self._results
+
+    @results.setter
+    def results(self, results: ResultsBuffer):
+        self._results = results
+        self._load_results = None
+
+    def attach_store(self, load_results):
+        """Defers loading of the results to the first access, load_results returns a ResultsBuffer"""
+        self._results = None
+        self._load_results = load_results
+
+    def get_row(self, index: int) -> dict:
+        return self.results.row(index)
+
+    def pop_unsaved(self) -> list:
+        unsaved, self.unsaved = self.unsaved, []  # swapped first, an index added meanwhile by a device is not lost
+        return list(dict.fromkeys(unsaved))  # an index rewritten twice is stored once
+
+    def without_results(self) -> "Test":
+        """Shallow copy holding only the parameters, pickled by Electrode.save"""
+        test = copy.copy(self)
+        test._results, test._load_results, test.unsaved = None, None, []
+        return test
 
     def update_param(self, params: dict) -> bool:
         try:
@@ -55,33 +85,76 @@ class Test:
         return self.results.index
 
     def get_df(self) -> pd.DataFrame:
-        return self.results
+        """DataFrame view of the results, built only when asked for and cached until the next scan"""
+        return self.results.get_df()
 
     def add_result(self, index: int, _time: float, _voltage: list[float], _current: list[float], frequency: float,
-                   concentration: float = None) -> int:
+                   concentration: float = None, gains: dict = None) -> int:
+        """gains can hold the output of extract_gains when it was already computed, e.g. in a worker process"""
+        started = Instrumentation.start()
         try:
-            data = extract_gains(_voltage, _current)
-            self.results.loc[index] = [
-                _time,
-                _voltage,
-                _current,
-                list(data["baseline coefs"]),
-                list(data["gain coefs"]),
-                data["peak voltage"],
-                data["peak current"],
-                data["half-height voltages"],
-                list(data["smooth_data"]),
-                concentration,
-                frequency
-            ]
-            self.results.sort_index(axis=0, inplace=True)
+            if gains is None:
+                gains_started = Instrumentation.start()
+                gains = (self.gains_function or extract_gains)(_voltage, _current)
+                Instrumentation.stop("extract_gains", gains_started)
+            data = gains
+            self.results.add(index, {
+                "time": _time,
+                "raw_voltages": _voltage,
+                "raw_currents": _current,
+                "baseline": list(data["baseline coefs"]),
+                "normalized_gain": list(data["gain coefs"]),
+                "peak_voltage": data["peak voltage"],
+                "peak_current": data["peak current"],
+                "half_heigths": data["half-height voltages"],
+                "smooth_data": list(data["smooth_data"]),
+                "concentration": concentration,
+                "frequency": frequency
+            })
+            self.unsaved.append(index)
+            Instrumentation.stop("add_result", started)
             return 1
         except Exception:
             return debug()
 
-    def run_test(self, comport, baudrate):
+    def run_test(self, comport, baudrate, on_record=None):
         pass
 
+    def get_command(self, test_name: str) -> str:
+        """Command string sent to the board, e.g. "SWV,E1:0,E2:200,...", ending with ",Binary:1" in binary mode"""
+        command = test_name + "," + ",".join(f"{param}:{value}" for param, value in self.parameters.items())
+        return command + ",Binary:1" if self.binary_protocol else command
+
+    def acquire(self, comport, baudrate, command: str, on_record=None):
+        """Runs one sweep on the board and waits for its "Done" marker.
+        Returns the time, voltage and current lists, or None if the test was stopped by the user"""
+        device = get_device(comport, baudrate)
+        run = device.start_run(command, binary=self.binary_protocol)
+        _time = []
+        _voltage = []
+        _current = []
+        for record in run.iter_records(stop=lambda: self.stop_test_flag):
+            if isinstance(record, tuple):
+                _time.append(record[0])
+                _voltage.append(record[1])
+                _current.append(record[2])
+                count = 1
+            else:  # number of records added by the binary decoder
+                count = record
+            if on_record is not None:
+                for i in range(count):
+                    on_record()
+        if self.stop_test_flag:
+            device.abort(run)
+            return None
+        if run.binary:
+            if run.decoder.crc_errors:
+                print(f"{run.decoder.crc_errors} frames failed the CRC check")
+            return tuple(values.astype(float).tolist() for values in run.decoder.get_records())
+        if run.dropped_lines:
+            print(f"{run.dropped_lines} lines could not be parsed")
+        return _time, _voltage, _current
+
     def stop_test(self):
         self.stop_test_flag = True
         self.stop_continuous = True
@@ -102,52 +175,33 @@ class Titration(Test):
         self.parameters.update({"Amplitude": 50})
         self.parameters.update({"Concentration": 0})
 
-    def run_test(self, comport, baudrate):
+    def run_test(self, comport, baudrate, on_record=None):
         self.stop_test_flag = False  # Reset the stop flag before running the test
         self.get_steps()
         try:
             dt = datetime.datetime.now()
             dt_float = float(dt.timestamp())
             dt = float(dt_float / 86400)
-            ser = serial.Serial(port=comport, baudrate=baudrate)
-            ser.read_all()
-            data = "SWV,"
 
             if self.parameters["Concentration"] <= 0.0:
                 return "Please enter a concentration bigger than zero"
             else:
                 print(f"Titration data:")
                 for param, value in self.parameters.items():
-                    data = data + f"{param}:{value},"
                     print(f"{param}:{value},")
 
-                self.get_steps()
-
-                data = data[:-1]
-                ser.write(data.encode())
-                _time = []
-                _voltage = []
-                _current = []
-                _index = self.results.shape[0]
+                _index = len(self.results)
+                from alive_progress import alive_bar  # console progress bar, only imported when a titration runs
                 with alive_bar(self.steps) as bar:
-                    while not self.stop_test_flag:
-                        try:
-                            if int(ser.inWaiting()) > 0:
-                                line = ser.read(size=ser.inWaiting()).decode()
-                                #print(line)
-                                if line.find("Done") >= 0:
-                                    break
-                                elif line.find("time:") >= 0:
-                                    lst = line.split(",")
-                                    _time.append(float(lst[0].split(":")[1]))
-                                    _voltage.append(float(lst[1].split(":")[1]))
-                                    _current.append(float(lst[2].split(":")[1].strip()))
-                                    bar()
-                        except Exception as e:
-                            return e
-                if self.stop_test_flag:
+                    def on_point():
+                        bar()
+                        if on_record is not None:
+                            on_record()
+                    data = self.acquire(comport, baudrate, self.get_command("SWV"), on_record=on_point)
+                if data is None:
                     self.stop_test_flag = False
                     return "Test stopped by user"
+                _time, _voltage, _current = data
                 return self.add_result(_index, dt, _voltage, _current, self.parameters["Frequency"],
                                        self.parameters["Concentration"])
         except Exception as e:
@@ -162,39 +216,23 @@ class CV(Test):
         self.parameters.update({"vertex2": 200})
         self.parameters.update({"Cycles": 1})
 
-    def run_test(self, comport, baudrate):
+    def run_test(self, comport, baudrate, on_record=None):
         ## do the experiment
+        self.stop_test_flag = False  # Reset the stop flag before running the test
         dt = datetime.datetime.now()
         dt = float(dt.timestamp() / 86400)
-        ser = serial.Serial(port=comport, baudrate=baudrate)
-        ser.read_all()
-        data = "CV,"
         print(f"CV data:")
         for param, value in self.parameters.items():
-            data = data + f"{param}:{value},"
             print(f"{param}:{value},")
-        data = data[:-1]
-        ser.write(data.encode())
-        _time = []
-        _voltage = []
-        _current = []
-        _index = self.results.shape[0]
-        while 1:
-            try:
-                if int(ser.inWaiting()) > 0:
-                    line = ser.read(size=ser.inWaiting()).decode()
-                    if line.find("Done") >= 0:
-                        break
-                    elif line.find("experiment Starting") >= 0:
-                        experiment_started = True
-                    elif line.find("time:") >= 0:
-                        lst = line.split(",")
-                        _time.append(float(lst[0].split(":")[1]))
-                        _voltage.append(float(lst[1].split(":")[1]))
-                        _current.append(float(lst[2].split(":")[1].strip()))
-
-            except Exception:
-                return debug()
+        _index = len(self.results)
+        try:
+            data = self.acquire(comport, baudrate, self.get_command("CV"), on_record=on_record)
+        except Exception:
+            return debug()
+        if data is None:
+            self.stop_test_flag = False
+            return "Test stopped by user"
+        _time, _voltage, _current = data
         return self.add_result(_index, dt, _voltage, _current, self.parameters["Frequency"])
 
 
@@ -206,54 +244,20 @@ class SWV(Test):
         self.parameters.update({"RunTime": 10})
 
 
-    def run_test(self, comport, baudrate):
+    def run_test(self, comport, baudrate, on_record=None):
         ## do the experiment
         self.stop_test_flag = False  # Reset the stop flag before running the test
         dt = datetime.datetime.now()
         dt = float(dt.timestamp() / 86400)
-        ser = serial.Serial(port=comport, baudrate=baudrate)
-        ser.read_all()
-        data = "SWV,"
-        # print(f"SWV data:")
-        for param, value in self.parameters.items():
-            data = data + f"{param}:{value},"
-        #     print(f"{param}:{value},")
-        data = data[:-1]
-        ser.write(data.encode())
-        _time = []
-        _voltage = []
-        _current = []
-        _index = self.results.shape[0]
-        while not self.stop_test_flag:
-            try:
-                if int(ser.inWaiting()) > 0:
-                    data = ser.read(size=ser.inWaiting()).decode()
-                    lines = data.split('\n')
-
-                    for line in lines:
-                        line = line.strip()
-                        if "Done" in line:
-                            return self.add_result(_index, dt, _voltage, _current, self.parameters["Frequency"])
-                        elif "time:" in line:
-                            lst = line.split(",")
-                            _time.append(float(lst[0].split(":")[1]))
-                            _voltage.append(float(lst[1].split(":")[1]))
-                            print("voltage: ", float(lst[1].split(":")[1]))
-                            _current_value = lst[2].split(":")[1].strip()  # Remove unwanted characters
-                            # Try to convert the cleaned string to a float
-                            try:
-                                _current.append(float(_current_value))
-                            except ValueError:
-                                print('VALUE ERROR')
-                                print(_current_value)
-                                print(_current_value.split("/"))
-                        else:
-                            break
-            except Exception:
-                return debug()
-        if self.stop_test_flag:
+        _index = len(self.results)
+        try:
+            data = self.acquire(comport, baudrate, self.get_command("SWV"), on_record=on_record)
+        except Exception:
+            return debug()
+        if data is None:
             self.stop_test_flag = False
             return "Test stopped by user"
+        _time, _voltage, _current = data
         return self.add_result(_index, dt, _voltage, _current, self.parameters["Frequency"])
 
 
@@ -0,0 +1,123 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import Analysis
+import Export
+
+# Command line interface of the headless analysis, e.g.
+#   python swiftmote.py process <CH folder> --type Titration --concentrations <file>
+#   python swiftmote.py fit E1_sensor E1_sensor_25Hz --range 0.5 500
+#   python swiftmote.py export --output output --calibrate E1_sensor E1_sensor_25Hz [--bootstrap 1000]
+
+
+def process(args) -> int:
+    electrodes = Analysis.import_ch(args.folder, args.data, args.type, args.concentrations, args.workers)
+    if electrodes is None:
+        return 1
+    print(f"{len(electrodes)} electrodes updated in {args.data}: {', '.join(electrodes)}")
+    return 0
+
+
+def get_fit(args, electrode_name: str, experiment_name: str):
+    electrode = Analysis.load_electrodes(args.data, [electrode_name]).get(electrode_name)
+    if electrode is None:
+        return None
+    if experiment_name not in electrode.get_experiments():
+        logging.getLogger("SwiftMote").error(f"{electrode_name} has no experiment {experiment_name}, "
+                                             f"experiments: {', '.join(electrode.get_experiments())}")
+        return None
+    return Analysis.fit_titration(electrode.get_tests(experiment_name)["Titration"].get_df(), not args.linear,
+                                  args.range, getattr(args, "bootstrap", 0))
+
+
+def fit(args) -> int:
+    result = get_fit(args, args.electrode, args.experiment)
+    if result is None:
+        return 1
+    calibration = result["calibration"]
+    summary = {"model": calibration.kind,
+               "params": dict(zip(("top", "bottom", "ec50", "nH") if calibration.kind == "Hill" else ("a", "b"),
+                                  calibration.params)),
+               "r_2": result["r_2"],
+               "points": len(result["concentration"]),
+               "concentration_range": calibration.concentration_range}
+    intervals = result["intervals"]
+    if intervals is not None and "ec50" in intervals:
+        summary["intervals"] = {name: intervals[name] for name in ("top", "bottom", "ec50", "nH")}
+        summary["failed_refits"] = intervals["failed"]
+    if args.json:
+        print(json.dumps(summary, indent=1))
+    else:
+        print(f"{summary['model']} fit of {summary['points']} points, R²={summary['r_2']:.4f}")
+        for name, value in summary["params"].items():
+            interval = summary.get("intervals", {}).get(name)
+            print(f"  {name} = {value:.6g}" + (f"  [{interval[0]:.6g}, {interval[1]:.6g}]" if interval else ""))
+    return 0
+
+
+def export(args) -> int:
+    calibration = None
+    if args.calibrate is not None:
+        result = get_fit(args, *args.calibrate)
+        if result is None:
+            return 1
+        calibration = result["calibration"]
+    electrodes = Analysis.load_electrodes(args.data, args.electrodes)
+    if not electrodes:
+        logging.getLogger("SwiftMote").error(f"No electrode to export in {args.data}")
+        return 1
+    paths = Analysis.export_csv(electrodes, args.output, args.columns, calibration, args.format)
+    for path in paths.values():
+        print(path)
+    return 0 if paths else 1
+
+
+def main(argv=None) -> int:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--data", default=os.path.join(os.getcwd(), "data"), help="folder of the electrodes")
+    common.add_argument("-v", "--verbose", action="store_true", help="log progress")
+    arg_parser = argparse.ArgumentParser(prog="swiftmote", description="SwiftMote analysis without the GUI")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    process_parser = commands.add_parser("process", parents=[common],
+                                         help="import a folder of CH Instruments files, extracting gains")
+    process_parser.add_argument("folder")
+    process_parser.add_argument("--type", choices=("SWV", "Titration"), default="SWV")
+    process_parser.add_argument("--concentrations", help="concentration file, required for titrations")
+    process_parser.add_argument("--workers", type=int, default=None, help="worker processes, 1 to use none")
+    process_parser.set_defaults(function=process)
+
+    fit_parser = commands.add_parser("fit", parents=[common], help="fit the titration of an experiment")
+    fit_parser.add_argument("electrode")
+    fit_parser.add_argument("experiment")
+    fit_parser.add_argument("--linear", action="store_true", help="linear fit instead of Hill")
+    fit_parser.add_argument("--range", nargs=2, type=float, metavar=("LOW", "HIGH"), help="concentrations to fit")
+    fit_parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                            help="95%% confidence intervals of the Hill parameters from N resampled refits")
+    fit_parser.add_argument("--json", action="store_true")
+    fit_parser.set_defaults(function=fit)
+
+    export_parser = commands.add_parser("export", parents=[common],
+                                        help="export the results to CSV or parquet files like the GUI")
+    export_parser.add_argument("--electrodes", nargs="+", help="all electrodes by default")
+    export_parser.add_argument("--output", default=os.path.join(os.getcwd(), "output"))
+    export_parser.add_argument("--columns", nargs="+", help="parameters to export, all by default")
+    export_parser.add_argument("--format", choices=list(Export.formats), default="csv",
+                               help="parquet needs pyarrow")
+    export_parser.add_argument("--calibrate", nargs=2, metavar=("ELECTRODE", "EXPERIMENT"),
+                               help="titration used to convert SWV peak currents to concentrations")
+    export_parser.add_argument("--linear", action="store_true", help="linear calibration instead of Hill")
+    export_parser.add_argument("--range", nargs=2, type=float, metavar=("LOW", "HIGH"))
+    export_parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                               help="adds the 95%% intervals of the concentrations, from N resampled Hill refits")
+    export_parser.set_defaults(function=export)
+
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s: %(message)s")
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import random
+import unittest
+import numpy as np
+from BLE_packets import TransactionReassembler
+
+# python -m unittest test_BLE_packets
+
+
+def make_packet(transaction: int, packet: int, points: int = 4) -> bytearray:
+    """Packet of a transaction created at 12:00:00, datapoints encode (transaction, packet, point)"""
+    values = np.array([transaction * 1000 + packet * 10 + i + 1 for i in range(points)], dtype='<u2')
+    return bytearray([transaction % 256, packet, 255, 0, 0, 12]) + bytearray(values.tobytes())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def get_stream(transactions: int, size: int) -> list:
+    return [(transaction, packet) for transaction in range(transactions) for packet in range(size)]
+
+
+class TestTransactionReassembler(unittest.TestCase):
+
+    def feed(self, reassembler: TransactionReassembler, stream: list, clock: Clock) -> list:
+        emitted = []
+        for transaction, packet in stream:
+            clock.now += 0.01
+            emitted += reassembler.add_packet(make_packet(transaction, packet), None)
+        clock.now += reassembler.timeout + 0.01  # packets stopped arriving, the GUI timer polls
+        emitted += reassembler.poll()
+        return emitted
+
+    def test_in_order(self):
+        for size in (0, 3):  # learned or given
+            clock = Clock()
+            reassembler = TransactionReassembler(size=size, clock=clock)
+            emitted = self.feed(reassembler, get_stream(12, 3), clock)
+            self.assertEqual([transaction.transaction_number for transaction in emitted], list(range(12)))
+            self.assertTrue(all(not transaction.get_missing_packets() for transaction in emitted))
+            self.assertEqual(reassembler.counters["complete"], 12)
+            self.assertEqual(reassembler.counters["late"], 0)
+            self.assertEqual(len(emitted[0].get_joined_data()), 12)
+
+    def test_reordered(self):
+        stream = get_stream(30, 4)
+        rng = random.Random(1)  # packets moved by up to 5 places, the first, whole transaction gives the size
+        stream = stream[:4] + [item for _, item in sorted(
+            (position + rng.uniform(-5, 5), item) for position, item in enumerate(stream[4:]))]
+        clock = Clock()
+        reassembler = TransactionReassembler(window=6, clock=clock)
+        emitted = self.feed(reassembler, stream, clock)
+        self.assertEqual([transaction.transaction_number for transaction in emitted], list(range(30)))
+        self.assertTrue(all(not transaction.get_missing_packets() for transaction in emitted))
+        self.assertEqual(reassembler.counters["late"], 0)
+        self.assertGreater(reassembler.counters["reordered"], 0)
+
+    def test_lossy(self):
+        stream = [item for item in get_stream(20, 3) if item not in ((0, 2), (5, 1), (9, 2))]
+        stream += [(7, 0)]  # duplicate
+        clock = Clock()
+        reassembler = TransactionReassembler(size=3, clock=clock)
+        emitted = self.feed(reassembler, stream, clock)
+        self.assertEqual([transaction.transaction_number for transaction in emitted], list(range(20)))
+        missing = {transaction.transaction_number: transaction.get_missing_packets() for transaction in emitted
+                   if transaction.get_missing_packets()}
+        self.assertEqual(missing, {0: [2], 5: [1], 9: [2]})
+        self.assertEqual(reassembler.counters["lost_packets"], 3)
+        data = emitted[5].get_joined_data()
+        self.assertEqual(len(data), 12)
+        self.assertFalse(data[4:8].any())
+        self.assertTrue(emitted[5].gap_mask[4:8].all())
+        self.assertFalse(emitted[5].gap_mask[:4].any())
+        self.assertFalse(emitted[5].gap_mask[8:].any())
+        self.assertEqual(reassembler.counters["duplicates"] + reassembler.counters["late"], 1)
+
+    def test_partial_first_transaction_does_not_shrink_size(self):
+        stream = [item for item in get_stream(6, 4) if item != (0, 3)]  # first transaction lost its last packet
+        clock = Clock()
+        reassembler = TransactionReassembler(clock=clock)
+        emitted = self.feed(reassembler, stream, clock)
+        self.assertEqual([transaction.transaction_number for transaction in emitted], list(range(6)))
+        self.assertEqual(reassembler.counters["late"], 0)
+        self.assertTrue(all(transaction.size == 4 for transaction in emitted[1:]))
+        self.assertTrue(all(not transaction.get_missing_packets() for transaction in emitted[1:]))
+
+    def test_lost_first_packet_is_discarded(self):
+        stream = [item for item in get_stream(4, 3) if item not in ((1, 2), (2, 0))]
+        clock = Clock()
+        reassembler = TransactionReassembler(size=3, clock=clock)
+        emitted = self.feed(reassembler, stream, clock)
+        values = [reassembler.get_values(transaction, 3) for transaction in emitted]
+        self.assertEqual(emitted[2].get_missing_packets(), [0])
+        self.assertTrue(emitted[2].gap_mask[:4].all())
+        self.assertIsNone(values[2])
+        self.assertEqual(values[1].tolist(), [1001, 1002, 1003])  # partial, its values are in packet 0
+        self.assertEqual(values[3].tolist(), [3001, 3002, 3003])
+        self.assertEqual(reassembler.counters["discarded"], 1)
+
+    def test_lost_transactions(self):
+        stream = [item for item in get_stream(10, 2) if item[0] != 4]
+        clock = Clock()
+        reassembler = TransactionReassembler(size=2, clock=clock)
+        emitted = self.feed(reassembler, stream, clock)
+        self.assertEqual([transaction.transaction_number for transaction in emitted], [0, 1, 2, 3, 5, 6, 7, 8, 9])
+        self.assertEqual(reassembler.counters["lost_transactions"], 1)
+
+    def test_timeout_without_new_packets(self):
+        clock = Clock()
+        reassembler = TransactionReassembler(clock=clock)
+        self.assertEqual(self.feed(reassembler, get_stream(1, 3), clock)[0].size, 3)
+        self.assertEqual(reassembler.poll(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
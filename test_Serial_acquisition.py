@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+# python -m unittest test_Serial_acquisition
+
+
+class TestSimulatedPort(unittest.TestCase):
+
+    def test_sim_port_without_importing_simulator(self):
+        """A "sim://" port works from a fresh interpreter that never imported Simulator"""
+        code = ("import sys\n"
+                "from Tests import SWV\n"
+                "import Serial_acquisition\n"
+                "assert 'Simulator' not in sys.modules\n"
+                "test = SWV()\n"
+                "assert test.run_test('sim://b1?rate=0&seed=1', 115200) == 1, 'scan failed'\n"
+                "assert len(test.results) == 1\n"
+                "Serial_acquisition.close_all()\n")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+
+class TestPortNames(unittest.TestCase):
+
+    def test_device_manager_rejects_ble_addresses(self):
+        from Device_manager import DeviceManager
+        from Serial_acquisition import is_port_name
+        for name in ("COM3", "/dev/ttyUSB0", "sim://b1?rate=0", "socket://localhost:7777"):
+            self.assertTrue(is_port_name(name), name)
+        for name in ("FE:B7:22:CC:BA:8D", ""):
+            self.assertFalse(is_port_name(name), name)
+        with self.assertRaises(ValueError):
+            DeviceManager("data").assign("FE:B7:22:CC:BA:8D", None)
+
+
+if __name__ == "__main__":
+    unittest.main()